@@ -1,9 +1,12 @@
 """
 The main file of the maze car game server.
 """
-import log_manager
-import application_gui
 
 if __name__ == "__main__":
+	# Import in the main guard, so the spawned worker processes don't
+	# create the application again while importing this file
+	import log_manager
+	import application_gui
+
 	application_gui.start_gui()
 	log_manager.end_logger()
@@ -6,8 +6,10 @@ in the gui.
 
 import tkinter as tk
 import logging
+from functools import partial
 
 from webcam import WebCamera
+from vision_process import VisionProcess, ProcessColorPosManager
 from color_position_finder import *
 from maze_manager import MazeManager
 from widget_color_manager import ColorManagerWidget
@@ -17,9 +19,16 @@ from config_manager import ConfigManager
 from game_maze_run import GameCore, GameConsoleWidget
 
 ### Workers ###
+# Run the frame capturing and the color recognition in a worker process
+_use_vision_process = False
 _config_manager = ConfigManager("config.xml")
-_camera = WebCamera(src = 0, width = 1080, height = 720)
-_color_pos_manager = ColorPosManager(_camera, fps = 30)
+if _use_vision_process:
+	_camera = VisionProcess(partial(WebCamera, src = 0, width = 1080, height = 720), \
+		fps = 30)
+	_color_pos_manager = ProcessColorPosManager(_camera, fps = 30)
+else:
+	_camera = WebCamera(src = 0, width = 1080, height = 720)
+	_color_pos_manager = ColorPosManager(_camera, fps = 30)
 _maze_manager = MazeManager(_color_pos_manager, fps = 30)
 _game_core = GameCore(_maze_manager)
 
@@ -40,6 +49,7 @@ def start_gui():
 	except KeyboardInterrupt:
 		logger.error("User keyboard interrupt. Forcely shutdown.")
 
+	_game_core.release()
 	_camera.stop_camera_thread()
 	_camera.release_camera()
 
@@ -3,14 +3,18 @@ Find the position of the specified color in the image.
 """
 
 import cv2
-import imutils
 import numpy as np
 import logging
+import time
 from threading import Lock
-from util.job_thread import JobThread
+from util.sequence_signal import SequenceSignal
+from util import latency_monitor
 
 from point import Point2D
 from color_type import *
+from color_segmentation import MultiColorSegmenter
+from color_tracker import ColorTracker
+from frame_pipeline import FramePipeline, PipelineFrame
 
 class ColorPosition:
 	"""Data structure storing the position of the color found in the frame
@@ -51,7 +55,9 @@ class ColorPosition:
 
 		@return A clone of the ColorPosition object
 		"""
-		new_item = ColorPosition(self.color_bgr.copy())
+		# Skip __init__() to avoid converting the color again
+		new_item = ColorPosition.__new__(ColorPosition)
+		new_item.color_bgr = self.color_bgr.copy()
 		new_item.color_hsv = self.color_hsv.copy()
 		new_item.pixel_position = self.pixel_position.copy()
 		return new_item
@@ -60,38 +66,52 @@ class ColorPositionFinder:
 	"""Find the given colors in the video stream of the camera
 
 	@var _colors_to_find A list stores colors to be find in the frame
+	@var _color_index A dictionary maps the packed color to its index in
+	     _colors_to_find. It is replaced instead of being modified.
 	@var _finder_name The name of the finder
-	@var _camera The camera object for getting frames
-	@var _color_finding_thread The thread for finding colors in the frame
+	@var _frame_pipeline The FramePipeline that provides the processed frames
+	@var _is_recognition_started Is the finder consuming the frames from
+	     the _frame_pipeline?
 	@var _colors_to_find_lock The read lock of _colors_to_find
+	@var _segmenter The MultiColorSegmenter finding all the colors at once
+	@var _tracker The ColorTracker predicting the search window of each color.
+	     None if the colors are always found in the whole frame.
+	@var _new_result_signal The SequenceSignal published when the result of
+	     a new frame is written to _colors_to_find
+	@var _result_frame_seq The sequence number of the frame of the latest result
 	"""
 
-	def __init__(self, finder_name, camera, fps = 30):
+	def __init__(self, finder_name, camera, fps = 30, frame_pipeline = None, \
+		tracking = True):
 		"""Constructor
 
 		@param finder_name The name of the finder
-		@param camera Spcify the camera object
+		@param camera Spcify the FrameSource object
 		@param fps Sepcify the updating rate of the car position
+		@param frame_pipeline Specify the FramePipeline shared with other finders.
+		       If it is None, the finder will create its own pipeline from
+		       camera and fps.
+		@param tracking Specify whether to search the colors only in the
+		       windows around their predicted positions while they are tracked
 		"""
 		self._logger = logging.getLogger(self.__class__.__name__)
 
 		self._colors_to_find = []
+		self._color_index = {}
 		self._finder_name = finder_name
-		self._camera = camera
 
-		try:
-			if int(fps) < 1:
-				raise ValueError
-		except ValueError:
-			self._logger.error("Invaild fps: {0}. Set to 30.".format(fps))
-			fps = 30
+		if frame_pipeline is None:
+			frame_pipeline = FramePipeline(finder_name, camera, fps)
+		self._frame_pipeline = frame_pipeline
+		self._is_recognition_started = False
 
-		self._color_recognition_thread = JobThread(self._find_colors, \
-			"Color_{0}".format(finder_name), 1.0 / fps)
 		self._colors_to_find_lock = Lock()
+		self._segmenter = MultiColorSegmenter()
+		self._tracker = ColorTracker() if tracking else None
+		self._new_result_signal = SequenceSignal()
+		self._result_frame_seq = -1
 
-		self._logger.debug("Finder \"{0}\" is run in fps {1}." \
-			.format(finder_name, fps))
+		self._logger.debug("Finder \"{0}\" is created.".format(finder_name))
 
 	def add_target_color(self, color_b, color_g, color_r):
 		"""Add new target color to ColorPositionFinder._colors_to_find
@@ -100,11 +120,13 @@ class ColorPositionFinder:
 		@param color_g The green channel of the target color
 		@param color_r The red channel of the target color
 		"""
-		if self._color_recognition_thread.is_running:
+		if self._is_recognition_started:
 			self._logger.error("Cannot add colors while recognizing.")
 			return
 
 		self._colors_to_find.append(ColorPosition([color_b, color_g, color_r]))
+		self._update_color_index()
+		self._update_segmenter()
 		self._logger.info("New target color ({0}, {1}, {2}) " \
 			"is added to the finder \"{3}\"." \
 			.format(color_b, color_g, color_r, self._finder_name))
@@ -119,20 +141,19 @@ class ColorPositionFinder:
 		@param color_g The green channel of the target color
 		@param color_r The red channel of the target color
 		"""
-		if self._color_recognition_thread.is_running:
+		if self._is_recognition_started:
 			self._logger.error("Cannot delete colors while recognizing.")
 			return
 
-		where = -1
-		try:
-			where = self._colors_to_find.index( \
-				ColorPosition([color_b, color_g, color_r]))
-		except ValueError:
+		where = self._color_index.get(pack_color_bgr([color_b, color_g, color_r]))
+		if where is None:
 			self._logger.error("Cannot delete color ({0}, {1}, {2}). " \
 				"It is not in the finder \"{3}\"." \
 				.format(color_b, color_g, color_r, self._finder_name))
 		else:
-			self._colors_to_find.remove(self._colors_to_find[where])
+			del self._colors_to_find[where]
+			self._update_color_index()
+			self._update_segmenter()
 			self._logger.info("Target color ({0}, {1}, {2}) is deleted " \
 				"from the finder \"{3}\"." \
 				.format(color_b, color_g, color_r, self._finder_name))
@@ -150,12 +171,9 @@ class ColorPositionFinder:
 		@return A copy of ColorPosition object in the _colors_to_find if the
 		        specified color is existing
 		"""
-		where = -1
 		new_item = None
-		try:
-			where = self._colors_to_find.index( \
-				ColorPosition([color_b, color_g, color_r]))
-		except ValueError:
+		where = self._color_index.get(pack_color_bgr([color_b, color_g, color_r]))
+		if where is None:
 			self._logger.error("Color ({0}, {1}, {2}) is not in the finder \"{3}\"." \
 				.format(color_b, color_g, color_r, self._finder_name))
 			return None
@@ -177,115 +195,249 @@ class ColorPositionFinder:
 		self._colors_to_find_lock.release()
 		return copied
 
+	def get_result(self):
+		"""Get the result of the latest frame at once without copying the colors
+
+		The lists of the positions are replaced instead of being modified by
+		the later results, so they can be read without the lock.
+
+		@return (frame_seq, color_index, pixel_positions) The sequence number
+		        of the frame, the dictionary mapping the packed color to its
+		        index, and a list whose i-th element is the list of the positions
+		        in pixel of the i-th color
+		"""
+		self._colors_to_find_lock.acquire()
+		frame_seq = self._result_frame_seq
+		color_index = self._color_index
+		pixel_positions = [color.pixel_position for color in self._colors_to_find]
+		self._colors_to_find_lock.release()
+		return frame_seq, color_index, pixel_positions
+
 	def start_recognition(self):
-		"""Start a new thread to do color recognition
+		"""Start consuming the frames from the frame pipeline to do color recognition
 
-		If the color recognition thread has been started,
-		the method will do nothing.
+		If the color recognition has been started, the method will do nothing.
 		"""
-		self._color_recognition_thread.start()
+		if self._is_recognition_started:
+			return
+		if self._tracker is not None:
+			self._tracker.reset(len(self._colors_to_find))
+		self._is_recognition_started = True
+		self._frame_pipeline.add_consumer(self._find_colors)
 
 	def stop_recognition(self):
-		"""Stop the color recognition thread
+		"""Stop consuming the frames from the frame pipeline
 
-		If the color recognition thread has been stopped,
-		the method will do nothing.
+		If the color recognition has been stopped, the method will do nothing.
 		"""
-		self._color_recognition_thread.stop()
+		if not self._is_recognition_started:
+			return
+		self._frame_pipeline.remove_consumer(self._find_colors)
+		self._is_recognition_started = False
 
 	def is_recognition_thread_started(self) -> bool:
-		"""Is the color recognition thread has been started?
+		"""Is the color recognition has been started?
 
-		@return True if the color recognition thread is started,
+		@return True if the color recognition is started,
 		        otherwise, return False.
 		"""
-		return self._color_recognition_thread.is_running
-
-	def _find_colors(self):
-		def _get_detect_range(color_hsv):
-			"""Generate the detecting color range from predefined sensitivity
-
-			@param color_hsv The detecting colot in HSV domain
-			@return (lower_bound, upper_bound) The range of the detecting color
-			"""
-			# TODO The range of the detecting colors can be set on the UI
-			hue = color_hsv[0]
-			low_hue = hue - 15 if hue - 15 > -1 else 0
-			high_hue = hue + 15 if hue + 15 < 256 else 255
-			lower_bound = np.array([low_hue, 100, 180], dtype = np.uint8)
-			upper_bound = np.array([high_hue, 255, 255], dtype = np.uint8)
-			return lower_bound, upper_bound
-
-		def _find_target_color(target_frame_hsv, target_color_hsv):
-			"""Find the position of the specified color in the given frame
-
-			@param target_frame_hsv The source frame in HSV domain
-			@param target_color_hsv The color in the HSV domain to be found
-			       in the target_frame_hsv
-			@return A list of positions in pixel where the target color is at
-			        It is possible that returning an empty list
-			"""
-			lower_bound, upper_bound = _get_detect_range(target_color_hsv)
-			# Only colors in defined range will be passed
-			filtered_frame = cv2.inRange(target_frame_hsv, lower_bound, upper_bound)
-
-			# Erode and dilate the filtered result with 3 x 3 kernal
-			# to eliminate the noise
-			kernal = np.ones((3, 3), dtype = np.uint8)
-			filtered_frame = cv2.erode(filtered_frame, kernal, iterations = 1)
-			filtered_frame = cv2.dilate(filtered_frame, kernal, iterations = 1)
-			filtered_frame = cv2.GaussianBlur(filtered_frame, (5, 5), 0)
-
-			# Find contours in the final filtered frame
-			contours = cv2.findContours(filtered_frame, \
-				cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-			contours = contours[0] if imutils.is_cv2() else contours[1]
-
-			# Find center point of each contour
-			centres = []
-			for i in range(len(contours)):
-				moments = cv2.moments(contours[i])
-				centres.append(Point2D(int(moments['m10']/moments['m00']), \
-					int(moments['m01']/moments['m00'])))
-			return centres
-
-		frame = self._camera.get_frame()
-		frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-		# TODO Create multiple thread to find colors if there are
-		# too many colors to be found
-		posFound = []
+		return self._is_recognition_started
+
+	def get_result_frame_seq(self) -> int:
+		"""Get the sequence number of the frame of the latest result
+
+		@return The sequence number of the frame. -1 if there is no result yet.
+		"""
+		return self._result_frame_seq
+
+	def create_result_trigger(self, timeout = 0.1):
+		"""Create a trigger function that waits for the result of a new frame
+
+		@param timeout Specify the maximum waiting time in seconds of each call
+		@return The trigger function for the JobThread
+		@sa SequenceSignal.create_trigger()
+		"""
+		return self._new_result_signal.create_trigger(timeout)
+
+	def _update_color_index(self):
+		"""Rebuild the index from the packed color to its index in _colors_to_find
+
+		If a color is added more than once, the first one is indexed.
+		"""
+		color_index = {}
 		for i in range(len(self._colors_to_find)):
-			posFound.append(_find_target_color(frame_hsv, \
-				self._colors_to_find[i].color_hsv))
+			color_index.setdefault(pack_color_bgr(self._colors_to_find[i].color_bgr), i)
+		self._color_index = color_index
+
+	def _update_segmenter(self):
+		"""Rebuild the segmenter for the current target colors
 
-		# Write local result back to the shared data
+		The index of the color in _colors_to_find is the same as the index of
+		its result in the segmenter.
+		"""
+		self._segmenter.set_target_colors( \
+			[color.color_hsv for color in self._colors_to_find])
+
+	def _find_colors(self, frame: PipelineFrame):
+		"""Find all the target colors in the frame from the frame pipeline
+
+		All the target colors are found in a single pass by the
+		MultiColorSegmenter, so the cost doesn't grow with the number of colors.
+
+		If any color is tracked, the tracked colors are only searched in their
+		search windows, and only the lost colors are searched in the whole frame.
+
+		@param frame The PipelineFrame passed by the frame pipeline
+		"""
+		start_time = time.perf_counter()
+		if self._tracker is not None and self._tracker.is_tracking_any():
+			posFound = self._find_colors_in_windows(frame)
+		else:
+			posFound = self._segmenter.segment(frame.frame_hsv, frame.offset)
+		if self._tracker is not None:
+			self._tracker.update(posFound)
+		latency_monitor.record(latency_monitor.STAGE_SEGMENTATION, \
+			time.perf_counter() - start_time)
+
+		self._publish_result(frame.frame_seq, posFound)
+
+	def _publish_result(self, frame_seq, posFound):
+		"""Write the result of a frame back to _colors_to_find and publish it
+
+		@param frame_seq The sequence number of the frame
+		@param posFound A list whose i-th element is a list of positions in
+		       pixel of the i-th color in _colors_to_find
+		"""
 		self._colors_to_find_lock.acquire()
 		for i in range(len(posFound)):
-			self._colors_to_find[i].pixel_position = posFound[i].copy()
+			self._colors_to_find[i].pixel_position = posFound[i]
+		self._result_frame_seq = frame_seq
 		self._colors_to_find_lock.release()
 
+		self._new_result_signal.publish()
+
+	def _find_colors_in_windows(self, frame: PipelineFrame):
+		"""Find each tracked color in its search window predicted by the tracker
+
+		Only the blobs of the tracked color inside its window are returned,
+		so the other blobs of the same color in the frame are ignored while
+		tracking. The color not found in its window is searched in the whole
+		frame at once, and the color lost before is searched in the whole frame
+		when ColorTracker.tick_lost_search tells. The whole frame is segmented
+		for all the colors, so the blobs are labelled the same as without
+		tracking, but only the results of the lost colors are taken.
+
+		@param frame The PipelineFrame passed by the frame pipeline
+		@return The same as MultiColorSegmenter.segment()
+		"""
+		height, width = frame.frame_hsv.shape[:2]
+		is_lost_search_due = self._tracker.tick_lost_search()
+		posFound = []
+		lost_colors = []
+		for i, window in enumerate(self._tracker.get_search_windows()):
+			if window is None:
+				posFound.append([])
+				if is_lost_search_due:
+					lost_colors.append(i)
+				continue
+
+			# Convert the window to the coordinate of frame_hsv and clip it
+			left = max(window[0].x - frame.offset.x, 0)
+			top = max(window[0].y - frame.offset.y, 0)
+			right = min(window[1].x - frame.offset.x, width)
+			bottom = min(window[1].y - frame.offset.y, height)
+			color_pos = []
+			if left < right and top < bottom:
+				window_offset = Point2D(frame.offset.x + left, frame.offset.y + top)
+				color_pos = self._segmenter.segment( \
+					frame.frame_hsv[top:bottom, left:right], window_offset)[i]
+			if len(color_pos) == 0:
+				lost_colors.append(i)
+			posFound.append(color_pos)
+
+		if len(lost_colors) > 0:
+			frame_pos = self._segmenter.segment(frame.frame_hsv, frame.offset)
+			for i in lost_colors:
+				posFound[i] = frame_pos[i]
+		return posFound
+
 class ColorPosManager:
 	"""Manage the ColorPositionFinders and provide accessing interface.
 
+	The ColorPositionFinders share the same FramePipeline, so each frame is
+	grabbed and converted only once for all the finders.
+
+	@var _camera The FrameSource providing the frames
+	@var _frame_pipeline The FramePipeline shared by the ColorPositionFinders
 	@var _color_pos_finders A dict contains name-ColorPositionFinder pairs
 	"""
 
 	def __init__(self, camera, fps = 30):
 		"""Constructor
 
-		@param camera Specify the WebCam object
+		@param camera Specify the FrameSource object, such as WebCamera
 		@param fps Specify the updating rate of the car position
 		"""
 		self._is_recognition_started = False
+		self._camera = camera
+		self._frame_pipeline = FramePipeline("car", camera, fps)
 		self._color_pos_finders = {
-			PosFinderType.CAR_TEAM_A: ColorPositionFinder("team_A", camera, fps),
-			PosFinderType.CAR_TEAM_B: ColorPositionFinder("team_B", camera, fps)
+			PosFinderType.CAR_TEAM_A: self._create_finder("team_A", fps),
+			PosFinderType.CAR_TEAM_B: self._create_finder("team_B", fps)
 		}
 
+	def _create_finder(self, finder_name, fps) -> ColorPositionFinder:
+		"""Create the ColorPositionFinder consuming the shared frame pipeline
+
+		The subclass overrides it to create its own type of the finders.
+
+		@param finder_name Specify the name of the finder
+		@param fps Specify the updating rate of the car position
+		"""
+		return ColorPositionFinder(finder_name, self._camera, fps, \
+			self._frame_pipeline)
+
 	@property
 	def is_recognition_started(self):
 		return self._is_recognition_started
 
+	def set_roi(self, top_left: Point2D, bottom_right: Point2D):
+		"""Only find the colors in the region of interest of the frame
+
+		@param top_left Specify the top-left corner of the region
+		@param bottom_right Specify the bottom-right corner of the region
+		       (exclusive)
+		"""
+		self._frame_pipeline.set_roi(top_left, bottom_right)
+
+	def clear_roi(self):
+		"""Find the colors in the whole frame
+		"""
+		self._frame_pipeline.clear_roi()
+
+	def get_frame_size(self) -> Point2D:
+		"""Get the size of the frames from the camera
+
+		@return The size in Point2D(width, height). None if there is no frame yet.
+		"""
+		frame = self._camera.frame
+		if frame is None:
+			return None
+		return Point2D(frame.shape[1], frame.shape[0])
+
+	def process_frame(self, frame_seq, frame):
+		"""Find the colors in the given frame in the caller thread
+
+		The frame is passed to the finders in the same way as the frames
+		from the camera, so the recorded or rendered frames can be fed one
+		by one without being dropped, such as in the benchmark.
+		The recognition should be started first.
+
+		@param frame_seq Specify the sequence number of the frame
+		@param frame Specify the frame in BGR domain
+		"""
+		self._frame_pipeline.process_frame(frame_seq, frame)
+
 	def get_finder(self, finder_type: PosFinderType) -> ColorPositionFinder:
 		"""Get the ColorPositionFinder by the PosFinderType
 
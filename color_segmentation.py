@@ -0,0 +1,192 @@
+"""@package docstring
+Segment all the target colors in the frame in a single pass.
+"""
+
+import cv2
+import numpy as np
+import logging
+
+from point import Point2D
+
+class MultiColorSegmenter:
+	"""Find the blobs of all the target colors in the frame at once
+
+	Instead of filtering the frame once per target color, the segmenter
+	classifies every pixel against all the target colors by a hue lookup
+	table, which maps a hue to the label of the target color it belongs to.
+	Label 0 is the background, and label i + 1 is the i-th target color.
+	If the hue ranges of two target colors overlap, the hue is given to the
+	color whose hue is closer.
+
+	The segmentation of a frame is:
+	1. Label the hue channel by the lookup table, and gate the saturation
+	   and the value channel to get the foreground mask;
+	2. Erode, dilate and blur the foreground mask to eliminate the noise;
+	3. Find the connected blobs in the foreground mask;
+	4. Each blob is given to the target color that its pixels are labelled
+	   with. If the pixels of a blob are labelled with more than one target
+	   color, the LEDs of different colors are next to each other and fused
+	   into one blob. Such a blob is segmented again in its bounding box once
+	   per target color, so the blobs of different colors never fuse.
+	Every step but the last one runs once per frame, so the cost stays nearly
+	the same while the target colors are added.
+
+	@var HUE_SENSITIVITY The half width of the hue range of a target color
+	@var MAX_NUM_OF_COLORS The maximum number of the target colors
+	@var _lower_bound The lower bound of the foreground in HSV domain
+	@var _upper_bound The upper bound of the foreground in HSV domain
+	@var _kernal The kernal for eroding and dilating the foreground mask
+	@var _hue_lut The lookup table from the hue to the label
+	@var _num_of_colors The number of the target colors
+	"""
+
+	HUE_SENSITIVITY = 15
+	MAX_NUM_OF_COLORS = 254
+
+	def __init__(self):
+		"""Constructor
+		"""
+		self._logger = logging.getLogger(self.__class__.__name__)
+
+		# TODO The range of the detecting colors can be set on the UI
+		self._lower_bound = np.array([0, 100, 180], dtype = np.uint8)
+		self._upper_bound = np.array([255, 255, 255], dtype = np.uint8)
+		self._kernal = np.ones((3, 3), dtype = np.uint8)
+		self._hue_lut = np.zeros(256, dtype = np.uint8)
+		self._num_of_colors = 0
+
+	@property
+	def num_of_colors(self):
+		return self._num_of_colors
+
+	def set_target_colors(self, colors_hsv: list):
+		"""Rebuild the hue lookup table for the target colors
+
+		@param colors_hsv A list of the target colors in HSV domain.
+		       The index of the color in the list is the index of its
+		       result in MultiColorSegmenter.segment().
+		"""
+		if len(colors_hsv) > MultiColorSegmenter.MAX_NUM_OF_COLORS:
+			self._logger.error("Too many target colors: {0}. Only the first {1} " \
+				"colors will be found." \
+				.format(len(colors_hsv), MultiColorSegmenter.MAX_NUM_OF_COLORS))
+			colors_hsv = colors_hsv[:MultiColorSegmenter.MAX_NUM_OF_COLORS]
+
+		hue_lut = np.zeros(256, dtype = np.uint8)
+		hue_distance = np.full(256, 256, dtype = np.int32)
+		hues = np.arange(256, dtype = np.int32)
+		for i in range(len(colors_hsv)):
+			distance = np.abs(hues - int(colors_hsv[i][0]))
+			is_closer = (distance <= MultiColorSegmenter.HUE_SENSITIVITY) & \
+				(distance < hue_distance)
+			hue_lut[is_closer] = i + 1
+			hue_distance[is_closer] = distance[is_closer]
+
+		self._hue_lut = hue_lut
+		self._num_of_colors = len(colors_hsv)
+
+	def segment(self, frame_hsv, offset = Point2D(0, 0)) -> list:
+		"""Find the positions of all the target colors in the given frame
+
+		@param frame_hsv The source frame in HSV domain
+		@param offset The position of the top-left pixel of frame_hsv in
+		       the original frame. It is added to the positions found.
+		@return A list whose i-th element is a list of positions in pixel
+		        where the i-th target color is at. The positions are sorted
+		        by the size of the blob in descending order.
+		        It is possible that the list of a color is empty.
+		"""
+		positions = [[] for i in range(self._num_of_colors)]
+		if self._num_of_colors == 0:
+			return positions
+
+		# Label each pixel, and only the labelled colors in the defined
+		# saturation and value range will be passed
+		labels = cv2.LUT(cv2.extractChannel(frame_hsv, 0), self._hue_lut)
+		filtered = cv2.inRange(frame_hsv, self._lower_bound, self._upper_bound)
+		filtered = cv2.bitwise_and(filtered, filtered, mask = labels)
+		foreground, blurred = self._filter_noise(filtered)
+
+		num_of_blobs, blob_map, stats, centroids = \
+			cv2.connectedComponentsWithStats(blurred, connectivity = 8)
+		# Blob 0 is the background
+		if num_of_blobs <= 1:
+			return positions
+
+		# Vote the color of each blob by the labels of its pixels
+		num_of_labels = self._num_of_colors + 1
+		ys, xs = np.nonzero(foreground)
+		votes = blob_map[ys, xs].astype(np.int64) * num_of_labels + labels[ys, xs]
+		histogram = np.bincount(votes, minlength = num_of_blobs * num_of_labels) \
+			.reshape(num_of_blobs, num_of_labels)
+		histogram[0, :] = 0
+		histogram[:, 0] = 0
+
+		# (size, label, centroid) of each blob found
+		blobs_found = []
+		for blob in np.nonzero(histogram.sum(axis = 1))[0]:
+			blob_labels = np.nonzero(histogram[blob])[0]
+			if len(blob_labels) == 1:
+				blobs_found.append((histogram[blob, blob_labels[0]], \
+					blob_labels[0], centroids[blob]))
+			else:
+				blobs_found.extend(self._split_fused_blob( \
+					filtered, labels, blob_map, stats[blob], blob, blob_labels))
+
+		blobs_found.sort(key = lambda blob_found: -blob_found[0])
+		for _, label, centroid in blobs_found:
+			positions[label - 1].append(Point2D( \
+				int(centroid[0]) + offset.x, int(centroid[1]) + offset.y))
+		return positions
+
+	def _filter_noise(self, filtered):
+		"""Erode, dilate and blur the filtered mask
+
+		@param filtered The mask of the pixels passed the color filter
+		@return (foreground, blurred) The mask after eroding and dilating,
+		        and the blurred one
+		"""
+		# Erode and dilate the filtered result with 3 x 3 kernal
+		# to eliminate the noise
+		foreground = cv2.erode(filtered, self._kernal, iterations = 1)
+		foreground = cv2.dilate(foreground, self._kernal, iterations = 1)
+		blurred = cv2.GaussianBlur(foreground, (5, 5), 0)
+		return foreground, blurred
+
+	def _split_fused_blob(self, filtered, labels, blob_map, blob_stats, blob, \
+		blob_labels) -> list:
+		"""Segment a blob fused from the LEDs of different colors per color
+
+		The blob is segmented in its bounding box once per target color, which
+		is the same as segmenting the whole frame per target color, because the
+		blob of a single color is always in a blob of the combined mask.
+
+		@param filtered The mask of the pixels passed the color filter
+		@param labels The labels of the pixels
+		@param blob_map The map of the blobs of the combined mask
+		@param blob_stats The stats of the blob from cv2.connectedComponentsWithStats
+		@param blob The index of the blob in blob_map
+		@param blob_labels The labels of the target colors in the blob
+		@return A list of (size, label, centroid) of the blobs found.
+		        The centroid is in the coordinate of the given frame.
+		"""
+		x, y = blob_stats[cv2.CC_STAT_LEFT], blob_stats[cv2.CC_STAT_TOP]
+		width, height = blob_stats[cv2.CC_STAT_WIDTH], blob_stats[cv2.CC_STAT_HEIGHT]
+		in_blob = blob_map[y:y + height, x:x + width] == blob
+		filtered_crop = filtered[y:y + height, x:x + width]
+		labels_crop = labels[y:y + height, x:x + width]
+
+		blobs_found = []
+		for label in blob_labels:
+			label_mask = np.where(in_blob & (labels_crop == label), filtered_crop, 0) \
+				.astype(np.uint8)
+			foreground, blurred = self._filter_noise(label_mask)
+			num_of_blobs, sub_blob_map, _, centroids = \
+				cv2.connectedComponentsWithStats(blurred, connectivity = 8)
+			sizes = np.bincount(sub_blob_map[foreground > 0], minlength = num_of_blobs)
+			for sub_blob in range(1, num_of_blobs):
+				if sizes[sub_blob] == 0:
+					continue
+				blobs_found.append((sizes[sub_blob], label, \
+					(centroids[sub_blob][0] + x, centroids[sub_blob][1] + y)))
+		return blobs_found
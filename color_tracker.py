@@ -0,0 +1,144 @@
+"""@package docstring
+Track the colors found in the frame to predict where to search them next.
+"""
+
+from point import Point2D
+
+class ColorTrack:
+	"""Data structure storing the tracking state of a color
+
+	@var position The last position in pixel of the color.
+	     None if the color is lost.
+	@var velocity_x The smoothed moving distance in pixel per frame in x axis
+	@var velocity_y The smoothed moving distance in pixel per frame in y axis
+	"""
+	__slots__ = ("position", "velocity_x", "velocity_y")
+
+	def __init__(self):
+		self.position = None
+		self.velocity_x = 0.0
+		self.velocity_y = 0.0
+
+	def predict(self) -> Point2D:
+		"""Predict the position of the color in the next frame
+
+		@return The predicted position in pixel
+		"""
+		return Point2D(int(round(self.position.x + self.velocity_x)), \
+			int(round(self.position.y + self.velocity_y)))
+
+class ColorTracker:
+	"""Remember the position and the velocity of each color to predict the
+	small window to search it in the next frame
+
+	The i-th track is for the i-th color of the ColorPositionFinder.
+	The window is centered at the predicted position, and is enlarged with
+	the speed of the color. If a color is not found in its window, it is lost,
+	and it has to be found in the whole frame again. The color lost for a
+	while, such as the car out of the arena, is searched in the whole frame
+	every LOST_SEARCH_INTERVAL frames, so it doesn't cost a whole frame search
+	on every frame while the other colors are tracked.
+
+	@var WINDOW_HALF_SIZE The minimum half size in pixel of the search window
+	@var WINDOW_VELOCITY_GAIN The ratio of the speed added to the half size
+	     of the search window
+	@var VELOCITY_SMOOTHING The weight of the previous velocity in the
+	     smoothed velocity
+	@var LOST_SEARCH_INTERVAL The interval in frames of searching the colors
+	     lost for a while in the whole frame
+	@var _tracks A list of ColorTrack
+	@var _frames_to_lost_search The number of the frames until the next
+	     search of the lost colors
+	"""
+
+	WINDOW_HALF_SIZE = 40
+	WINDOW_VELOCITY_GAIN = 2.0
+	VELOCITY_SMOOTHING = 0.5
+	LOST_SEARCH_INTERVAL = 5
+
+	def __init__(self, num_of_colors = 0):
+		"""Constructor
+
+		@param num_of_colors Specify the number of colors to be tracked
+		"""
+		self._tracks = []
+		self._frames_to_lost_search = 0
+		self.reset(num_of_colors)
+
+	def reset(self, num_of_colors):
+		"""Lose all the colors and set the number of colors to be tracked
+
+		@param num_of_colors Specify the number of colors to be tracked
+		"""
+		self._tracks = [ColorTrack() for i in range(num_of_colors)]
+		self._frames_to_lost_search = 0
+
+	def is_tracking_any(self) -> bool:
+		"""Is any color tracked?
+
+		@return True if the search window of any color is available.
+		        False if all the colors are lost or there is no color.
+		"""
+		for track in self._tracks:
+			if track.position is not None:
+				return True
+		return False
+
+	def tick_lost_search(self) -> bool:
+		"""Count a frame and tell whether to search the lost colors in it
+
+		The method should be called once per frame while any color is tracked.
+
+		@return True every LOST_SEARCH_INTERVAL frames
+		"""
+		if self._frames_to_lost_search > 0:
+			self._frames_to_lost_search -= 1
+			return False
+		self._frames_to_lost_search = ColorTracker.LOST_SEARCH_INTERVAL - 1
+		return True
+
+	def get_search_windows(self) -> list:
+		"""Get the search window of each color
+
+		@return A list whose i-th element is the search window of the i-th
+		        color in the tuple of (top_left, bottom_right), where both are
+		        Point2D and bottom_right is exclusive. The element is None
+		        if the color is lost.
+		"""
+		windows = []
+		for track in self._tracks:
+			if track.position is None:
+				windows.append(None)
+				continue
+
+			center = track.predict()
+			half_size_x = ColorTracker.WINDOW_HALF_SIZE + \
+				int(abs(track.velocity_x) * ColorTracker.WINDOW_VELOCITY_GAIN)
+			half_size_y = ColorTracker.WINDOW_HALF_SIZE + \
+				int(abs(track.velocity_y) * ColorTracker.WINDOW_VELOCITY_GAIN)
+			windows.append(( \
+				Point2D(center.x - half_size_x, center.y - half_size_y), \
+				Point2D(center.x + half_size_x + 1, center.y + half_size_y + 1)))
+		return windows
+
+	def update(self, positions: list):
+		"""Update the tracks by the positions found in the frame
+
+		@param positions A list whose i-th element is a list of positions in
+		       pixel of the i-th color. The first position is tracked.
+		"""
+		for track, color_positions in zip(self._tracks, positions):
+			if len(color_positions) == 0:
+				track.position = None
+				track.velocity_x = 0.0
+				track.velocity_y = 0.0
+				continue
+
+			new_position = color_positions[0]
+			if track.position is not None:
+				smoothing = ColorTracker.VELOCITY_SMOOTHING
+				track.velocity_x = track.velocity_x * smoothing + \
+					(new_position.x - track.position.x) * (1.0 - smoothing)
+				track.velocity_y = track.velocity_y * smoothing + \
+					(new_position.y - track.position.y) * (1.0 - smoothing)
+			track.position = new_position
@@ -1,5 +1,15 @@
 from enum import Enum, auto
 
+def pack_color_bgr(color_bgr) -> int:
+	"""Pack the color in BGR domain into an integer
+
+	The packed color is used as the key of the color in the dictionary.
+
+	@param color_bgr Specify the color in BGR domain: [b, g, r]
+	@return The integer 0xBBGGRR
+	"""
+	return (int(color_bgr[0]) << 16) | (int(color_bgr[1]) << 8) | int(color_bgr[2])
+
 class ColorType(Enum):
 	"""The representation of colors in the maze arena
 
@@ -2,21 +2,121 @@
 
 The wrapper module of tcp_module. Mainly handling the command
 send from the client.
+
+The TCP server backend can be selected by set_backend() before the server
+is started. The backends share the same callback functions, so the handlers
+set to this module are kept after switching the backend.
+
+The commands from each client are limited by a token bucket per command
+class. The command exceeding the limit is not handled, and the server
+replies "<cmd> busy" to the client.
+
+The commands are handled by a pool of worker threads. The commands from
+the same client are handled one by one in the order of receiving, and the
+commands from different clients are handled concurrently.
+
+A client may switch to the binary protocol by set_binary_protocol(). The
+data is then framed by util.binary_frame. The frame of a message ID
+registered by add_binary_message() is dispatched to the handler of its
+command, and the integers unpacked from the payload are the parameters.
+The frame of MSG_ID_TEXT carries a text command. The messages sent to the
+client are translated into the frames of the registered commands, or sent
+in the frame of MSG_ID_TEXT.
+
+The client requesting the binary protocol has to wait for the reply of its
+request, such as "join ok", before sending the binary frames. The reply is
+the last text message to the client, and the framing is switched right
+after it. If the client sends anything between its request and the reply,
+it violates the protocol and is disconnected.
 """
-import util.tcp_server as TCPServer
+import util.tcp_server
+import util.tcp_server_asyncio
 import logging
-from threading import Thread
+import struct
+import time
+from collections import deque
+from enum import Enum, auto
+from threading import Thread, Lock
 from queue import Queue
+from util.rate_limiter import TokenBucket
+from util.binary_frame import pack_frame
+from util import latency_monitor
+
+class CommandClass(Enum):
+	"""The class of the command for rate limiting
 
+	@var QUERY The command that polls the information, such as "position".
+	     It may be sent in a high rate.
+	@var CONTROL The command that changes the game, such as "join".
+	"""
+	QUERY = auto()
+	CONTROL = auto()
+
+# The available TCP server backends
+_backends = {
+	"select": util.tcp_server,
+	"asyncio": util.tcp_server_asyncio
+}
+# The TCP server backend in use
+TCPServer = _backends["select"]
 # A dictionary for mapping command to the handler
 _command_handlers = {}	# (command, handler)
-# The thread for handling the pending command
-_command_thread = None
-# A queue to store the pending command
-_pending_queue = Queue()
+# A dictionary for mapping command to its CommandClass
+_command_classes = {}	# (command, CommandClass)
+# The rate limit of each command class
+_rate_limits = {	# (CommandClass, (rate per second, burst))
+	CommandClass.QUERY: (30.0, 10),
+	CommandClass.CONTROL: (20.0, 20)
+}
+# The token buckets of the clients. It is only accessed by the server thread.
+_client_buckets = {}	# (client_ip, {CommandClass: TokenBucket})
+# The message ID of the binary frame carrying a text message
+MSG_ID_TEXT = 0x00
+# A dictionary for mapping message ID to the command of the binary protocol
+_binary_commands = {}	# (message_id, (command, request payload struct))
+# A dictionary for mapping command to the message ID of the binary protocol
+_binary_message_ids = {}	# (command, (message_id, payload struct))
+# The IPs of the clients using the binary protocol
+_binary_clients = set()
+# The lock for switching the protocol of a client and sending the messages,
+# so no text message is sent after the reply of the negotiation
+_binary_clients_lock = Lock()
+# The number of the worker threads for handling the commands
+NUM_OF_WORKERS = 4
+# The worker threads for handling the pending commands
+_command_threads = []
+# The pending commands of each client with the time they are queued
+_pending_commands = {}	# (client_ip, deque of (queued_time, cmd_string or (command, parameters)))
+# A queue of the clients that have pending commands and are not being handled
+# by any worker. A worker thread stops when it gets None from the queue.
+_ready_clients = Queue()
+# The lock for accessing _pending_commands and _num_of_pending_commands
+_pending_lock = Lock()
+# The total number of the pending commands
+_num_of_pending_commands = 0
 # Logger
 _logger = logging.getLogger(__name__)
 
+def set_backend(backend_name: str):
+	"""Select the TCP server backend
+
+	@param backend_name Specify "asyncio" or "select"
+	@exception ValueError If the backend_name is unknown
+	@exception RuntimeError If the server is running
+	"""
+	global TCPServer
+
+	try:
+		backend = _backends[backend_name]
+	except KeyError:
+		raise ValueError("Unknown TCP server backend '{0}'.".format(backend_name))
+
+	if TCPServer.is_running():
+		raise RuntimeError("Cannot change the backend while the server is running.")
+
+	TCPServer = backend
+	_logger.info("TCP server backend is set to \"{0}\".".format(backend_name))
+
 def set_new_connection_handler(handler):
 	"""Set the callback function(client_ip) when a client connects to the server
 	"""
@@ -37,7 +137,8 @@ def remove_disconnection_handler(handler):
 	"""
 	TCPServer.on_disconnect -= handler
 
-def add_command_handler(cmd_keyword: str, handler):
+def add_command_handler(cmd_keyword: str, handler, \
+	cmd_class: CommandClass = CommandClass.CONTROL):
 	"""Set the callback fucntion(from_ip, *args) of receving commands from client
 
 	The arguments of the handle are (from_ip, *args_of_command).
@@ -48,33 +149,148 @@ def add_command_handler(cmd_keyword: str, handler):
 
 	@param cmd_keyword Specify the command
 	@param handler Specify the callback function for that command
+	@param cmd_class Specify the CommandClass of the command for rate limiting
 	@sa _parse_command
 	"""
 	try:
 		_ = _command_handlers[cmd_keyword]
 	except KeyError:
 		_command_handlers[cmd_keyword] = handler
+		_command_classes[cmd_keyword] = cmd_class
 	else:
 		raise ValueError("Command '{0}' is already registered." \
 			.format(cmd_keyword))
 
+def add_binary_message(message_id: int, cmd_keyword: str, payload_format = "", \
+	request_format = None):
+	"""Register the message ID of the command for the binary protocol
+
+	The frame of the message_id received is dispatched to the handler of
+	the cmd_keyword, and the message "<cmd_keyword> [param1] [param2]..."
+	sent to the binary clients is packed into the frame of the message_id.
+
+	@param message_id Specify the message ID from 1 to 255
+	@param cmd_keyword Specify the command
+	@param payload_format Specify the struct format of the integer parameters
+	       in the payload sent to the client, such as "<hh" for two int16.
+	       "" for no parameter.
+	@param request_format Specify the struct format of the parameters in the
+	       payload received from the client. Same as payload_format if None.
+	@exception ValueError If the message_id or the cmd_keyword is already
+	           registered, or the message_id is invalid
+	"""
+	if not 0 < message_id <= 0xFF:
+		raise ValueError("Message ID {0} is invalid.".format(message_id))
+	if message_id in _binary_commands or cmd_keyword in _binary_message_ids:
+		raise ValueError("Message ID {0} or command '{1}' is already registered." \
+			.format(message_id, cmd_keyword))
+
+	if request_format is None:
+		request_format = payload_format
+
+	_binary_commands[message_id] = (cmd_keyword, struct.Struct(request_format))
+	_binary_message_ids[cmd_keyword] = (message_id, struct.Struct(payload_format))
+
+def set_binary_protocol(client_ip: str, reply: str):
+	"""Send the reply of the negotiation, and then communicate with the client
+	in the binary protocol
+
+	It should be called by the handler of the request of the binary protocol.
+	The commands from the client queued after the request were sent before
+	the client received the reply, so the client violates the protocol and
+	is disconnected.
+
+	@param client_ip Specify the IP of the client
+	@param reply Specify the reply in text, such as "join ok"
+	"""
+	global _num_of_pending_commands
+
+	with _binary_clients_lock:
+		TCPServer.set_binary_framing(client_ip, reply)
+		_binary_clients.add(client_ip)
+
+	with _pending_lock:
+		pending_commands = _pending_commands.get(client_ip, ())
+		num_of_violated = len(pending_commands)
+		if num_of_violated > 0:
+			_num_of_pending_commands -= num_of_violated
+			pending_commands.clear()
+
+	if num_of_violated > 0:
+		_reject_early_data(client_ip)
+	else:
+		_logger.info("{0} uses the binary protocol.".format(client_ip))
+
+def _reject_early_data(client_ip: str):
+	"""Disconnect the client sending data before the binary protocol is negotiated
+	"""
+	_logger.error("{0} sends data before receiving the reply of the binary " \
+		"protocol. Disconnect it.".format(client_ip))
+	TCPServer.force_disconnection(client_ip)
+
+def set_rate_limit(cmd_class: CommandClass, rate: float, burst: int):
+	"""Set the rate limit of the commands of a command class from each client
+
+	It is applied to the clients connected after the call.
+
+	@param cmd_class Specify the CommandClass
+	@param rate Specify the number of commands allowed per second
+	@param burst Specify the maximum number of commands allowed at once
+	"""
+	_rate_limits[cmd_class] = (rate, burst)
+
+def get_queue_depth() -> int:
+	"""Get the number of the commands waiting to be handled
+
+	The handling time of each command is recorded to the latency_monitor
+	in the stage latency_monitor.STAGE_COMMAND_HANDLER.
+	"""
+	return _num_of_pending_commands
+
 def _comsume_command():
-	"""Comsume the pending commands in the _pending_queue
+	"""Comsume the pending commands of the clients in the _ready_clients
 
-	This method is the target method of the thread _command_thread.
-	The thread will stop when get the None object from the _pending_queue.
+	This method is the target method of the threads in _command_threads.
+	A worker handles a command of the client got from _ready_clients, and then
+	puts the client back if it has more pending commands, so a client is only
+	handled by a worker at a time and the clients take turns.
+	The thread will stop when get the None object from the _ready_clients.
 	"""
+	global _num_of_pending_commands
+
 	_logger.debug("Consuming command thread is started.")
 
 	while True:
-		command_item = _pending_queue.get()
+		client_ip = _ready_clients.get()
 
-		if command_item is None:
-			_pending_queue.task_done()
+		if client_ip is None:
 			break
 
-		_parse_command(*command_item)
-		_pending_queue.task_done()
+		with _pending_lock:
+			pending_commands = _pending_commands[client_ip]
+			if len(pending_commands) == 0:
+				# The commands are dropped after the client is disconnected
+				del _pending_commands[client_ip]
+				continue
+			queued_time, command_item = pending_commands.popleft()
+			_num_of_pending_commands -= 1
+		latency_monitor.record(latency_monitor.STAGE_COMMAND_QUEUE, \
+			time.perf_counter() - queued_time)
+
+		try:
+			if isinstance(command_item, str):
+				_parse_command(client_ip, command_item)
+			else:
+				_dispatch_command(client_ip, *command_item)
+		except Exception:
+			_logger.exception("Exception occured while handling command " \
+				"\"{0}\" from {1}".format(command_item, client_ip))
+
+		with _pending_lock:
+			if len(_pending_commands[client_ip]) > 0:
+				_ready_clients.put(client_ip)
+			else:
+				del _pending_commands[client_ip]
 
 	_logger.debug("Consuming command thread is stopped.")
 
@@ -98,54 +314,209 @@ def _parse_command(from_ip: str, cmd_string: str):
 	spilted_str = cmd_string.split(' ')
 	command = spilted_str[0]
 	parameters = tuple(spilted_str[1:len(spilted_str)])
+	_dispatch_command(from_ip, command, parameters)
+
+def _dispatch_command(from_ip: str, command: str, parameters: tuple):
+	"""Invoke the handler of the command
 
+	@param from_ip The IP of the client
+	@param command The command keyword
+	@param parameters The tuple of the parameters of the command
+	"""
 	try:
 		target_handler = _command_handlers[command]
 	except KeyError:
 		_logger.error("Unknown command {0} from {1}. Discard." \
 			.format(command, from_ip))
 	else:
-		target_handler(from_ip, *parameters)
+		start_time = time.perf_counter()
+		try:
+			target_handler(from_ip, *parameters)
+		finally:
+			latency_monitor.record(latency_monitor.STAGE_COMMAND_HANDLER.format(command), \
+				time.perf_counter() - start_time)
 
-def _queue_command(from_ip: str, cmd_string: str):
-	"""Queue the pending command to the _pending_queue
+def _is_rate_limited(from_ip: str, command: str) -> bool:
+	"""Take a token from the bucket of the client for the command
 
-	The command in the _pending_queue will be comsumed in _dequeue_command.
+	The unknown command is counted as CommandClass.CONTROL.
 
 	@param from_ip The IP of the client
-	@param cmd_string The command recevied from the client
+	@param command The command keyword
+	@return True if the command exceeds the rate limit
+	"""
+	cmd_class = _command_classes.get(command, CommandClass.CONTROL)
+
+	try:
+		buckets = _client_buckets[from_ip]
+	except KeyError:
+		buckets = {}
+		_client_buckets[from_ip] = buckets
+
+	try:
+		bucket = buckets[cmd_class]
+	except KeyError:
+		bucket = TokenBucket(*_rate_limits[cmd_class])
+		buckets[cmd_class] = bucket
+
+	return not bucket.try_consume()
+
+def _decode_frame(from_ip: str, message_id: int, payload: bytes):
+	"""Decode the binary frame into the command
+
+	@param from_ip The IP of the client
+	@param message_id The message ID of the frame
+	@param payload The payload of the frame
+	@return The command string if it is a text frame, or a tuple
+	        (command, parameters) if it is the frame of a registered command
+	@retval None If the frame is invalid
+	"""
+	if message_id == MSG_ID_TEXT:
+		try:
+			return payload.decode("utf-8")
+		except UnicodeDecodeError as e:
+			_logger.error("Invalid text frame from {0}: {1}. Discard." \
+				.format(from_ip, e))
+			return None
+
+	try:
+		command, payload_struct = _binary_commands[message_id]
+		return (command, payload_struct.unpack(payload))
+	except KeyError:
+		_logger.error("Unknown message ID {0} from {1}. Discard." \
+			.format(message_id, from_ip))
+	except struct.error:
+		_logger.error("Invalid payload of message ID {0} from {1}. Discard." \
+			.format(message_id, from_ip))
+	return None
+
+def _encode_frame(msg: str) -> bytes:
+	"""Encode the message into the binary frame
+
+	The message is packed into the frame of its command if the command is
+	registered by add_binary_message() and the parameters match the payload
+	format. Otherwise, it is sent in the text frame.
+
+	@param msg The message to be sent
+	@return The binary frame
+	"""
+	command, _, parameters = msg.partition(' ')
+	try:
+		message_id, payload_struct = _binary_message_ids[command]
+		return pack_frame(message_id, \
+			payload_struct.pack(*[int(value) for value in parameters.split()]))
+	except (KeyError, ValueError, struct.error):
+		return pack_frame(MSG_ID_TEXT, msg.encode())
+
+def _queue_command(from_ip: str, message):
+	"""Queue the pending command to the _pending_commands of the client
+
+	The command will be comsumed in _comsume_command(). If the client has no
+	pending command, it is put to the _ready_clients.
+	If the command exceeds the rate limit, it won't be queued, and
+	"<cmd> busy" is replied.
+
+	@param from_ip The IP of the client
+	@param message The command string recevied from the client, or
+	       the binary frame in tuple (message_id, payload)
 	"""
-	_pending_queue.put((from_ip, cmd_string))
+	global _num_of_pending_commands
+
+	if isinstance(message, str):
+		if from_ip in _binary_clients:
+			# The line split before the framing is switched
+			_reject_early_data(from_ip)
+			return
+		command_item = message
+		command = message.split(' ', 1)[0]
+	else:
+		command_item = _decode_frame(from_ip, *message)
+		if command_item is None:
+			return
+		elif isinstance(command_item, str):
+			command = command_item.split(' ', 1)[0]
+		else:
+			command = command_item[0]
+
+	if _is_rate_limited(from_ip, command):
+		_logger.debug("Command {0} from {1} exceeds the rate limit." \
+			.format(command, from_ip))
+		send_message(from_ip, command + " busy")
+		return
+
+	queued_item = (time.perf_counter(), command_item)
+	with _pending_lock:
+		try:
+			_pending_commands[from_ip].append(queued_item)
+		except KeyError:
+			_pending_commands[from_ip] = deque([queued_item])
+			_ready_clients.put(from_ip)
+		_num_of_pending_commands += 1
+
+def _remove_client(client_ip: str):
+	"""Remove the token buckets, the protocol and the pending commands of
+	the disconnected client
+
+	The deque of the pending commands is emptied instead of being removed,
+	because the client may be in the _ready_clients or being handled.
+	The worker removes it.
+	"""
+	global _num_of_pending_commands
+
+	_client_buckets.pop(client_ip, None)
+	_binary_clients.discard(client_ip)
+
+	with _pending_lock:
+		pending_commands = _pending_commands.get(client_ip, ())
+		_num_of_pending_commands -= len(pending_commands)
+		if len(pending_commands) > 0:
+			_logger.debug("Drop {0} pending commands of {1}." \
+				.format(len(pending_commands), client_ip))
+			pending_commands.clear()
 
 TCPServer.on_recv_msg += _queue_command
+TCPServer.on_disconnect += _remove_client
 
 # TODO: Is class better than the module?
 def start_server(server_ip: str, server_port: int) -> bool:
-	"""Start the TCP server and the command thread
+	"""Start the TCP server and the command threads
 
 	@param server_ip Specify the IP of the server
 	@param server_port Specify the port of the server
 	@return True If the server successfully started.
 	"""
-	global _command_thread
+	global _command_threads
 
 	if not TCPServer.start_server(server_ip, server_port):
 		return False
 
-	_logger.debug("Consuming command thread is starting.")
-	_command_thread = Thread(target = _comsume_command, name = "consume_cmd")
-	_command_thread.start()
+	_logger.debug("Consuming command threads are starting.")
+	_command_threads = [Thread(target = _comsume_command, \
+		name = "consume_cmd_{0}".format(i)) for i in range(NUM_OF_WORKERS)]
+	for command_thread in _command_threads:
+		command_thread.start()
 
 	return True
 
 def stop_server():
-	"""Stop the TCP server and the command thread
+	"""Stop the TCP server and the command threads
+
+	The pending commands which haven't been handled are discarded.
 	"""
-	_logger.debug("Consuming command thread is stopping.")
-	_pending_queue.put(None)
-	_pending_queue.join()
-	_command_thread.join()
+	global _num_of_pending_commands
+
+	_logger.debug("Consuming command threads are stopping.")
 	TCPServer.stop_server()
+	for command_thread in _command_threads:
+		_ready_clients.put(None)
+	for command_thread in _command_threads:
+		command_thread.join()
+
+	with _pending_lock:
+		_pending_commands.clear()
+		_num_of_pending_commands = 0
+	while not _ready_clients.empty():
+		_ready_clients.get()
 
 def force_disconnection(client_ip):
 	"""Forcely disconnect the client from the server
@@ -161,7 +532,18 @@ def get_current_connection_num():
 	return TCPServer.get_current_connection_num()
 
 def send_message(to_ip: str, msg: str):
-	TCPServer.send_message(to_ip, msg)
+	with _binary_clients_lock:
+		if to_ip in _binary_clients:
+			TCPServer.send_message(to_ip, _encode_frame(msg))
+		else:
+			TCPServer.send_message(to_ip, msg)
 
 def broadcast_message(msg: str):
-	TCPServer.broadcast_message(msg)
+	with _binary_clients_lock:
+		binary_clients = tuple(_binary_clients)
+		TCPServer.broadcast_message(msg, binary_clients)
+
+		if len(binary_clients) > 0:
+			frame = _encode_frame(msg)
+			for client_ip in binary_clients:
+				TCPServer.send_message(client_ip, frame)
@@ -0,0 +1,218 @@
+"""@package docstring
+Process each frame of the camera once and share it with all the consumers.
+"""
+
+import cv2
+import logging
+import time
+from threading import Lock
+from util.job_thread import JobThread
+from util import latency_monitor
+
+from point import Point2D
+
+class PipelineFrame:
+	"""Data structure storing a frame processed by the FramePipeline
+
+	@var frame_seq The sequence number of the frame from the camera
+	@var frame_hsv The frame in HSV domain. It only contains the region of
+	     interest if it is set to the FramePipeline.
+	@var offset The position of the top-left pixel of frame_hsv in the
+	     original frame
+	"""
+	__slots__ = ("frame_seq", "frame_hsv", "offset")
+
+	def __init__(self, frame_seq, frame_hsv, offset = Point2D(0, 0)):
+		self.frame_seq = frame_seq
+		self.frame_hsv = frame_hsv
+		self.offset = offset
+
+class FramePipeline:
+	"""Grab a frame from the camera, convert it into HSV domain once, and
+	pass the result to all the consumers
+
+	The consumers are run in the pipeline thread in the order of being added,
+	so all the consumers get the result of the same frame.
+	The pipeline thread wakes up when the camera captures a new frame, so
+	each frame is processed at most once. The fps limits the processing rate
+	if it is lower than the frame rate of the camera.
+	The pipeline thread is started when the first consumer is added, and
+	stopped when the last consumer is removed.
+
+	If the region of interest is set, only that region of the frame is
+	converted and passed to the consumers.
+
+	@var _pipeline_name The name of the pipeline
+	@var _camera The camera object for getting frames
+	@var _roi The region of interest in the tuple of (top_left, bottom_right),
+	     where both are Point2D and bottom_right is exclusive.
+	     None if the whole frame is processed.
+	@var _consumers A tuple of the consumer methods, which are
+	     consumer(frame: PipelineFrame). The tuple is replaced instead of
+	     being modified, so the pipeline thread can iterate it without lock.
+	@var _consumers_lock The lock for replacing _consumers
+	@var _dispatch_lock The lock for passing a frame to the consumers, so
+	     the frames fed by FramePipeline.process_frame and the frames of the
+	     pipeline thread are never consumed at the same time
+	@var _pipeline_thread The thread for running the pipeline
+	"""
+
+	def __init__(self, pipeline_name, camera, fps = 30):
+		"""Constructor
+
+		@param pipeline_name The name of the pipeline
+		@param camera Specify the camera object
+		@param fps Specify the processing rate of the frames
+		"""
+		self._logger = logging.getLogger(self.__class__.__name__)
+
+		self._pipeline_name = pipeline_name
+		self._camera = camera
+		self._roi = None
+		self._consumers = ()
+		self._consumers_lock = Lock()
+		self._dispatch_lock = Lock()
+
+		try:
+			if int(fps) < 1:
+				raise ValueError
+		except ValueError:
+			self._logger.error("Invaild fps: {0}. Set to 30.".format(fps))
+			fps = 30
+
+		self._pipeline_thread = JobThread(self._run_pipeline, \
+			"Pipeline_{0}".format(pipeline_name), 1.0 / fps, \
+			fixed_rate = True, trigger = camera.create_frame_trigger())
+
+		self._logger.debug("Pipeline \"{0}\" is run in fps {1}." \
+			.format(pipeline_name, fps))
+
+	@property
+	def is_running(self):
+		"""Is the pipeline thread running?
+		"""
+		return self._pipeline_thread.is_running
+
+	def set_roi(self, top_left: Point2D, bottom_right: Point2D):
+		"""Set the region of interest of the frame
+
+		The region will be clipped by the frame size while processing.
+
+		@param top_left Specify the top-left corner of the region
+		@param bottom_right Specify the bottom-right corner of the region
+		       (exclusive)
+		"""
+		self._roi = (top_left, bottom_right)
+		self._logger.info("The region of interest of pipeline \"{0}\" " \
+			"is set to {1} - {2}.".format(self._pipeline_name, top_left, bottom_right))
+
+	def clear_roi(self):
+		"""Process the whole frame
+		"""
+		self._roi = None
+
+	def add_consumer(self, consumer):
+		"""Add a consumer to the pipeline
+
+		The pipeline thread will be started if it is not running.
+
+		@param consumer Specify the method consumer(frame: PipelineFrame)
+		"""
+		with self._consumers_lock:
+			if consumer in self._consumers:
+				self._logger.error("The consumer is already in the pipeline \"{0}\"." \
+					.format(self._pipeline_name))
+				return
+			self._consumers = self._consumers + (consumer,)
+
+			if not self._pipeline_thread.is_running:
+				self._pipeline_thread.start()
+
+	def remove_consumer(self, consumer):
+		"""Remove a consumer from the pipeline
+
+		The pipeline thread will be stopped if there is no consumer left.
+
+		@param consumer Specify the consumer to be removed
+		"""
+		with self._consumers_lock:
+			if consumer not in self._consumers:
+				self._logger.error("The consumer is not in the pipeline \"{0}\"." \
+					.format(self._pipeline_name))
+				return
+			self._consumers = tuple(c for c in self._consumers if c != consumer)
+
+			if len(self._consumers) == 0 and self._pipeline_thread.is_running:
+				self._pipeline_thread.stop()
+
+	def process_frame(self, frame_seq, frame) -> PipelineFrame:
+		"""Convert the frame and pass the result to all the consumers
+
+		@param frame_seq The sequence number of the frame
+		@param frame The frame in BGR domain
+		@return The PipelineFrame passed to the consumers
+		"""
+		frame_hsv, offset = self._convert_frame(frame)
+		pipeline_frame = PipelineFrame(frame_seq, frame_hsv, offset)
+		self._dispatch(pipeline_frame)
+		return pipeline_frame
+
+	def _convert_frame(self, frame):
+		"""Crop the region of interest from the frame and convert it into HSV domain
+
+		@param frame The frame in BGR domain
+		@return (frame_hsv, offset) The converted frame and the position of
+		        its top-left pixel in the frame
+		"""
+		start_time = time.perf_counter()
+		frame, offset = self._crop_roi(frame)
+		frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+		latency_monitor.record(latency_monitor.STAGE_HSV, \
+			time.perf_counter() - start_time)
+		return frame_hsv, offset
+
+	def _crop_roi(self, frame):
+		"""Crop the region of interest from the frame without copying
+
+		@param frame The frame to be cropped
+		@return (cropped_frame, offset) The view of the region of interest and
+		        the position of its top-left pixel in the frame. If the region
+		        of interest is not set or out of the frame, the whole frame is
+		        returned.
+		"""
+		roi = self._roi
+		if roi is None:
+			return frame, Point2D(0, 0)
+
+		height, width = frame.shape[:2]
+		left, top = max(roi[0].x, 0), max(roi[0].y, 0)
+		right, bottom = min(roi[1].x, width), min(roi[1].y, height)
+		if left >= right or top >= bottom:
+			return frame, Point2D(0, 0)
+		return frame[top:bottom, left:right], Point2D(left, top)
+
+	def _dispatch(self, pipeline_frame: PipelineFrame):
+		"""Pass the processed frame to all the consumers
+		"""
+		with self._dispatch_lock:
+			for consumer in self._consumers:
+				consumer(pipeline_frame)
+
+	def _run_pipeline(self):
+		"""The job of the pipeline thread
+
+		The frame is borrowed from the camera without copying. It is only
+		read while converting to HSV domain, and the converted frame is
+		discarded if the camera has overwritten the frame in the meantime.
+		"""
+		frame_seq, frame = self._camera.borrow_frame()
+		if frame is None:
+			return
+
+		frame_hsv, offset = self._convert_frame(frame)
+		if not self._camera.is_frame_valid(frame_seq):
+			self._logger.debug("Frame {0} is overwritten while converting. Discard." \
+				.format(frame_seq))
+			return
+
+		self._dispatch(PipelineFrame(frame_seq, frame_hsv, offset))
@@ -0,0 +1,356 @@
+"""@package docstring
+The sources of frames for the recognition, such as video files and images.
+"""
+
+from threading import Thread, Lock
+from util.sequence_signal import SequenceSignal
+from util import latency_monitor
+import cv2
+import logging
+import os
+import time
+
+class FrameSource:
+	"""The base class of the sources providing frames
+
+	It will create a new thread to get frames from the source.
+	The source thread has to be started first by invoking
+	FrameSource.start_camera_thread, and then accessing frames captured
+	by invoking FrameSource.get_frame or FrameSource.borrow_frame.
+
+	The frames are captured into a preallocated ring buffer, and each frame
+	captured successfully is numbered by a monotonically increasing sequence
+	number. FrameSource.borrow_frame returns a read-only view of the latest
+	frame without copying it, and the view stays intact until the source
+	thread wraps around the ring buffer. FrameSource.is_frame_valid tells
+	whether a borrowed frame is still intact. FrameSource.create_frame_trigger
+	creates a trigger for the JobThread to run once per captured frame.
+
+	The subclass implements FrameSource._read_frame to read the next frame.
+	If the fps is given, the source thread is paced to provide frames in
+	that rate, which replays the recorded frames in real time. Otherwise,
+	the frames are read as fast as possible.
+
+	Note that if you want to access FrameSource.isCaptured and
+	FrameSource.frame from another thread, you have to check the
+	FrameSource.read_lock first.
+
+	@var isCaptured Is this frame captured successfully?
+	@var frame The latest frame captured from the source
+	@var is_finished Is there no more frame in the source?
+	@var _frame_ring The ring buffer of the frames captured
+	@var _frame_seq The sequence number of FrameSource.frame. The frame is
+	     stored at _frame_ring[_frame_seq % len(_frame_ring)].
+	@var _frame_interval The interval in seconds between two frames.
+	     0 if the frames are not paced.
+	@var _new_frame_signal The SequenceSignal published when a new frame is
+	     captured
+	@var _source_thread The thread for capturing frames
+	@var is_thread_started Is the source thread started?
+	     It is also the flag for thread to keep running.
+	@var read_lock The mutex for FrameSource.isCaptured, FrameSource.frame and
+	     FrameSource._frame_seq
+	"""
+
+	def __init__(self, ring_size = 4, fps = 0):
+		"""Constructor
+
+		@param ring_size Specify the number of frames in the ring buffer.
+		       It should be at least 3.
+		@param fps Specify the rate of providing frames.
+		       0 if the frames are read as fast as possible.
+		"""
+		self._logger = logging.getLogger(self.__class__.__name__)
+		self.isCaptured = False
+		self.frame = None
+		self.is_finished = False
+		self._frame_ring = [None] * max(ring_size, 3)
+		self._frame_seq = 0
+		self._frame_interval = 1.0 / fps if fps > 0 else 0.0
+		self._new_frame_signal = SequenceSignal()
+		self._source_thread = None
+		self.is_thread_started = False
+		self.read_lock = Lock()
+
+	def _capture_first_frame(self):
+		"""Capture the first frame into the ring buffer
+
+		The subclass invokes it at the end of its constructor.
+		"""
+		(self.isCaptured, self.frame) = self._read_frame(None)
+		self._frame_ring[0] = self.frame
+
+	def _read_frame(self, frame_buffer):
+		"""Read the next frame from the source
+
+		The subclass sets FrameSource.is_finished if there is no more frame.
+
+		@param frame_buffer The preallocated frame which could be overwritten
+		       by the new frame. None if it is not allocated.
+		@return (isCaptured, frame) Is the frame read successfully, and
+		        the frame read
+		"""
+		raise NotImplementedError
+
+	def release_camera(self):
+		"""Release the source
+		"""
+		pass
+
+	def start_camera_thread(self):
+		"""Start a new thread for capturing frames from the source
+
+		The target method of the thread is FrameSource._source_read_frame.
+		If the source thread is running, the method will output the
+		message and do nothing.
+		"""
+		if self.is_thread_started:
+			self._logger.info("The source thread has been started.")
+			return
+
+		self._logger.debug("The source thread is starting.")
+
+		self._source_thread = Thread(target = self._source_read_frame, \
+			name = self.__class__.__name__)
+		self.is_thread_started = True
+		self._source_thread.start()
+
+	def stop_camera_thread(self):
+		"""Stop the running thread
+
+		If the source thread haven't started yet, the method will do
+		nothing.
+		"""
+		if self._source_thread is not None and self._source_thread.is_alive():
+			self._logger.debug("The source thread is stopping.")
+
+			self.is_thread_started = False
+			self._source_thread.join()
+
+		self.is_thread_started = False
+
+	def _source_read_frame(self):
+		"""Keep capturing frames from the source
+
+		The main job of the source thread. The frame is captured into the
+		next slot of the ring buffer, and then published to FrameSource.frame
+		with a new sequence number. FrameSource.isCaptured indicates
+		that if this frame is captured successfully or not. If it is not,
+		the previous frame remains. The thread ends when the source is finished,
+		but the last frame can still be borrowed.
+
+		Updating FrameSource.frame, FrameSource.isCaptured and
+		FrameSource._frame_seq is in the critcal section.
+		"""
+		self._logger.debug("The source thread is started.")
+
+		next_frame_time = time.monotonic()
+		while self.is_thread_started:
+			slot = (self._frame_seq + 1) % len(self._frame_ring)
+			# The frame is captured in place if the slot has been allocated
+			start_time = time.perf_counter()
+			(isCaptured, frame) = self._read_frame(self._frame_ring[slot])
+			if self.is_finished:
+				break
+			if isCaptured:
+				self._frame_ring[slot] = frame
+				latency_monitor.record(latency_monitor.STAGE_CAPTURE, \
+					time.perf_counter() - start_time)
+
+			self.read_lock.acquire()
+			self.isCaptured = isCaptured
+			if isCaptured:
+				self.frame = frame
+				self._frame_seq += 1
+			self.read_lock.release()
+
+			if isCaptured:
+				self._new_frame_signal.publish()
+
+			if self._frame_interval > 0:
+				next_frame_time += self._frame_interval
+				delay = next_frame_time - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+				else:
+					# Fall behind. Do not catch up with a burst of frames.
+					next_frame_time = time.monotonic()
+
+		self._logger.debug("The source thread is stopped.")
+
+	def get_frame(self):
+		"""Get the copy of the frame captured from the source
+
+		Use it if the frame will be modified. Otherwise, use
+		FrameSource.borrow_frame to avoid copying the frame.
+
+		If the frame is overwritten by the source thread while copying,
+		the latest frame is borrowed and copied again.
+
+		@return The frame captured if the source thread is running
+		@return None if the source thread is not running
+		"""
+		while True:
+			frame_seq, frame = self.borrow_frame()
+			if frame is None:
+				return None
+			copied_frame = frame.copy()
+			if self.is_frame_valid(frame_seq):
+				return copied_frame
+			self._logger.debug("Frame {0} is overwritten while copying. Retry." \
+				.format(frame_seq))
+
+	def borrow_frame(self):
+		"""Borrow the latest frame captured from the source without copying
+
+		The frame returned is a read-only view of the slot in the ring buffer.
+		It will be overwritten after the source thread captures
+		len(_frame_ring) - 1 more frames. Check it by FrameSource.is_frame_valid
+		after using it.
+
+		Getting the sequence number and the frame is in the critical section.
+
+		@return (frame_seq, frame) The sequence number and the view of the
+		        latest frame if the source thread is running
+		@return (-1, None) if the source thread is not running
+		"""
+		if not self.is_thread_started:
+			return -1, None
+
+		self.read_lock.acquire()
+		frame_seq, frame = self._frame_seq, self.frame
+		self.read_lock.release()
+
+		if frame is None:
+			return -1, None
+		frame_view = frame.view()
+		frame_view.flags.writeable = False
+		return frame_seq, frame_view
+
+	def create_frame_trigger(self, timeout = 0.1):
+		"""Create a trigger function that waits for a new captured frame
+
+		@param timeout Specify the maximum waiting time in seconds of each call
+		@return The trigger function for the JobThread
+		@sa SequenceSignal.create_trigger()
+		"""
+		return self._new_frame_signal.create_trigger(timeout)
+
+	def is_frame_valid(self, frame_seq) -> bool:
+		"""Is the frame borrowed still intact in the ring buffer?
+
+		The slot next to the latest frame may be being overwritten by the
+		source thread, so only the latest len(_frame_ring) - 1 frames are valid.
+
+		@param frame_seq Specify the sequence number of the frame borrowed
+		@return True if the frame has not been overwritten
+		"""
+		return 0 <= self._frame_seq - frame_seq <= len(self._frame_ring) - 2
+
+class VideoFileSource(FrameSource):
+	"""Provide the frames of a recorded video file
+
+	@var _video The cv2.VideoCapture object of the video file
+	@var _loop Replay the video from the beginning when it ends?
+	"""
+
+	def __init__(self, file_path, realtime = True, loop = False, ring_size = 4):
+		"""Constructor
+
+		@param file_path Specify the path of the video file
+		@param realtime Specify whether to provide the frames in the fps of
+		       the video or as fast as possible
+		@param loop Specify whether to replay the video when it ends
+		@param ring_size Specify the number of frames in the ring buffer
+		"""
+		video = cv2.VideoCapture(file_path)
+		fps = video.get(cv2.CAP_PROP_FPS) if realtime else 0
+		if realtime and fps <= 0:
+			fps = 30
+
+		super().__init__(ring_size, fps)
+		self._video = video
+		self._loop = loop
+
+		if not self._video.isOpened():
+			self._logger.error("Cannot open the video file \"{0}\".".format(file_path))
+			self.is_finished = True
+			return
+
+		self._capture_first_frame()
+
+		self._logger.debug("Video file \"{0}\" opened. Replayed in fps {1}." \
+			.format(file_path, fps))
+
+	def release_camera(self):
+		"""Release the video file
+		"""
+		self._logger.debug("Video file released.")
+		self._video.release()
+
+	def _read_frame(self, frame_buffer):
+		(isCaptured, frame) = self._video.read(frame_buffer)
+		if not isCaptured and self._loop:
+			self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+			(isCaptured, frame) = self._video.read(frame_buffer)
+		if not isCaptured:
+			self.is_finished = True
+		return isCaptured, frame
+
+class ImageDirectorySource(FrameSource):
+	"""Provide the images in a directory as the frames
+
+	The images are provided in the order of their file names.
+
+	@var IMAGE_EXTENSIONS The extensions of the image files to be read
+	@var _image_paths The paths of the image files
+	@var _next_image The index of the next image to be read
+	@var _loop Provide the images from the first one when all of them are read?
+	"""
+
+	IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+	def __init__(self, directory, fps = 30, realtime = True, loop = False, \
+		ring_size = 4):
+		"""Constructor
+
+		@param directory Specify the directory of the images
+		@param fps Specify the rate of providing the images if realtime is True
+		@param realtime Specify whether to provide the images in the fps or
+		       as fast as possible
+		@param loop Specify whether to provide the images from the first one
+		       when all of them are read
+		@param ring_size Specify the number of frames in the ring buffer
+		"""
+		super().__init__(ring_size, fps if realtime else 0)
+		self._image_paths = [os.path.join(directory, file_name) \
+			for file_name in sorted(os.listdir(directory)) \
+			if file_name.lower().endswith(ImageDirectorySource.IMAGE_EXTENSIONS)]
+		self._next_image = 0
+		self._loop = loop
+
+		if len(self._image_paths) == 0:
+			self._logger.error("There is no image in \"{0}\".".format(directory))
+			self.is_finished = True
+			return
+
+		self._capture_first_frame()
+
+		self._logger.debug("{0} images found in \"{1}\"." \
+			.format(len(self._image_paths), directory))
+
+	def _read_frame(self, frame_buffer):
+		if self._next_image >= len(self._image_paths):
+			if not self._loop:
+				self.is_finished = True
+				return False, None
+			self._next_image = 0
+
+		image_path = self._image_paths[self._next_image]
+		self._next_image += 1
+
+		frame = cv2.imread(image_path)
+		if frame is None:
+			self._logger.error("Cannot read the image \"{0}\".".format(image_path))
+			return False, None
+		return True, frame
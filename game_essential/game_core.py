@@ -3,13 +3,35 @@
 
 import communication_server as comm_server
 from .player_info import BasicTeamInfo, TeamType
-from maze_manager import MazeManager, MazePositionFinder
+from maze_manager import MazeManager, MazePositionFinder, MazePositionSnapshot
+from color_type import pack_color_bgr
 from util.function_delegate import FunctionDelegate
 from functools import wraps
+from threading import Lock
 import logging
+import time
 
 _logger = logging.getLogger(__name__)
 
+class _PositionSubscription:
+	"""The state of a player subscribing its position
+
+	@var player_info The player information of the subscriber
+	@var maze_pos_finder The MazePositionFinder of the team of the player
+	@var period The maximum time in seconds between two pushes
+	@var last_push_time The time of the last push
+	@var last_position The position of the last push
+	"""
+	__slots__ = ("player_info", "maze_pos_finder", "period", \
+		"last_push_time", "last_position")
+
+	def __init__(self, player_info, maze_pos_finder, period):
+		self.player_info = player_info
+		self.maze_pos_finder = maze_pos_finder
+		self.period = period
+		self.last_push_time = 0.0
+		self.last_position = None
+
 class BasicGameCore:
 	"""The basic functions in the game
 
@@ -24,8 +46,20 @@ class BasicGameCore:
 	@var _handlers The dictionary of situation-handlers for the external widgets
 	     or class to set the callback functions. See BasicGameCore._handler_init()
 	@var _is_game_started Is the game started?
+	@var _players_lock The lock for joining and quitting players. The commands
+	     from different players are handled concurrently.
+	@var _position_subscriptions The dictionary of player_IP-_PositionSubscription
+	     pair. It is replaced instead of being modified, so it can be iterated
+	     by the recognition threads without lock.
 	"""
 
+	# The maximum rate of the position pushing
+	MAX_SUBSCRIBE_HZ = 100.0
+	# The message IDs of the binary protocol
+	MSG_ID_POSITION = 0x01
+	MSG_ID_GAME_START = 0x10
+	MSG_ID_GAME_STOP = 0x11
+
 	def __init__(self, maze_manager: MazeManager, \
 		team_info_T = BasicTeamInfo):
 		"""Constructor
@@ -48,6 +82,8 @@ class BasicGameCore:
 		self._handlers = {}
 
 		self._is_game_started = False
+		self._players_lock = Lock()
+		self._position_subscriptions = {}
 
 		self._set_handler_to_server()
 		self._team_init()
@@ -92,22 +128,46 @@ class BasicGameCore:
 		  from player
 		* Set player_send_msg() when the server receives the command "send-to"
 		* Set player_team_broadcast() when the server receives the command "send-team"
+		* Set player_subscribe_position() when the server receives the command
+		  "subscribe-position"
+		* Set player_position_batch() when the server receives the command
+		  "position-batch"
+
+		For the binary protocol, "position" is sent in the frame of MSG_ID_POSITION
+		without payload, and its reply "position <x> <y>" is sent in the frame of
+		MSG_ID_POSITION with two int16 for x and y, and
+		"game-start" and "game-stop" are sent in the frames without payload.
 		"""
 		self._comm_server.set_disconnection_handler(self.player_quit)
 		self._comm_server.add_command_handler("join", self.player_join)
-		self._comm_server.add_command_handler("position", self.player_position)
+		self._comm_server.add_command_handler("position", self.player_position, \
+			self._comm_server.CommandClass.QUERY)
 		self._comm_server.add_command_handler("send-to", self.player_send_msg)
 		self._comm_server.add_command_handler("send-team", self.player_team_broadcast)
+		self._comm_server.add_command_handler("subscribe-position", \
+			self.player_subscribe_position)
+		self._comm_server.add_command_handler("position-batch", \
+			self.player_position_batch, self._comm_server.CommandClass.QUERY)
+
+		self._comm_server.add_binary_message( \
+			BasicGameCore.MSG_ID_POSITION, "position", "<hh", "")
+		self._comm_server.add_binary_message( \
+			BasicGameCore.MSG_ID_GAME_START, "game-start")
+		self._comm_server.add_binary_message( \
+			BasicGameCore.MSG_ID_GAME_STOP, "game-stop")
 
 	def _team_init(self):
 		"""Initialize the variables in the BasicTeamInfo
 
-		The method will set the team_type and MazePositionFinder to both BasicTeamInfo
+		The method will set the team_type and MazePositionFinder to both BasicTeamInfo,
+		and push the positions to the subscribers when the MazePositionFinder
+		is updated.
 		"""
 		for team_type, team_info in self._teams.items():
 			team_info.team_type = team_type
 			team_info.maze_pos_finder = \
 				self._maze_manager.get_finder_by_name(team_type.__str__())
+			team_info.maze_pos_finder.on_position_update += self._push_positions
 
 	def _handler_init(self):
 		"""Create the event handlers
@@ -160,12 +220,15 @@ class BasicGameCore:
 	def player_join(self, player_ip, *args):
 		"""The callback function when a player sends join command
 
-		The command is: "join <player ID> <team name>".
-		The response is: "server join ok" if it's success.
+		The command is: "join <player ID> <team name> [binary]".
+		The response is: "server join ok" if it's success,
 		or "server join fail" if one of the situations is occured:
 		1. The argument is not matched;
 		2. The specified <team name> is not found;
 		3. The ID is already used by another player in the same team.
+		If "binary" is specified and the player joins, the messages after
+		"join ok" are in the binary protocol. The player has to wait for
+		"join ok" before sending the binary frames. See communication_server.
 
 		The method will try to find the player's team and create a new
 		player info for that player in his team.
@@ -174,7 +237,7 @@ class BasicGameCore:
 		`BasicGameCore._handler["player_join"](player_info, team_type)`
 
 		@param player_ip Specify the IP of the player
-		@param args Specify a tuple (player ID, team name)
+		@param args Specify a tuple (player ID, team name[, "binary"])
 		"""
 		try:
 			player_ID = args[0] # IndexError
@@ -189,28 +252,32 @@ class BasicGameCore:
 			_logger.error("player-join: " \
 				"Specified team name {0} is not found.".format(team_name))
 		else:
-			# If the player has already joined
-			if self._teammates.get(player_ip) is not None:
-				self._comm_server.send_message(player_ip, "join fail")
-				_logger.error("player-join: " \
-					"IP {0} has already joined the game.".format(player_ip))
-				return
-
-			# Check if the player ID is used in the team
-			player_info = self._teams[team_type].get_player_info_by_ID(player_ID)
-			if player_info is not None:
-				self._comm_server.send_message(player_ip, "join fail")
-				_logger.error("player-join: " \
-					"Player \"{0}\" is already in the team.".format(player_ID))
-				return
-
-			player_info = self._teams[team_type] \
-				.add_player_info(player_ip, player_ID, team_name)
-
-			self._teammates[player_ip] = team_type
+			with self._players_lock:
+				# If the player has already joined
+				if self._teammates.get(player_ip) is not None:
+					self._comm_server.send_message(player_ip, "join fail")
+					_logger.error("player-join: " \
+						"IP {0} has already joined the game.".format(player_ip))
+					return
+
+				# Check if the player ID is used in the team
+				player_info = self._teams[team_type].get_player_info_by_ID(player_ID)
+				if player_info is not None:
+					self._comm_server.send_message(player_ip, "join fail")
+					_logger.error("player-join: " \
+						"Player \"{0}\" is already in the team.".format(player_ID))
+					return
+
+				player_info = self._teams[team_type] \
+					.add_player_info(player_ip, player_ID, team_name)
+
+				self._teammates[player_ip] = team_type
 			self._handlers["player-join"].invoke(player_info, team_type)
 
-			self._comm_server.send_message(player_ip, "join ok")
+			if len(args) > 2 and args[2] == "binary":
+				self._comm_server.set_binary_protocol(player_ip, "join ok")
+			else:
+				self._comm_server.send_message(player_ip, "join ok")
 
 			_logger.info("Player \"{0}\" from {1} joins the team \"{2}\"." \
 				.format(player_info.ID, player_info.IP, player_info.team_name))
@@ -225,13 +292,14 @@ class BasicGameCore:
 		@param player_ip Specify the IP of the player
 		"""
 		try:
-			team_type = self._teammates.pop(player_ip)
+			with self._players_lock:
+				team_type = self._teammates.pop(player_ip)
+				player_info = self._teams[team_type].delete_player_info(player_ip)
+				self._set_position_subscription(player_ip, None)
 		except KeyError:
 			_logger.error("player-quit: Specified player is not found.")
 			return
 		else:
-			player_info = self._teams[team_type].delete_player_info(player_ip)
-
 			self._handlers["player-quit"].invoke(player_info, team_type)
 
 			_logger.info("Player \"{0}\" from {1} quits the game." \
@@ -294,7 +362,7 @@ class BasicGameCore:
 			for msg_block in message:
 				msg_str += " " + msg_block
 
-			for to_ip, team in self._teammates.items():
+			for to_ip, team in list(self._teammates.items()):
 				if team is team_type and to_ip != player_ip:
 					self._comm_server.send_message(to_ip, "send-from {0}{1}" \
 						.format(from_ID, msg_str))
@@ -328,6 +396,161 @@ class BasicGameCore:
 			else:
 				self._comm_server.send_message(player_ip, "position -1 -1")
 
+	# @game_started
+	def player_position_batch(self, player_ip, *args):
+		"""Response the request of the positions of several players at once
+
+		The request is "position-batch <target>+", where <target> is the ID of
+		a player in the same team, or "<team name>:<player ID>" for a player
+		in any team.
+		The response is "position-batch [<target> <x> <y>]+" in the order of
+		the request. The position is "-1 -1" if the target is not found.
+		The positions are from the same recognition result.
+
+		@param player_ip Specify the IP of the player
+		@param args Specify a tuple of the targets
+		"""
+		if len(args) == 0:
+			self._comm_server.send_message(player_ip, "position-batch fail")
+			return
+
+		own_team_type = self._teammates.get(player_ip)
+		positions = [(-1, -1)] * len(args)
+		# The dictionary of TeamType-[(index of target, color_bgr)] pair
+		targets_of_team = {}
+
+		for i in range(len(args)):
+			team_name, _, player_ID = args[i].rpartition(":")
+			if len(team_name) > 0:
+				try:
+					team_type = self.team_get_type_by_name(team_name)
+				except ValueError:
+					continue
+			else:
+				team_type = own_team_type
+				if team_type is None:
+					continue
+
+			player_info = self._teams[team_type].get_player_info_by_ID(player_ID)
+			if player_info is not None:
+				targets_of_team.setdefault(team_type, []) \
+					.append((i, player_info.color_bgr))
+
+		for team_type, targets in targets_of_team.items():
+			records = self._teams[team_type].maze_pos_finder \
+				.get_maze_pos_batch([color_bgr for _, color_bgr in targets])
+			for (i, _), record in zip(targets, records):
+				if record is not None:
+					positions[i] = record.position
+
+		reply_msg = ["position-batch"]
+		for target, position in zip(args, positions):
+			reply_msg.append("{0} {1} {2}".format(target, *position))
+		self._comm_server.send_message(player_ip, " ".join(reply_msg))
+
+	def player_subscribe_position(self, player_ip, *args):
+		"""Subscribe the position of the player
+
+		The command is "subscribe-position <hz>".
+		The response is "subscribe-position ok", or "subscribe-position fail" if
+		the player hasn't joined or the <hz> is invalid.
+
+		After subscribing, the server pushes "position <x> <y>" to the player
+		when its position in the maze is changed, or at least <hz> times per
+		second. The pushing is driven by the update of the MazePositionFinder,
+		so it won't be faster than the recognition rate.
+		The subscription is canceled by "subscribe-position 0" or when the player
+		quits the game.
+
+		@param player_ip Specify the IP of the player
+		@param args Specify a tuple (hz,)
+		"""
+		try:
+			hz = float(args[0]) # IndexError, ValueError
+			if not 0.0 <= hz <= BasicGameCore.MAX_SUBSCRIBE_HZ:
+				raise ValueError
+		except (IndexError, ValueError):
+			self._comm_server.send_message(player_ip, "subscribe-position fail")
+			_logger.error("subscribe-position: " \
+				"The arguments for subscribing the position are invaild.")
+			return
+
+		with self._players_lock:
+			try:
+				team_type = self._teammates[player_ip]
+			except KeyError:
+				self._comm_server.send_message(player_ip, "subscribe-position fail")
+				return
+
+			if hz > 0.0:
+				team_info = self._teams[team_type]
+				subscription = _PositionSubscription( \
+					team_info.get_player_info_by_IP(player_ip), \
+					team_info.maze_pos_finder, 1.0 / hz)
+			else:
+				subscription = None
+			self._set_position_subscription(player_ip, subscription)
+
+		self._comm_server.send_message(player_ip, "subscribe-position ok")
+
+	def _set_position_subscription(self, player_ip, subscription):
+		"""Replace the _position_subscriptions with the new subscription
+
+		The caller should hold _players_lock.
+
+		@param player_ip Specify the IP of the player
+		@param subscription Specify the _PositionSubscription, or None to
+		       cancel the subscription
+		"""
+		subscriptions = self._position_subscriptions.copy()
+		if subscription is not None:
+			subscriptions[player_ip] = subscription
+		elif subscriptions.pop(player_ip, None) is None:
+			return
+		self._position_subscriptions = subscriptions
+
+	def _push_positions(self, maze_pos_finder: MazePositionFinder, \
+		snapshot: MazePositionSnapshot):
+		"""Push the positions to the subscribers of the team of the finder
+
+		The callback function of MazePositionFinder.on_position_update.
+		The position is pushed if it is changed or the period of the
+		subscription is passed.
+
+		@param maze_pos_finder The MazePositionFinder which is updated
+		@param snapshot The new MazePositionSnapshot of the finder
+		"""
+		now = time.monotonic()
+		for player_ip, subscription in self._position_subscriptions.items():
+			if subscription.maze_pos_finder is not maze_pos_finder:
+				continue
+
+			where = snapshot.color_index.get( \
+				pack_color_bgr(subscription.player_info.color_bgr))
+			if where is not None:
+				position = snapshot.positions[where].position
+			else:
+				position = (-1, -1)
+
+			if position == subscription.last_position and \
+				now - subscription.last_push_time < subscription.period:
+				continue
+
+			subscription.last_position = position
+			subscription.last_push_time = now
+			self._comm_server.send_message(player_ip, "position {0} {1}" \
+				.format(*position))
+
+	def release(self):
+		"""Stop the game and remove the callbacks set to the MazePositionFinders
+
+		Call it before the game core is discarded, so the MazePositionFinders
+		won't keep invoking it.
+		"""
+		self.game_stop()
+		for team_info in self._teams.values():
+			team_info.maze_pos_finder.on_position_update -= self._push_positions
+
 	@game_stopped
 	def game_start(self):
 		"""Start the game
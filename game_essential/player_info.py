@@ -2,6 +2,8 @@
 """
 from enum import Enum, auto
 from threading import Lock
+from color_type import pack_color_bgr
+from util.function_delegate import FunctionDelegate
 
 class BasicPlayerInfo:
 	"""A data struture for the player information
@@ -10,12 +12,25 @@ class BasicPlayerInfo:
 	@var IP The IP of the player. It is the main searching key for the player.
 	@var team_name The name of the team that this player belongs to
 	@vat color_bgr The LED color of the player's maze car
+	@var color_changed The FunctionDelegate invoked with (player_info, old_color_bgr)
+	     after color_bgr is changed
 	"""
 	def __init__(self):
 		self.ID = None
 		self.IP = None
 		self.team_name = ""
-		self.color_bgr = [0, 0, 0]
+		self._color_bgr = [0, 0, 0]
+		self.color_changed = FunctionDelegate()
+
+	@property
+	def color_bgr(self):
+		return self._color_bgr
+
+	@color_bgr.setter
+	def color_bgr(self, color_bgr):
+		old_color_bgr = self._color_bgr
+		self._color_bgr = color_bgr
+		self.color_changed.invoke(self, old_color_bgr)
 
 class TeamType(Enum):
 	"""A enum for the type of the team used to distinguish the different team
@@ -43,6 +58,9 @@ class BasicTeamInfo:
 	@var maze_pos_finder The MazePositionFinder belongs to this team
 	@var _players_read_lock A lock to avoid that _players is changed while reading it
 	@var _players The dictionary stores the player IP-BasicPlayerInfo pair
+	@var _players_by_ID The dictionary stores the player ID-BasicPlayerInfo pair
+	@var _players_by_color The dictionary stores the packed LED color-BasicPlayerInfo
+	     pair. If several players have the same color, only one of them is stored.
 	"""
 
 	def __init__(self, player_info_T = BasicPlayerInfo):
@@ -56,6 +74,8 @@ class BasicTeamInfo:
 		self.maze_pos_finder = None
 		self._players_read_lock = Lock()
 		self._players = {}
+		self._players_by_ID = {}
+		self._players_by_color = {}
 
 	def add_player_info(self, player_ip, player_ID, team_name) -> BasicPlayerInfo:
 		"""Add the new player to this team
@@ -74,6 +94,10 @@ class BasicTeamInfo:
 		new_player_info.team_name = team_name
 		with self._players_read_lock:
 			self._players[player_ip] = new_player_info
+			self._players_by_ID[player_ID] = new_player_info
+			self._players_by_color.setdefault( \
+				pack_color_bgr(new_player_info.color_bgr), new_player_info)
+		new_player_info.color_changed += self._update_player_color_index
 		return new_player_info
 
 	def delete_player_info(self, player_ip) -> BasicPlayerInfo:
@@ -87,7 +111,12 @@ class BasicTeamInfo:
 		target_player_info = self.get_player_info_by_IP(player_ip)
 
 		if target_player_info is not None:
+			target_player_info.color_changed -= self._update_player_color_index
 			with self._players_read_lock:
+				if self._players_by_ID.get(target_player_info.ID) is target_player_info:
+					del self._players_by_ID[target_player_info.ID]
+				self._remove_from_color_index(target_player_info, \
+					target_player_info.color_bgr)
 				return self._players.pop(player_ip, None)
 
 	def get_player_info_by_IP(self, player_ip) -> BasicPlayerInfo:
@@ -107,11 +136,7 @@ class BasicTeamInfo:
 		@return The specified player information
 		@retval None If it is not found
 		"""
-		with self._players_read_lock:
-			for player_info in self._players.values():
-				if player_info.ID == player_ID:
-					return player_info
-		return None
+		return self._players_by_ID.get(player_ID)
 
 	def set_player_color(self, player_ip, color_bgr):
 		"""Set the LED color of the player
@@ -131,11 +156,34 @@ class BasicTeamInfo:
 		@return The specified color information
 		@retval None If it is not found
 		"""
+		return self._players_by_color.get(pack_color_bgr(color_bgr))
+
+	def _update_player_color_index(self, player_info, old_color_bgr):
+		"""Move the player to the new color in _players_by_color
+
+		It is invoked by BasicPlayerInfo.color_changed.
+		"""
 		with self._players_read_lock:
-			for player_info in self._players.values():
-				if player_info.color_bgr == color_bgr:
-					return player_info
-		return None
+			self._remove_from_color_index(player_info, old_color_bgr)
+			self._players_by_color.setdefault( \
+				pack_color_bgr(player_info.color_bgr), player_info)
+
+	def _remove_from_color_index(self, player_info, color_bgr):
+		"""Remove the player of the color from _players_by_color
+
+		If there is another player having the same color, that player will be
+		stored instead. The caller should hold _players_read_lock.
+		"""
+		packed_color = pack_color_bgr(color_bgr)
+		if self._players_by_color.get(packed_color) is not player_info:
+			return
+
+		del self._players_by_color[packed_color]
+		for other_info in self._players.values():
+			if other_info is not player_info and \
+				pack_color_bgr(other_info.color_bgr) == packed_color:
+				self._players_by_color[packed_color] = other_info
+				break
 
 	def get_all_players(self) -> list:
 		"""Get the copy of the _players
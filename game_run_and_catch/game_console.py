@@ -49,7 +49,7 @@ class GameConsoleWidget(LabelFrame):
 	def destroy(self):
 		super().destroy()
 		if self._game_core.is_game_started:
-			self._game_core.gamecore_thread.stop()
+			self._game_core.game_stop()
 
 	def _setup_layout(self):
 		control_panel = Frame(self, name = "control_panel")
@@ -3,10 +3,15 @@
 
 from game_essential import BasicGameCore
 from game_essential import BasicPlayerInfo, BasicTeamInfo, TeamType
-from maze_manager import MazeManager, MazePosition
+from maze_manager import MazeManager, MazePositionFinder, \
+	MazePositionSnapshot, MazePositionRecord
+from color_type import pack_color_bgr
 from point import Point2D
-from util.job_thread import JobThread
 from util.function_delegate import FunctionDelegate
+from threading import Lock
+import logging
+
+_logger = logging.getLogger(__name__)
 
 class PlayerInfo(BasicPlayerInfo):
 	def __init__(self):
@@ -21,6 +26,24 @@ class GameCore(BasicGameCore):
 	"""The game core of the game
 
 	Team A is Team Catcher. Team B is the Team Runner.
+
+	The catching is checked when the MazePositionFinder of a team is updated.
+	Only the cars whose position is changed are checked, and only against
+	the cars of the other team in the same block or the nearby blocks.
+
+	@var _catch_lock The lock for checking the catching. The MazePositionFinders
+	     of both teams are updated in their own threads.
+	@var _last_position_details The dictionary of TeamType-{packed color:
+	     position_detail} pair storing the positions checked last time
+	@var _cars_in_block The dictionary of TeamType-{block: [MazePositionRecord]}
+	     pair storing the cars of each team in each block of the maze
+	@var _maze_size The size of the maze in blocks in Point2D(width, height)
+	@var _maze_map A bytearray storing the connection bits of each block.
+	     The block (x, y) is at the index y * width + x.
+	@var _touch_table A bytearray of (width * height)^2 elements. The element
+	     at [runner_index * width * height + catcher_index] is 1 if the
+	     catcher in the block of catcher_index can touch the runner in the
+	     block of runner_index.
 	"""
 	# The alias of the TeamType
 	TEAM_CATCHER = TeamType.A
@@ -30,15 +53,26 @@ class GameCore(BasicGameCore):
 	SIDE_RIGHT = 1 << 1
 	SIDE_DOWN = 1 << 2
 	SIDE_LEFT = 1 << 3
+	# The message ID of "game-catched" in the binary protocol
+	MSG_ID_GAME_CATCHED = 0x12
+	# The offsets of the blocks where the car could catch or be catched
+	NEARBY_BLOCKS = (Point2D(0, 0), Point2D(0, 1), Point2D(1, 0), \
+		Point2D(0, -1), Point2D(-1, 0))
 
 	def __init__(self, maze_manager: MazeManager):
 		super().__init__(maze_manager, TeamInfo)
 
 		self._num_of_survivor = 0
-		self._maze_map = None
+		self._maze_size = Point2D(0, 0)
+		self._maze_map = bytearray()
+		self._touch_table = bytearray()
 		self._init_maze_map()
 
-		self.gamecore_thread = JobThread(self.gamecore, call_every_sec = 0.01)
+		self._catch_lock = Lock()
+		self._last_position_details = {}
+		self._cars_in_block = {}
+		for team_info in self._teams.values():
+			team_info.maze_pos_finder.on_position_update += self._check_catch
 
 	def _init_maze_map(self):
 		"""Initialize the connections between each block in the maze
@@ -47,26 +81,81 @@ class GameCore(BasicGameCore):
 		The 4 bits repesent 4 directions, which are UP (bit 0), RIGHT (bit 1),
 		DOWN (bit 2), and LEFT (bit 3).
 		If there is no wall between two blocks, then the bit is set.
-		"""
-		# Create a 8 x 8 2D list
-		self._maze_map = [[0 for col in range(8)] for row in range(8)]
 
+		In the map file, each line is the binary number of a block, and the
+		rows are separated by blank lines. The lines started with '#' are
+		ignored. The size of the maze is decided by the map file, but all the
+		rows must have the same number of blocks.
+		"""
+		rows = []
+		row = []
 		with open("game_run_and_catch/maze_map.txt") as f:
-			for row in range(len(self._maze_map)):
-				for col in range(len(self._maze_map[row])):
-					data = ""
-					# Ignore newline or the line started with '#'
-					while len(data) <= 1 or data[0] == '#':
-						data = f.readline()
-
+			for line in f:
+				line = line.strip()
+				if len(line) == 0:
+					if len(row) > 0:
+						rows.append(row)
+						row = []
+				elif line[0] != '#':
 					# Map data is a binary number
-					self._maze_map[row][col] = int(data, 2)
+					row.append(int(line, 2))
+		if len(row) > 0:
+			rows.append(row)
+
+		if len(rows) == 0 or any(len(row) != len(rows[0]) for row in rows):
+			raise ValueError("The rows of the maze map are empty or " \
+				"in different lengths.")
+
+		self._maze_size = Point2D(len(rows[0]), len(rows))
+		self._maze_map = bytearray(block for row in rows for block in row)
+		self._init_touch_table()
+
+	def _init_touch_table(self):
+		"""Precompute whether a car can touch the car in each block
+
+		A car can touch the car in the same block, or in the nearby block
+		connected to its block.
+		"""
+		width, height = self._maze_size
+		num_of_blocks = width * height
+		self._touch_table = bytearray(num_of_blocks * num_of_blocks)
+
+		# Use the position of the runner as the reference point
+		connection_bits = (
+			(Point2D(0, 1), GameCore.SIDE_UP),
+			(Point2D(1, 0), GameCore.SIDE_RIGHT),
+			(Point2D(0, -1), GameCore.SIDE_DOWN),
+			(Point2D(-1, 0), GameCore.SIDE_LEFT)
+		)
+
+		for runner_index in range(num_of_blocks):
+			runner_block = Point2D(runner_index % width, runner_index // width)
+			self._touch_table[runner_index * num_of_blocks + runner_index] = 1
+
+			for offset, connection_bit in connection_bits:
+				catcher_index = self._get_block_index(runner_block + offset)
+				if catcher_index >= 0 and \
+					self._maze_map[runner_index] & connection_bit != 0:
+					self._touch_table[runner_index * num_of_blocks + catcher_index] = 1
+
+	def _get_block_index(self, block: Point2D) -> int:
+		"""Get the index of the block in the _maze_map
+
+		@return The index of the block. -1 if the block is out of the maze.
+		"""
+		width, height = self._maze_size
+		if block.x < 0 or block.x >= width or block.y < 0 or block.y >= height:
+			return -1
+		return block.y * width + block.x
 
 	def _set_handler_to_server(self):
 		super()._set_handler_to_server()
 		self._comm_server.add_command_handler("game-touch", self.game_touch)
-		self._comm_server.add_command_handler("position-team", self.player_position_team)
-		self._comm_server.add_command_handler("position-enemy", self.player_position_enemy)
+		self._comm_server.add_command_handler("position-team", self.player_position_team, \
+			self._comm_server.CommandClass.QUERY)
+		self._comm_server.add_command_handler("position-enemy", self.player_position_enemy, \
+			self._comm_server.CommandClass.QUERY)
+		self._comm_server.add_binary_message(GameCore.MSG_ID_GAME_CATCHED, "game-catched")
 
 	def _handler_init(self):
 		super()._handler_init()
@@ -82,7 +171,7 @@ class GameCore(BasicGameCore):
 		Note that if the request is sent from the player who is catched, it won't
 		reply the request.
 		"""
-		reply_msg = "position-team"
+		reply_msg = ["position-team"]
 
 		team_type = self._teammates[player_ip]
 		player_info = self._teams[team_type].get_player_info_by_IP(player_ip)
@@ -90,18 +179,16 @@ class GameCore(BasicGameCore):
 		if player_info.is_catched:
 			return
 
-		maze_pos_finder = self._teams[team_type].maze_pos_finder
-
-		for player_info in self._teams[team_type]._players.values():
-			reply_msg += " " + player_info.ID
+		players = list(self._teams[team_type].get_all_players().values())
+		records = self._teams[team_type].maze_pos_finder.get_maze_pos_batch( \
+			[player_info.color_bgr for player_info in players])
 
-			pos = maze_pos_finder.get_maze_pos(player_info.color_bgr)
-			if pos is not None:
-				reply_msg += " {0} {1}".format(*pos.position)
-			else:
-				reply_msg += " -1 -1"
+		for player_info, record in zip(players, records):
+			reply_msg.append(player_info.ID)
+			reply_msg.append("{0} {1}".format(*record.position) \
+				if record is not None else "-1 -1")
 
-		self._comm_server.send_message(player_ip, reply_msg)
+		self._comm_server.send_message(player_ip, " ".join(reply_msg))
 
 	# @BasicGameCore.game_started
 	def player_position_enemy(self, player_ip):
@@ -113,7 +200,7 @@ class GameCore(BasicGameCore):
 		Note that if the request is sent from the player who is catched, it won't
 		reply the request.
 		"""
-		reply_msg = "position-enemy"
+		reply_msg = ["position-enemy"]
 
 		team_type = self._teammates[player_ip]
 		player_info = self._teams[team_type].get_player_info_by_IP(player_ip)
@@ -126,16 +213,29 @@ class GameCore(BasicGameCore):
 		else:
 			target_team_type = GameCore.TEAM_RUNNER
 
-		maze_pos_finder = self._teams[target_team_type].maze_pos_finder
+		players = self._teams[target_team_type].get_all_players().values()
+		records = self._teams[target_team_type].maze_pos_finder.get_maze_pos_batch( \
+			[player_info.color_bgr for player_info in players])
+
+		for record in records:
+			reply_msg.append("{0} {1}".format(*record.position) \
+				if record is not None else "-1 -1")
+
+		self._comm_server.send_message(player_ip, " ".join(reply_msg))
+
+	def player_position_batch(self, player_ip, *args):
+		"""Response the request of the positions of several players at once
 
-		for player_info in self._teams[target_team_type]._players.values():
-			pos = maze_pos_finder.get_maze_pos(player_info.color_bgr)
-			if pos is not None:
-				reply_msg += " {0} {1}".format(*pos.position)
-			else:
-				reply_msg += " -1 -1"
+		Same as BasicGameCore.player_position_batch(), but it won't reply the
+		request sent from the player who is catched.
+		"""
+		team_type = self._teammates.get(player_ip)
+		if team_type is not None:
+			player_info = self._teams[team_type].get_player_info_by_IP(player_ip)
+			if player_info is not None and player_info.is_catched:
+				return
 
-		self._comm_server.send_message(player_ip, reply_msg)
+		super().player_position_batch(player_ip, *args)
 
 	@BasicGameCore.game_started
 	def game_touch(self, player_ip):
@@ -147,77 +247,145 @@ class GameCore(BasicGameCore):
 		if player_info is not None:
 			self.game_stop()
 
+	def release(self):
+		"""Stop the game and remove the callbacks set to the MazePositionFinders
+		"""
+		super().release()
+		for team_info in self._teams.values():
+			team_info.maze_pos_finder.on_position_update -= self._check_catch
+
 	@BasicGameCore.game_stopped
 	def game_start(self):
-		self._num_of_survivor = self._teams[GameCore.TEAM_RUNNER].num_of_players()
-		for player_info in self._teams[GameCore.TEAM_RUNNER]._players.values():
-			player_info.is_catched = False
-		self.gamecore_thread.start()
+		with self._catch_lock:
+			self._num_of_survivor = self._teams[GameCore.TEAM_RUNNER].num_of_players()
+			for player_info in self._teams[GameCore.TEAM_RUNNER].get_all_players().values():
+				player_info.is_catched = False
+			# All the cars are checked at the first update
+			self._last_position_details = {team_type: {} for team_type in self._teams}
+			self._cars_in_block = {team_type: {} for team_type in self._teams}
 		super().game_start()
 
-	@BasicGameCore.game_started
-	def game_stop(self):
-		self.gamecore_thread.stop_without_wait()
-		super().game_stop()
-
-	def gamecore(self):
-		"""Keep tracking the status of the runners and the catchers
+	def _check_catch(self, maze_pos_finder: MazePositionFinder, \
+		snapshot: MazePositionSnapshot):
+		"""Check if the moved cars catch or are catched by the nearby cars
 
-		The method will get the maze position of all the players, and
-		test each runner-catcher pair. If the runner is catched by a catcher,
-		the method will send a "game-catched" to the runner, and set the status
-		of that runner to "catched". Then, invoke the handler of "game-catched".
+		The callback function of MazePositionFinder.on_position_update.
+		Each car that is moved since the last update is tested with the cars of
+		the other team in GameCore.NEARBY_BLOCKS. If the runner is catched by
+		a catcher, the method will send a "game-catched" to the runner, and set
+		the status of that runner to "catched". Then, invoke the handler of
+		"game-catched".
 
 		If there is no runner who is still alive, then the game will be stopped.
+
+		The method is run in the recognition thread of the MazePositionFinder,
+		so the exception is logged instead of stopping the thread.
+
+		@param maze_pos_finder The MazePositionFinder which is updated
+		@param snapshot The new MazePositionSnapshot of the finder
 		"""
-		runners = self._teams[GameCore.TEAM_RUNNER].maze_pos_finder.get_all_maze_pos()
-		catchers = self._teams[GameCore.TEAM_CATCHER].maze_pos_finder.get_all_maze_pos()
-
-		for runner in runners:
-			for catcher in catchers:
-				if self.is_catch(runner, catcher):
-					runner_info = self._teams[GameCore.TEAM_RUNNER] \
-						.get_player_info_by_color(runner.color_bgr)
-					catcher_info = self._teams[GameCore.TEAM_CATCHER] \
-						.get_player_info_by_color(catcher.color_bgr)
-					if runner_info is None or catcher_info is None or \
-						runner_info.is_catched:
-						continue
-
-					runner_info.is_catched = True
-					self._comm_server.send_message(runner_info.IP, "game-catched")
-					self._handlers["game-catched"].invoke(runner_info.IP)
-					self._num_of_survivor -= 1
-
-					print("[GameCore] Runner \"{0}\" is catched by \"{1}\"." \
-						.format(runner_info.ID, catcher_info.ID))
-					break
-
-		if self._num_of_survivor <= 0:
-			self.game_stop()
+		if not self._is_game_started:
+			return
+
+		if maze_pos_finder is self._teams[GameCore.TEAM_RUNNER].maze_pos_finder:
+			team_type, other_team_type = GameCore.TEAM_RUNNER, GameCore.TEAM_CATCHER
+		else:
+			team_type, other_team_type = GameCore.TEAM_CATCHER, GameCore.TEAM_RUNNER
+
+		with self._catch_lock:
+			# The game may be stopped by the update of the other team
+			if not self._is_game_started:
+				return
+
+			try:
+				moved_cars = self._update_cars_in_block(team_type, snapshot.positions)
+				other_cars_in_block = self._cars_in_block[other_team_type]
+
+				for car in moved_cars:
+					for offset in GameCore.NEARBY_BLOCKS:
+						for other_car in other_cars_in_block.get(car.position + offset, ()):
+							if team_type is GameCore.TEAM_RUNNER:
+								runner, catcher = car, other_car
+							else:
+								runner, catcher = other_car, car
+
+							if self.is_catch(runner, catcher):
+								self._catch_runner(runner, catcher)
+			except Exception:
+				_logger.exception("Exception occured while checking the catch " \
+					"of the team {0}".format(team_type))
+
+			if self._num_of_survivor <= 0:
+				try:
+					self.game_stop()
+				except Exception:
+					_logger.exception("Exception occured while stopping the game")
+
+	def _update_cars_in_block(self, team_type: TeamType, positions) -> list:
+		"""Update the cars in each block of the team
+
+		The cars which are not in the maze are not put in any block.
+
+		@param team_type Specify the type of the team
+		@param positions Specify the MazePositionRecords of the team
+		@return A list of MazePositionRecords of the cars whose position is
+		        changed since the last update
+		"""
+		last_position_details = self._last_position_details[team_type]
+		position_details = {}
+		cars_in_block = {}
+		moved_cars = []
+
+		for car in positions:
+			packed_color = pack_color_bgr(car.color_bgr)
+			position_details[packed_color] = car.position_detail
+			if car.position.x < 0:
+				continue
+
+			cars_in_block.setdefault(car.position, []).append(car)
+			if last_position_details.get(packed_color) != car.position_detail:
+				moved_cars.append(car)
+
+		self._last_position_details[team_type] = position_details
+		self._cars_in_block[team_type] = cars_in_block
+		return moved_cars
 
-	def is_catch(self, runner: MazePosition, catcher: MazePosition) -> bool:
+	def _catch_runner(self, runner: MazePositionRecord, catcher: MazePositionRecord):
+		"""Set the runner to be catched by the catcher
+
+		The caller should hold _catch_lock.
+		"""
+		runner_info = self._teams[GameCore.TEAM_RUNNER] \
+			.get_player_info_by_color(runner.color_bgr)
+		catcher_info = self._teams[GameCore.TEAM_CATCHER] \
+			.get_player_info_by_color(catcher.color_bgr)
+		if runner_info is None or catcher_info is None or \
+			runner_info.is_catched:
+			return
+
+		runner_info.is_catched = True
+		self._num_of_survivor -= 1
+		self._comm_server.send_message(runner_info.IP, "game-catched")
+		self._handlers["game-catched"].invoke(runner_info.IP)
+
+		print("[GameCore] Runner \"{0}\" is catched by \"{1}\"." \
+			.format(runner_info.ID, catcher_info.ID))
+
+	def is_catch(self, runner: MazePositionRecord, catcher: MazePositionRecord) -> bool:
 		"""Check if the catcher catches the runner
 		"""
 		# Neither runner nor catcher is in the maze, return False.
 		if runner.position_detail.x < 0 or catcher.position_detail.x < 0:
 			return False
 
-		if Point2D.distance(runner.position_detail, catcher.position_detail) < 12.0:
-			if catcher.position == runner.position:
-				return True
-
-			# Use the position of the runner as the reference point
-			connection_bit = {
-				Point2D(0, 1): GameCore.SIDE_UP,
-				Point2D(1, 0): GameCore.SIDE_RIGHT,
-				Point2D(0, -1): GameCore.SIDE_DOWN,
-				Point2D(-1, 0): GameCore.SIDE_LEFT
-			}.get(catcher.position - runner.position, 0)
+		runner_index = self._get_block_index(runner.position)
+		catcher_index = self._get_block_index(catcher.position)
+		if runner_index < 0 or catcher_index < 0:
+			return False
 
-			# If the block where the runner at and the block where the cather at
-			# is connected, return True
-			if self._maze_map[runner.position.y][runner.position.x] & connection_bit != 0:
-				return True
+		# If the block where the runner at and the block where the cather at
+		# is the same or connected, check the distance between them
+		if self._touch_table[runner_index * len(self._maze_map) + catcher_index] == 0:
+			return False
 
-		return False
+		return Point2D.distance(runner.position_detail, catcher.position_detail) < 12.0
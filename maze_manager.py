@@ -6,13 +6,16 @@ such as the size of the maze, the position of the maze cars.
 import cv2
 import numpy as np
 import logging
+import time
+from collections import namedtuple
 from operator import attrgetter
-from threading import Lock
 
 from point import Point2D
 from color_type import *
 from color_position_finder import *
 from util.job_thread import JobThread
+from util.function_delegate import FunctionDelegate
+from util import latency_monitor
 
 class MazePosition:
 	"""A data structure for the position of the maze car in the maze
@@ -65,6 +68,27 @@ class MazePosition:
 		new_item.position_detail = self.position_detail
 		return new_item
 
+	def to_record(self):
+		"""Return an immutable record of itself
+
+		@return A MazePositionRecord object
+		"""
+		return MazePositionRecord(self.color_bgr, self.LED_height, \
+			self.position, self.position_detail)
+
+# An immutable record of the MazePosition published to the readers.
+# It has the same fields as MazePosition, and it must not be modified.
+MazePositionRecord = namedtuple("MazePositionRecord", \
+	["color_bgr", "LED_height", "position", "position_detail"])
+
+# The maze positions of all the target colors at a frame.
+# frame_seq is the sequence number of the frame that the positions are from,
+# -1 if there is no frame recognized yet. positions is a tuple of
+# MazePositionRecord in the order of the target colors. color_index is
+# a dictionary maps the packed color to its index in positions.
+MazePositionSnapshot = namedtuple("MazePositionSnapshot", \
+	["frame_seq", "positions", "color_index"])
+
 class MazePositionFinder:
 	"""Find the position of the colors in the maze
 
@@ -72,6 +96,14 @@ class MazePositionFinder:
 	(which is from ColorPositionFinder) to find the position of the colors in
 	the maze.
 
+	If the lookup table is used, the maze positions of every pixel in the
+	region of interest are precomputed for each distinct LED height when the
+	recognition starts. Then the maze position of a pixel is an array index
+	instead of the matrix math. The pixels outside the region of interest are
+	still transformed by the matrices.
+
+	@var MAX_LOOKUP_TABLE_SIZE The maximum size in bytes of the lookup tables.
+	     If the tables needed are larger than it, the lookup table won't be used.
 	@var _color_pos_finder The ColorPosFinder that contains the colors to be found
 	     in the MazePositionFinder
 	@var _finder_name The name of the finder
@@ -80,16 +112,42 @@ class MazePositionFinder:
 	     coordinate to the coordinate of the upper plane of the maze
 	@var _lower_transform_mat Similar to _upper_transform_mat, but for
 	     the lower plane of the maze
-	@var _colors_to_find A list of MazePosition
-	@var _colors_to_find_lock A lock for accessing _colors_to_find
+	@var _colors_to_find A list of MazePosition. It is only modified by the
+	     _recognition_thread or while the recognition is stopped.
+	@var _color_index A dictionary maps the packed color to its index in
+	     _colors_to_find. It is replaced instead of being modified, so it
+	     can be shared with the snapshots.
+	@var _snapshot The latest MazePositionSnapshot. It is replaced as a whole
+	     instead of being modified, so the readers get the consistent positions
+	     without any lock.
 	@var _ratio_to_wall_height_array An array of the ratio of LED height to the
 	     maze wall height of each color in _colors_to_find
 	@var _max_missing_counter The maximum number of missing counter that will
 	     treat this color as missing
-	@var _recognition_thread A JobThread for recognizing the car position
+	@var _recognition_thread A JobThread for recognizing the car position.
+	     It is triggered by the new result of the _color_pos_finder, so the
+	     car position is calculated once per frame.
+	@var _use_lookup_table Is the lookup table used?
+	@var _roi The region of interest in the tuple of (top_left, bottom_right)
+	     covered by the lookup table. None if it is not set.
+	@var _lookup_table_origin The pixel position of the element [0, 0] of
+	     the lookup table
+	@var _lookup_table_ids An array of the index of the lookup table of each
+	     color in _colors_to_find
+	@var _pos_lookup_table A (number of LED heights) x height x width x 2 array
+	     stores the maze position of each pixel in the region of interest.
+	     None if the lookup table is not used.
+	@var _pos_detail_lookup_table Similar to _pos_lookup_table, but for
+	     the detailed position
+	@var on_position_update The FunctionDelegate invoked with
+	     (maze_pos_finder, snapshot) in the _recognition_thread after a new
+	     MazePositionSnapshot is published
 	"""
 
-	def __init__(self, finder_name, color_pos_finder: ColorPositionFinder, fps = 30):
+	MAX_LOOKUP_TABLE_SIZE = 64 * 1024 * 1024
+
+	def __init__(self, finder_name, color_pos_finder: ColorPositionFinder, fps = 30, \
+		use_lookup_table = False):
 		self._logger = logging.getLogger(self.__class__.__name__)
 		self._finder_name = finder_name
 		self._color_pos_finder = color_pos_finder
@@ -100,8 +158,18 @@ class MazePositionFinder:
 		self._upper_transform_mat_detail = None
 		self._lower_transform_mat_detail = None
 		self._colors_to_find = []
-		self._colors_to_find_lock = Lock()
-		self._ratio_to_wall_height_array = []
+		self._color_index = {}
+		self._snapshot = MazePositionSnapshot(-1, (), self._color_index)
+		self._ratio_to_wall_height_array = np.zeros((0, 1), dtype = np.float32)
+
+		self._use_lookup_table = use_lookup_table
+		self._roi = None
+		self._lookup_table_origin = Point2D(0, 0)
+		self._lookup_table_ids = None
+		self._pos_lookup_table = None
+		self._pos_detail_lookup_table = None
+
+		self.on_position_update = FunctionDelegate()
 
 		try:
 			if int(fps) < 1:
@@ -113,7 +181,8 @@ class MazePositionFinder:
 		self._max_missing_counter = fps * 5	# 5 seconds
 
 		self._recognition_thread = JobThread(self._recognize_pos_in_maze, \
-			"Car_{0}".format(finder_name), 1.0 / fps)
+			"Car_{0}".format(finder_name), 1.0 / fps, fixed_rate = True, \
+			trigger = color_pos_finder.create_result_trigger())
 
 		self._logger.debug("Finder {0} is run in fps {1}." \
 			.format(finder_name, fps))
@@ -137,6 +206,30 @@ class MazePositionFinder:
 		self._upper_transform_mat_detail = upper_plane_detail
 		self._lower_transform_mat_detail = lower_plane_detail
 
+	def set_roi(self, top_left: Point2D, bottom_right: Point2D):
+		"""Set the region of interest covered by the lookup table
+
+		@param top_left Specify the top-left corner of the region
+		@param bottom_right Specify the bottom-right corner of the region
+		       (exclusive)
+		"""
+		self._roi = (top_left, bottom_right)
+
+	def clear_roi(self):
+		"""Clear the region of interest, so the lookup table is not generated
+		until it is set again
+		"""
+		self._roi = None
+
+	def get_lookup_table_size(self) -> int:
+		"""Get the memory used by the lookup tables
+
+		@return The size of the lookup tables in bytes. 0 if it is not used.
+		"""
+		if self._pos_lookup_table is None:
+			return 0
+		return self._pos_lookup_table.nbytes + self._pos_detail_lookup_table.nbytes
+
 	def add_target_color(self, color_bgr, LED_height = 0.0):
 		"""Add a target color to the position finding list
 
@@ -147,15 +240,17 @@ class MazePositionFinder:
 			self._logger.error("Cannot add colors while recognizing.")
 			return
 
-		try:
-			where = self._colors_to_find.index(MazePosition(color_bgr, 0))
-		except ValueError:
+		where = self._color_index.get(pack_color_bgr(color_bgr))
+		if where is None:
 			self._colors_to_find.append(MazePosition(color_bgr, LED_height))
+			self._update_color_index()
+			self._publish_snapshot(-1)
 			self._logger.info("New target color ({0}, {1}, {2}) is added " \
 				"to the finder \"{3}\"." \
 				.format(*color_bgr, self._finder_name))
 		else:
 			self._colors_to_find[where].LED_height = LED_height
+			self._publish_snapshot(-1)
 			self._logger.info("LED height of color ({0}, {1}, {2}) " \
 				"in the finder \"{3}\" is updated." \
 				.format(*color_bgr, self._finder_name))
@@ -169,53 +264,77 @@ class MazePositionFinder:
 			self._logger.error("Cannot delete colors while recognizing.")
 			return
 
-		try:
-			where = self._colors_to_find.index(MazePosition(color_bgr, 0))
-		except ValueError:
+		where = self._color_index.get(pack_color_bgr(color_bgr))
+		if where is None:
 			self._logger.error("Cannot delele color ({0}, {1}, {2}). " \
 				"It is not in the finder \"{3}\"." \
 				.format(*color_bgr, self._finder_name))
 		else:
-			self._colors_to_find.remove(self._colors_to_find[where])
+			del self._colors_to_find[where]
+			self._update_color_index()
+			self._publish_snapshot(-1)
 			self._logger.info("Target color ({0}, {1}, {2}) is deleted " \
 				"from the finder \"{3}\"." \
 				.format(*color_bgr, self._finder_name))
 
-	def get_maze_pos(self, color_bgr) -> MazePosition:
+	def get_snapshot(self) -> MazePositionSnapshot:
+		"""Get the latest maze positions of all the target colors
+
+		@return The MazePositionSnapshot object. It must not be modified.
+		"""
+		return self._snapshot
+
+	def get_maze_pos(self, color_bgr) -> MazePositionRecord:
 		"""Get the maze position of the specified color
 
 		@param color_bgr Specify the color in BGR domain
-		@return The copy MazePosition object of the specified color
+		@return The MazePositionRecord object of the specified color
 		@retval None if the specicifed color is not found
 		"""
-		try:
-			where = self._colors_to_find.index(MazePosition(color_bgr, 0))
-		except ValueError:
+		snapshot = self._snapshot
+		where = snapshot.color_index.get(pack_color_bgr(color_bgr))
+		if where is None:
 			return None
-		else:
-			with self._colors_to_find_lock:
-				return self._colors_to_find[where].copy()
+		return snapshot.positions[where]
+
+	def get_maze_pos_batch(self, colors_bgr) -> list:
+		"""Get the maze positions of the specified colors from the same snapshot
+
+		@param colors_bgr Specify a list of colors in BGR domain
+		@return A list of MazePositionRecord objects in the order of colors_bgr.
+		        The element is None if the color is not found.
+		"""
+		snapshot = self._snapshot
+		records = []
+		for color_bgr in colors_bgr:
+			where = snapshot.color_index.get(pack_color_bgr(color_bgr))
+			records.append(snapshot.positions[where] if where is not None else None)
+		return records
 
-	def get_all_maze_pos(self) -> list:
-		"""Get a copy of all the target colors and their maze positions
+	def get_all_maze_pos(self) -> tuple:
+		"""Get all the target colors and their maze positions
 
-		@return A copy of MazePositionFinder._colors_to_find
+		@return A tuple of MazePositionRecord in the order of the target colors
 		"""
-		target_colors = []
-		with self._colors_to_find_lock:
-			for i in range(len(self._colors_to_find)):
-				target_colors.append(self._colors_to_find[i].copy())
-		return target_colors
+		return self._snapshot.positions
+
+	def get_max_LED_height(self) -> float:
+		"""Get the maximum height of the LED of the target colors
+
+		@return The maximum LED height. 0.0 if there is no target color.
+		"""
+		return max([color.LED_height for color in self._colors_to_find], \
+			default = 0.0)
 
 	def _generate_ratio_to_wall_height(self):
 		"""Generate ratio to of the LED height to the maze wall height for all colors
 
 		The result will be stored to MazePositionFinder._ratio_to_wall_height_array
+		as a N x 1 array, so it can be multiplied with N positions at once.
 		"""
-		self._ratio_to_wall_height_array.clear()
-		for i in range(len(self._colors_to_find)):
-			self._ratio_to_wall_height_array \
-				.append(self._colors_to_find[i].LED_height / self._wall_height)
+		self._ratio_to_wall_height_array = np.array( \
+			[[color.LED_height / self._wall_height] for color in self._colors_to_find], \
+			dtype = np.float32).reshape(-1, 1)
 
 	def start_recognition(self):
 		# Generate an array og the ratio of the LED height to the maze height
@@ -225,109 +344,244 @@ class MazePositionFinder:
 			return
 
 		self._generate_ratio_to_wall_height()
+		self._generate_lookup_tables()
 		self._recognition_thread.start()
 
 	def stop_recognition(self):
 		self._recognition_thread.stop()
 
+	def _update_color_index(self):
+		"""Rebuild the index from the packed color to its index in _colors_to_find
+		"""
+		self._color_index = {pack_color_bgr(self._colors_to_find[i].color_bgr): i \
+			for i in range(len(self._colors_to_find))}
+
+	def _publish_snapshot(self, frame_seq):
+		"""Publish the positions in _colors_to_find as a new snapshot
+
+		@param frame_seq Specify the sequence number of the frame that
+		       the positions are from
+		"""
+		self._snapshot = MazePositionSnapshot(frame_seq, \
+			tuple(color.to_record() for color in self._colors_to_find), \
+			self._color_index)
+
+	def _generate_lookup_tables(self):
+		"""Precompute the maze positions of the pixels in the region of interest
+
+		A lookup table is generated for each distinct ratio of the LED height to
+		the wall height. The result is stored to _pos_lookup_table and
+		_pos_detail_lookup_table. If the lookup table is not used, the region
+		of interest is not set, or the tables are larger than
+		MazePositionFinder.MAX_LOOKUP_TABLE_SIZE, they will be None.
+
+		The region of interest is clipped to the frame by MazeManager. The
+		positions are saturated to the range of int16, so the pixels projected
+		far outside the maze are still outside the maze in the tables.
+		"""
+		self._pos_lookup_table = None
+		self._pos_detail_lookup_table = None
+
+		if not self._use_lookup_table:
+			return
+		if self._roi is None:
+			self._logger.warning("The region of interest of the finder \"{0}\" " \
+				"is not set. Lookup table is not used.".format(self._finder_name))
+			return
+
+		left, top = max(self._roi[0].x, 0), max(self._roi[0].y, 0)
+		width, height = self._roi[1].x - left, self._roi[1].y - top
+		if width <= 0 or height <= 0 or len(self._colors_to_find) == 0:
+			return
+
+		ratios, table_ids = np.unique(self._ratio_to_wall_height_array[:, 0], \
+			return_inverse = True)
+		# 2 tables (normal and detail) of 2 int16 (x and y) per pixel
+		table_size = len(ratios) * height * width * 2 * 2 * 2
+		if table_size > MazePositionFinder.MAX_LOOKUP_TABLE_SIZE:
+			self._logger.error("The lookup tables of the finder \"{0}\" need " \
+				"{1:.1f} MB, which is more than the limit {2:.1f} MB. " \
+				"Lookup table is not used.".format(self._finder_name, \
+				table_size / 1048576, MazePositionFinder.MAX_LOOKUP_TABLE_SIZE / 1048576))
+			return
+
+		xs, ys = np.meshgrid(np.arange(left, left + width, dtype = np.float32), \
+			np.arange(top, top + height, dtype = np.float32))
+		pos_in_frame = np.stack((xs, ys), axis = -1).reshape(1, -1, 2)
+		pos_table = np.empty((len(ratios), height, width, 2), dtype = np.int16)
+		pos_detail_table = np.empty((len(ratios), height, width, 2), dtype = np.int16)
+		int16_info = np.iinfo(np.int16)
+		for i in range(len(ratios)):
+			pos_table[i] = np.clip(self._get_pos(pos_in_frame, ratios[i], \
+				self._upper_transform_mat, self._lower_transform_mat), \
+				int16_info.min, int16_info.max).reshape(height, width, 2)
+			pos_detail_table[i] = np.clip(self._get_pos(pos_in_frame, ratios[i], \
+				self._upper_transform_mat_detail, self._lower_transform_mat_detail), \
+				int16_info.min, int16_info.max).reshape(height, width, 2)
+
+		self._lookup_table_origin = Point2D(left, top)
+		self._lookup_table_ids = table_ids.reshape(-1)
+		self._pos_lookup_table = pos_table
+		self._pos_detail_lookup_table = pos_detail_table
+
+		self._logger.info("The lookup tables of the finder \"{0}\" are generated " \
+			"for {1} LED heights in {2} x {3} pixels. Memory used: {4:.1f} MB." \
+			.format(self._finder_name, len(ratios), width, height, \
+			self.get_lookup_table_size() / 1048576))
+
+	def _get_pos(self, pos_in_frame, ratio_to_wall_height, \
+		upper_transform_mat, lower_transform_mat):
+		""" Transform the pixel positions to the maze coordinate
+
+		First, transfrom the pixel position by MazePositionFinder._upper_transform_mat
+		for upper plane (wall level), and MazePositionFinder._lower_transform_mat
+		for lower plane (groud level). It will generate two coordinates,
+		pos_at_upper_plane and pos_at_lower_plane.
+		Then, get the maze coordinate by interploting these two coordinates.
+		The formula is:
+		pos_at_lower_plane + (pos_at_upper_plane - pos_at_lower_plane)
+		* ratio_to_wall_height.
+
+		@param pos_in_frame Specify a 1 x N x 2 array of the positions found
+		       in the video stream
+		@param ratio_to_wall_height Specify a N x 1 array of the ratio of
+		       the LED height to the wall height, or a single ratio for all
+		@param upper_transform_mat Specify the transform matrix of the upper plane
+		@param lower_transform_mat Specify the transform matrix of the lower plane
+		@return A N x 2 array that stores the maze positions in integer
+		"""
+		pos_at_upper_plane = cv2.perspectiveTransform(pos_in_frame, upper_transform_mat)[0]
+		pos_at_lower_plane = cv2.perspectiveTransform(pos_in_frame, lower_transform_mat)[0]
+		pos_in_maze = pos_at_lower_plane + \
+			(pos_at_upper_plane - pos_at_lower_plane) * ratio_to_wall_height
+		return np.rint(pos_in_maze - 0.5).astype(np.int32)
+
 	def _recognize_pos_in_maze(self):
 		"""Recognize the position in the maze in the maze coordinate
 
 		The method will calculate the position of the maze car whose LED color is
 		stored at MazePositionFinder._colors_to_find.
-		Get the pixel position found in the video stream from corresponding
-		ColorPositionFinder by the LED color, and then calculate the car position
-		by MazePositionFinder._recognize_position_in_maze._get_pos().
-		The result is stored in MazePosition.postion.
-		"""
-		def _get_pos(pos_in_frame, ratio_to_wall_height, \
-			upper_transform_mat, lower_transform_mat) -> Point2D:
-			""" Transform the pixel position to the maze coordinate
-
-			First, transfrom the pixel position by MazePositionFinder._upper_transform_mat
-			for upper plane (wall level), and MazePositionFinder._lower_transform_mat
-			for lower plane (groud level). It will generate two coordinates,
-			pos_at_upper_plane and pos_at_lower_plane.
-			Then, get the maze coordinate by interploting these two coordinates.
-			The formula is:
-			pos_at_lower_plane + (pos_at_upper_plane - pos_at_lower_plane)
-			* ratio_to_wall_height.
-
-			@param pos_in_frame Specify the position found in the video stream
-			@param ratio_to_wall_height Specify the ratio of the LED height to the wall
-			       height
-			@param upper_transform_mat Specify the transform matrix of the upper plane
-			@param lower_transform_mat Specify the transform matrix of the lower plane
-			@return A Point2D object that stores the maze position in integer
-			"""
-			pos = np.array([[[pos_in_frame.x, pos_in_frame.y]]], dtype = np.float32)
-			pos_at_upper_plane = cv2.perspectiveTransform(pos, upper_transform_mat)
-			pos_at_lower_plane = cv2.perspectiveTransform(pos, lower_transform_mat)
-			pos_in_maze = pos_at_lower_plane + \
-				(pos_at_upper_plane - pos_at_lower_plane) * ratio_to_wall_height
-			return Point2D(int(round(pos_in_maze[0][0][0] - 0.5)), \
-				int(round(pos_in_maze[0][0][1] - 0.5)))
-
-		# Calculate the maze position for each color
-		car_pos = []
-		car_pos_detail = []
-		for i in range(len(self._colors_to_find)):
-			target_color_pos = self._color_pos_finder \
-				.get_target_color(*(self._colors_to_find[i].color_bgr))
-
+		Read the result of the ColorPositionFinder once, get the pixel position
+		found in the video stream by the LED color, and then get the car position
+		from the lookup tables, or calculate it by MazePositionFinder._get_pos()
+		if the pixel is not in the lookup tables.
+		The pixel positions of all the cars found are stacked and transformed
+		together, so each transform matrix is applied once per call.
+		The result is stored in MazePosition.postion, and then published as
+		a new MazePositionSnapshot.
+		"""
+		start_time = time.perf_counter()
+		frame_seq, color_index, pixel_positions = self._color_pos_finder.get_result()
+
+		# Collect the pixel positions of the colors found.
+		# If there is no position found in the video stream, it will be (-1, -1)
+		car_pos = [Point2D(-1, -1)] * len(self._colors_to_find)
+		car_pos_detail = [Point2D(-1, -1)] * len(self._colors_to_find)
+		found_ids = []
+		pixel_pos = []
+		for packed_color, i in self._color_index.items():
+			where = color_index.get(packed_color)
 			# Hope that there is only one position found in the video stream
-			if len(target_color_pos.pixel_position) > 0:
-				pos = _get_pos(target_color_pos.pixel_position[0], \
-					self._ratio_to_wall_height_array[i], \
-					self._upper_transform_mat, \
-					self._lower_transform_mat)
-				car_pos.append(pos)
-
-				pos_detail = _get_pos(target_color_pos.pixel_position[0], \
-					self._ratio_to_wall_height_array[i], \
-					self._upper_transform_mat_detail, \
-					self._lower_transform_mat_detail)
-				car_pos_detail.append(pos_detail)
-			# If there is no position found in the video stream,
-			# return (-1, -1)
-			else:
-				car_pos.append(Point2D(-1, -1))
-				car_pos_detail.append(Point2D(-1, -1))
+			if where is not None and len(pixel_positions[where]) > 0:
+				found_ids.append(i)
+				pixel_pos.append(pixel_positions[where][0])
+
+		# Calculate the maze position for all colors found at once
+		if len(found_ids) > 0:
+			found_ids = np.array(found_ids)
+			pixel_pos = np.array(pixel_pos, dtype = np.int32)
+			pos = np.empty((len(found_ids), 2), dtype = np.int32)
+			pos_detail = np.empty((len(found_ids), 2), dtype = np.int32)
+
+			# Look up the pixels in the lookup tables
+			in_table = np.zeros(len(found_ids), dtype = bool)
+			if self._pos_lookup_table is not None:
+				xs = pixel_pos[:, 0] - self._lookup_table_origin.x
+				ys = pixel_pos[:, 1] - self._lookup_table_origin.y
+				in_table = (xs >= 0) & (ys >= 0) & \
+					(xs < self._pos_lookup_table.shape[2]) & \
+					(ys < self._pos_lookup_table.shape[1])
+				table_ids = self._lookup_table_ids[found_ids[in_table]]
+				pos[in_table] = \
+					self._pos_lookup_table[table_ids, ys[in_table], xs[in_table]]
+				pos_detail[in_table] = \
+					self._pos_detail_lookup_table[table_ids, ys[in_table], xs[in_table]]
+
+			# Transform the rest of the pixels
+			not_in_table = ~in_table
+			if not_in_table.any():
+				pos_in_frame = pixel_pos[not_in_table] \
+					.astype(np.float32).reshape(1, -1, 2)
+				ratio_to_wall_height = \
+					self._ratio_to_wall_height_array[found_ids[not_in_table]]
+				pos[not_in_table] = self._get_pos(pos_in_frame, ratio_to_wall_height, \
+					self._upper_transform_mat, self._lower_transform_mat)
+				pos_detail[not_in_table] = self._get_pos(pos_in_frame, ratio_to_wall_height, \
+					self._upper_transform_mat_detail, self._lower_transform_mat_detail)
+
+			pos = pos.tolist()
+			pos_detail = pos_detail.tolist()
+			for i in range(len(found_ids)):
+				car_pos[found_ids[i]] = Point2D(*pos[i])
+				car_pos_detail[found_ids[i]] = Point2D(*pos_detail[i])
 
 		# Update the result
-		with self._colors_to_find_lock:
-			for i in range(len(car_pos)):
-				if car_pos[i].x >= 0:
-					# Position is found. Reset the counter
-					self._colors_to_find[i].position = car_pos[i]
-					self._colors_to_find[i].position_detail = car_pos_detail[i]
-					self._colors_to_find[i]._missing_counter = 0
-				elif self._colors_to_find[i]._missing_counter > self._max_missing_counter:
-					# Position is missing for a while. Set to (-1, -1)
-					self._colors_to_find[i].position = car_pos[i]
-					self._colors_to_find[i].position_detail = car_pos_detail[i]
-				else:
-					# Position is missing. Increase the missing counter
-					# and remain the lastest vaild position.
-					self._colors_to_find[i]._missing_counter += 1
+		for i in range(len(car_pos)):
+			if car_pos[i].x >= 0:
+				# Position is found. Reset the counter
+				self._colors_to_find[i].position = car_pos[i]
+				self._colors_to_find[i].position_detail = car_pos_detail[i]
+				self._colors_to_find[i]._missing_counter = 0
+			elif self._colors_to_find[i]._missing_counter > self._max_missing_counter:
+				# Position is missing for a while. Set to (-1, -1)
+				self._colors_to_find[i].position = car_pos[i]
+				self._colors_to_find[i].position_detail = car_pos_detail[i]
+			else:
+				# Position is missing. Increase the missing counter
+				# and remain the lastest vaild position.
+				self._colors_to_find[i]._missing_counter += 1
+
+		self._publish_snapshot(frame_seq)
+		latency_monitor.record(latency_monitor.STAGE_MAZE_TRANSFORM, \
+			time.perf_counter() - start_time)
+		self.on_position_update.invoke(self, self._snapshot)
 
 class MazeManager:
 	"""Manage the maze information and MazePositionFinders of team A and B
 
+	@var ROI_MARGIN The margin in pixel added around the region of interest
+	     for the size of the LED
+	@var _color_pos_manager The ColorPosManager whose region of interest is
+	     set to the region of the maze
 	@var _maze_pos_finders The container for MazePositionFinders
+	@var _wall_height The height of the maze wall
+	@var _upper_corner The sorted corners of the upper plane of the maze
+	@var _lower_corner The sorted corners of the lower plane of the maze
 	"""
 
-	def __init__(self, color_pos_manager: ColorPosManager, fps = 30):
+	ROI_MARGIN = 20
+
+	def __init__(self, color_pos_manager: ColorPosManager, fps = 30, \
+		use_lookup_table = False):
 		"""Constructor
 
 		@param color_pos_manager The instance of class ColorPosManager
 		@param fps Specify the updating rate of the car position in maze
+		@param use_lookup_table Specify whether to precompute the maze positions
+		       of the pixels in the maze region. See MazePositionFinder.
 		"""
+		self._color_pos_manager = color_pos_manager
+		self._wall_height = None
+		self._upper_corner = []
+		self._lower_corner = []
+
 		team_a_color_finder = color_pos_manager.get_finder(PosFinderType.CAR_TEAM_A)
 		team_b_color_finder = color_pos_manager.get_finder(PosFinderType.CAR_TEAM_B)
 		self._maze_pos_finders = {
-			PosFinderType.CAR_TEAM_A: MazePositionFinder("team_A", team_a_color_finder, fps),
-			PosFinderType.CAR_TEAM_B: MazePositionFinder("team_B", team_b_color_finder, fps)
+			PosFinderType.CAR_TEAM_A: MazePositionFinder("team_A", team_a_color_finder, \
+				fps, use_lookup_table),
+			PosFinderType.CAR_TEAM_B: MazePositionFinder("team_B", team_b_color_finder, \
+				fps, use_lookup_table)
 		}
 
 	def recognize_maze(self, scale_x: int, scale_y: int, wall_height: float, \
@@ -354,6 +608,11 @@ class MazeManager:
 				upper_transform_mat_detail, lower_transform_mat_detail)
 			maze_pos_finder.set_wall_height(wall_height)
 
+		# The corners are sorted in the same order by _generate_transform_matrix()
+		self._wall_height = wall_height
+		self._upper_corner = list(upper_corner)
+		self._lower_corner = list(lower_corner)
+
 	def _generate_transform_matrix(self, corner_pos_4: list, maze_scale: Point2D):
 		"""Get a transform matrix which converts coordinates in the video stream
 		to coordinates in the maze
@@ -435,30 +694,87 @@ class MazeManager:
 			"B": self.get_finder(PosFinderType.CAR_TEAM_B)
 		}.get(name)
 
-	def get_maze_pos(self, color_bgr, team: str) -> MazePosition:
+	def get_maze_pos(self, color_bgr, team: str) -> MazePositionRecord:
 		"""Get the position in the maze of the spcified maze car
 
 		@param color_bgr Specify the LED color of the maze car in BGR domain
 		@param team Specify the team of the maze car. Should be "A" or "B"
-		@return The copy of MazePosition object of the specified color
+		@return The MazePositionRecord object of the specified color
 		@retval None If the specified color in not found
 		"""
 		finder = self.get_finder_by_name(team)
 		return finder.get_maze_pos(color_bgr)
 
+	def get_maze_pos_batch(self, colors_bgr, team: str) -> list:
+		"""Get the positions in the maze of the specified maze cars at once
+
+		@param colors_bgr Specify a list of LED colors of the maze cars in BGR domain
+		@param team Specify the team of the maze cars. Should be "A" or "B"
+		@return A list of MazePositionRecord objects in the order of colors_bgr.
+		        The element is None if the color is not found.
+		"""
+		finder = self.get_finder_by_name(team)
+		return finder.get_maze_pos_batch(colors_bgr)
+
 	def get_team_maze_pos(self, team: str):
 		"""Get the position of all the maze cars in a team
 
 		@param team Specify the team of the maze cars. Should be "A" or "B"
-		@return A list of MazePosition objects of the specfied team
+		@return A tuple of MazePositionRecord objects of the specfied team
 		"""
 		finder = self.get_finder_by_name(team)
 		return finder.get_all_maze_pos()
 
+	def _update_roi(self):
+		"""Set the region of interest of the ColorPosManager to the maze region
+
+		The LED on the maze car is projected between the lower plane and the
+		plane at the LED height, which is extrapolated from the lower and
+		upper plane by the ratio of the highest LED to the wall height.
+		The region of interest is the bounding box of these planes plus
+		MazeManager.ROI_MARGIN, and it is clipped to the frame.
+		"""
+		if len(self._upper_corner) != 4 or len(self._lower_corner) != 4:
+			return
+
+		max_LED_height = max([finder.get_max_LED_height() \
+			for finder in self._maze_pos_finders.values()])
+		if self._wall_height > 0:
+			max_ratio = max(max_LED_height / self._wall_height, 1.0)
+		else:
+			max_ratio = 1.0
+
+		xs = []
+		ys = []
+		for upper, lower in zip(self._upper_corner, self._lower_corner):
+			xs += [upper.x, lower.x, lower.x + (upper.x - lower.x) * max_ratio]
+			ys += [upper.y, lower.y, lower.y + (upper.y - lower.y) * max_ratio]
+
+		top_left = Point2D(max(int(min(xs)) - MazeManager.ROI_MARGIN, 0), \
+			max(int(min(ys)) - MazeManager.ROI_MARGIN, 0))
+		bottom_right = Point2D(int(max(xs)) + MazeManager.ROI_MARGIN + 1, \
+			int(max(ys)) + MazeManager.ROI_MARGIN + 1)
+		frame_size = self._color_pos_manager.get_frame_size()
+		if frame_size is not None:
+			bottom_right = Point2D(min(bottom_right.x, frame_size.x), \
+				min(bottom_right.y, frame_size.y))
+		self._color_pos_manager.set_roi(top_left, bottom_right)
+		for maze_pos_finder in self._maze_pos_finders.values():
+			maze_pos_finder.set_roi(top_left, bottom_right)
+
 	def start_recognition(self):
+		self._update_roi()
 		for maze_pos_finder in self._maze_pos_finders.values():
 			maze_pos_finder.start_recognition()
 
 	def stop_recognition(self):
+		"""Stop the recognition and restore the whole frame to the ColorPosManager
+
+		The region of interest is set again by the next
+		MazeManager.start_recognition, so the re-calibration after stopping
+		sees the whole frame.
+		"""
 		for maze_pos_finder in self._maze_pos_finders.values():
-			maze_pos_finder.stop_recognition()
\ No newline at end of file
+			maze_pos_finder.stop_recognition()
+			maze_pos_finder.clear_roi()
+		self._color_pos_manager.clear_roi()
\ No newline at end of file
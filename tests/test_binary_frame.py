@@ -0,0 +1,70 @@
+"""@package docstring
+Test packing and splitting the frames of the binary protocol.
+"""
+
+import unittest
+
+from util.binary_frame import BinaryFrameBuffer, FRAME_HEADER, \
+	MAX_PAYLOAD_LENGTH, pack_frame
+
+class PackFrameTest(unittest.TestCase):
+
+	def test_header_in_little_endian(self):
+		self.assertEqual(pack_frame(0x12, b"abc"), b"\x12\x03\x00abc")
+		self.assertEqual(pack_frame(0x01), b"\x01\x00\x00")
+
+	def test_max_payload_length(self):
+		frame = pack_frame(0x01, b"x" * MAX_PAYLOAD_LENGTH)
+		self.assertEqual(len(frame), FRAME_HEADER.size + MAX_PAYLOAD_LENGTH)
+
+	def test_oversize_payload(self):
+		with self.assertRaises(ValueError):
+			pack_frame(0x01, b"x" * (MAX_PAYLOAD_LENGTH + 1))
+
+class BinaryFrameBufferTest(unittest.TestCase):
+
+	def setUp(self):
+		self._buffer = BinaryFrameBuffer()
+
+	def test_frames_merged_into_a_read(self):
+		data = pack_frame(0x01, b"ab") + pack_frame(0x02) + pack_frame(0x03, b"c")
+		self.assertEqual(self._buffer.feed(data), \
+			[(0x01, b"ab"), (0x02, b""), (0x03, b"c")])
+		self.assertEqual(self._buffer.get_pending(), b"")
+
+	def test_partial_header(self):
+		frame = pack_frame(0x05, b"payload")
+		self.assertEqual(self._buffer.feed(frame[:1]), [])
+		self.assertEqual(self._buffer.feed(frame[1:2]), [])
+		self.assertEqual(self._buffer.get_pending(), frame[:2])
+		self.assertEqual(self._buffer.feed(frame[2:]), [(0x05, b"payload")])
+
+	def test_frame_split_byte_by_byte(self):
+		data = pack_frame(0x05, b"payload") + pack_frame(0x06, b"z")
+		frames = []
+		for i in range(len(data)):
+			frames += self._buffer.feed(data[i:i + 1])
+		self.assertEqual(frames, [(0x05, b"payload"), (0x06, b"z")])
+		self.assertEqual(self._buffer.get_pending(), b"")
+
+	def test_incomplete_frame_after_complete_one(self):
+		second = pack_frame(0x02, b"xyz")
+		self.assertEqual(self._buffer.feed(pack_frame(0x01) + second[:4]), [(0x01, b"")])
+		self.assertEqual(self._buffer.get_pending(), second[:4])
+		self.assertEqual(self._buffer.feed(second[4:]), [(0x02, b"xyz")])
+
+	def test_max_length_in_header(self):
+		header = FRAME_HEADER.pack(0x07, MAX_PAYLOAD_LENGTH)
+		self.assertEqual(self._buffer.feed(header + b"x" * 1000), [])
+		# The buffer never holds more than a frame and the data after it
+		frames = self._buffer.feed(b"x" * (MAX_PAYLOAD_LENGTH - 1000) + b"\x08")
+		self.assertEqual(frames, [(0x07, b"x" * MAX_PAYLOAD_LENGTH)])
+		self.assertEqual(self._buffer.get_pending(), b"\x08")
+
+	def test_data_before_switching(self):
+		frame = pack_frame(0x01, b"hi")
+		frame_buffer = BinaryFrameBuffer(frame[:3])
+		self.assertEqual(frame_buffer.feed(frame[3:]), [(0x01, b"hi")])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,70 @@
+"""@package docstring
+Test searching the lost colors while the other colors are tracked.
+"""
+
+import cv2
+import numpy as np
+import unittest
+
+from color_position_finder import ColorPosManager
+from color_tracker import ColorTracker
+from color_type import ColorType, PosFinderType
+from point import Point2D
+from tools.synthetic_arena import SyntheticArena, SyntheticArenaSource
+
+class ColorPositionFinderTrackingTest(unittest.TestCase):
+
+	RED = (0, 0, 255)
+	BLUE = (255, 0, 0)
+
+	def setUp(self):
+		source = SyntheticArenaSource(SyntheticArena(frame_size = Point2D(160, 120)), \
+			realtime = False)
+		self._manager = ColorPosManager(source)
+		for color_bgr in (self.RED, self.BLUE):
+			self._manager.set_color(color_bgr, ColorType.NOT_DEFINED, \
+				ColorType.MAZE_CAR_TEAM_A)
+		self._finder = self._manager.get_finder(PosFinderType.CAR_TEAM_A)
+		self._manager.start_recognition()
+		self._frame_seq = 0
+
+	def tearDown(self):
+		self._manager.stop_recognition()
+
+	def _process(self, red_center, blue_center = (120, 80)) -> list:
+		"""Process a frame with the LEDs at the centers, and get the positions
+		"""
+		frame = np.zeros((120, 160, 3), dtype = np.uint8)
+		if red_center is not None:
+			cv2.circle(frame, red_center, 5, self.RED, -1)
+		cv2.circle(frame, blue_center, 5, self.BLUE, -1)
+		self._frame_seq += 1
+		self._manager.process_frame(self._frame_seq, frame)
+		frame_seq, color_index, pixel_positions = self._finder.get_result()
+		self.assertEqual(frame_seq, self._frame_seq)
+		return pixel_positions
+
+	def test_color_out_of_window_is_found_at_once(self):
+		self.assertEqual(self._process((20, 20)), [[Point2D(20, 20)], [Point2D(120, 80)]])
+		# Jump far out of the search window
+		self.assertEqual(self._process((140, 20)), [[Point2D(140, 20)], [Point2D(120, 80)]])
+
+	def test_lost_color_is_searched_periodically(self):
+		self._process((20, 20))
+		# The first frame with tracking searches the lost colors
+		self._process((20, 20))
+		self.assertEqual(self._process(None), [[], [Point2D(120, 80)]])
+
+		# The red LED is back, but it is lost, so it is not searched until
+		# LOST_SEARCH_INTERVAL frames after the last search
+		for i in range(ColorTracker.LOST_SEARCH_INTERVAL - 2):
+			self.assertEqual(self._process((60, 60)), [[], [Point2D(120, 80)]])
+		self.assertEqual(self._process((60, 60)), [[Point2D(60, 60)], [Point2D(120, 80)]])
+
+	def test_lost_color_is_searched_when_tracking_starts(self):
+		self._process(None, (120, 80))
+		self.assertEqual(self._process((20, 20), (120, 80)), \
+			[[Point2D(20, 20)], [Point2D(120, 80)]])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,52 @@
+"""@package docstring
+Test the single pass segmentation of the target colors.
+"""
+
+import cv2
+import numpy as np
+import unittest
+
+from color_segmentation import MultiColorSegmenter
+from point import Point2D
+
+def _to_hsv(color_bgr):
+	return cv2.cvtColor(np.uint8([[color_bgr]]), cv2.COLOR_BGR2HSV)[0, 0]
+
+class MultiColorSegmenterTest(unittest.TestCase):
+
+	RED = (0, 0, 255)
+	BLUE = (255, 0, 0)
+
+	def setUp(self):
+		self._segmenter = MultiColorSegmenter()
+		self._segmenter.set_target_colors([_to_hsv(self.RED), _to_hsv(self.BLUE)])
+		self._frame = np.zeros((100, 120, 3), dtype = np.uint8)
+
+	def _segment(self, offset = Point2D(0, 0)):
+		return self._segmenter.segment( \
+			cv2.cvtColor(self._frame, cv2.COLOR_BGR2HSV), offset)
+
+	def test_separated_LEDs(self):
+		cv2.circle(self._frame, (30, 50), 8, self.RED, -1)
+		cv2.circle(self._frame, (90, 50), 6, self.BLUE, -1)
+		self.assertEqual(self._segment(Point2D(10, 20)), \
+			[[Point2D(40, 70)], [Point2D(100, 70)]])
+
+	def test_adjacent_LEDs_of_different_colors(self):
+		# The blurred blobs of the two LEDs are connected
+		cv2.circle(self._frame, (50, 50), 8, self.RED, -1)
+		cv2.circle(self._frame, (66, 50), 6, self.BLUE, -1)
+		self.assertEqual(self._segment(), [[Point2D(50, 50)], [Point2D(66, 50)]])
+
+	def test_blobs_sorted_by_size(self):
+		cv2.circle(self._frame, (20, 20), 4, self.RED, -1)
+		cv2.circle(self._frame, (80, 70), 9, self.RED, -1)
+		self.assertEqual(self._segment(), [[Point2D(80, 70), Point2D(20, 20)], []])
+
+	def test_no_target_color(self):
+		self._segmenter.set_target_colors([])
+		cv2.circle(self._frame, (50, 50), 8, self.RED, -1)
+		self.assertEqual(self._segment(), [])
+
+if __name__ == "__main__":
+	unittest.main()
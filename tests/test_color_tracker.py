@@ -0,0 +1,70 @@
+"""@package docstring
+Test predicting the search windows of the tracked colors.
+"""
+
+import unittest
+
+from color_tracker import ColorTracker
+from point import Point2D
+
+class ColorTrackerTest(unittest.TestCase):
+
+	def setUp(self):
+		self._tracker = ColorTracker(2)
+
+	def test_all_lost_at_first(self):
+		self.assertFalse(self._tracker.is_tracking_any())
+		self.assertEqual(self._tracker.get_search_windows(), [None, None])
+
+	def test_window_centered_at_first_position(self):
+		self._tracker.update([[Point2D(100, 50), Point2D(10, 10)], []])
+		self.assertTrue(self._tracker.is_tracking_any())
+
+		half_size = ColorTracker.WINDOW_HALF_SIZE
+		self.assertEqual(self._tracker.get_search_windows(), [ \
+			(Point2D(100 - half_size, 50 - half_size), \
+			Point2D(100 + half_size + 1, 50 + half_size + 1)), None])
+
+	def test_window_follows_velocity(self):
+		self._tracker.update([[Point2D(100, 50)], []])
+		self._tracker.update([[Point2D(120, 50)], []])
+		self._tracker.update([[Point2D(140, 50)], []])
+
+		# The velocity is smoothed: 20 * 0.5 = 10, then 10 * 0.5 + 20 * 0.5 = 15
+		top_left, bottom_right = self._tracker.get_search_windows()[0]
+		center = Point2D((top_left.x + bottom_right.x - 1) // 2, \
+			(top_left.y + bottom_right.y - 1) // 2)
+		self.assertEqual(center, Point2D(155, 50))
+		# The window is enlarged in the moving direction only
+		half_size_x = ColorTracker.WINDOW_HALF_SIZE + int(15 * ColorTracker.WINDOW_VELOCITY_GAIN)
+		self.assertEqual(bottom_right.x - top_left.x, 2 * half_size_x + 1)
+		self.assertEqual(bottom_right.y - top_left.y, 2 * ColorTracker.WINDOW_HALF_SIZE + 1)
+
+	def test_lost_color_resets_velocity(self):
+		self._tracker.update([[Point2D(100, 50)], [Point2D(10, 10)]])
+		self._tracker.update([[Point2D(120, 50)], []])
+		windows = self._tracker.get_search_windows()
+		self.assertIsNotNone(windows[0])
+		self.assertIsNone(windows[1])
+
+		self._tracker.update([[], []])
+		self.assertFalse(self._tracker.is_tracking_any())
+		self._tracker.update([[Point2D(200, 50)], []])
+		top_left, bottom_right = self._tracker.get_search_windows()[0]
+		self.assertEqual(bottom_right.x - top_left.x, 2 * ColorTracker.WINDOW_HALF_SIZE + 1)
+
+	def test_lost_search_interval(self):
+		interval = ColorTracker.LOST_SEARCH_INTERVAL
+		ticks = [self._tracker.tick_lost_search() for i in range(2 * interval)]
+		self.assertEqual(ticks, ([True] + [False] * (interval - 1)) * 2)
+
+	def test_reset_searches_lost_colors_at_once(self):
+		self._tracker.tick_lost_search()
+		self._tracker.update([[Point2D(100, 50)], []])
+		self._tracker.reset(3)
+		self.assertFalse(self._tracker.is_tracking_any())
+		self.assertEqual(self._tracker.get_search_windows(), [None, None, None])
+		self.assertTrue(self._tracker.tick_lost_search())
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,72 @@
+"""@package docstring
+Test splitting the received data into lines.
+"""
+
+import unittest
+
+from util.line_buffer import LineBuffer
+
+class LineBufferTest(unittest.TestCase):
+
+	def setUp(self):
+		self._buffer = LineBuffer(max_length = 16)
+
+	def test_line_split_across_reads(self):
+		self.assertEqual(self._buffer.feed(b"position\njoin ca"), ["position"])
+		self.assertEqual(self._buffer.get_pending(), b"join ca")
+		self.assertEqual(self._buffer.feed(b"r1 A\r\n"), ["join car1 A"])
+		self.assertEqual(self._buffer.get_pending(), b"")
+
+	def test_lines_merged_into_a_read(self):
+		self.assertEqual(self._buffer.feed(b"position\n\nsend-team hi\r\nposition\n"), \
+			["position", "send-team hi", "position"])
+
+	def test_legacy_mode_treats_each_read_as_a_message(self):
+		self.assertEqual(self._buffer.feed(b"position"), ["position"])
+		self.assertEqual(self._buffer.feed(b"join car1 A\r"), ["join car1 A"])
+
+	def test_legacy_mode_cannot_reassemble_a_split_message(self):
+		# The documented limitation of the clients without newlines
+		self.assertEqual(self._buffer.feed(b"join ca"), ["join ca"])
+		self.assertEqual(self._buffer.feed(b"r1 A"), ["r1 A"])
+
+	def test_legacy_mode_cannot_split_merged_messages(self):
+		self.assertEqual(self._buffer.feed(b"positionposition"), ["positionposition"])
+
+	def test_switch_to_line_mode(self):
+		self.assertEqual(self._buffer.feed(b"position"), ["position"])
+		self.assertEqual(self._buffer.feed(b"join ca"), ["join ca"])
+		self.assertEqual(self._buffer.feed(b"position\njoin"), ["position"])
+		# No more legacy messages once a newline is received
+		self.assertEqual(self._buffer.feed(b" car1 A"), [])
+		self.assertEqual(self._buffer.feed(b"\n"), ["join car1 A"])
+
+	def test_too_long_line_is_discarded(self):
+		self.assertEqual(self._buffer.feed(b"\n" + b"x" * 17), [])
+		self.assertEqual(self._buffer.get_pending(), b"")
+		# The rest of the too long line is also discarded
+		self.assertEqual(self._buffer.feed(b"xxx\nposition\n"), ["position"])
+
+	def test_too_long_line_across_many_reads(self):
+		self._buffer.feed(b"\n")
+		for i in range(5):
+			self.assertEqual(self._buffer.feed(b"x" * 10), [])
+			self.assertLessEqual(len(self._buffer.get_pending()), 16)
+		self.assertEqual(self._buffer.feed(b"x\nposition\n"), ["position"])
+
+	def test_line_at_max_length_is_kept(self):
+		self.assertEqual(self._buffer.feed(b"\n" + b"x" * 16), [])
+		self.assertEqual(self._buffer.feed(b"\n"), ["x" * 16])
+
+	def test_default_max_length(self):
+		line_buffer = LineBuffer()
+		line_buffer.feed(b"\n")
+		self.assertEqual(line_buffer.feed(b"x" * 4097), [])
+		self.assertEqual(line_buffer.get_pending(), b"")
+
+	def test_invalid_utf8(self):
+		with self.assertRaises(UnicodeDecodeError):
+			self._buffer.feed(b"\xff\n")
+
+if __name__ == "__main__":
+	unittest.main()
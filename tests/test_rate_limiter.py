@@ -0,0 +1,59 @@
+"""@package docstring
+Test the token bucket limiting the rate of the requests.
+"""
+
+import unittest
+from unittest import mock
+
+from util.rate_limiter import TokenBucket
+
+class TokenBucketTest(unittest.TestCase):
+
+	def setUp(self):
+		self._now = 100.0
+		patcher = mock.patch("util.rate_limiter.time.monotonic", lambda: self._now)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def _consume(self, bucket, times) -> int:
+		return sum(bucket.try_consume() for i in range(times))
+
+	def test_burst(self):
+		bucket = TokenBucket(10.0, 5)
+		self.assertEqual(self._consume(bucket, 8), 5)
+		self.assertFalse(bucket.try_consume())
+
+	def test_refill(self):
+		bucket = TokenBucket(4.0, 5)
+		self._consume(bucket, 5)
+		self._now += 0.125
+		self.assertFalse(bucket.try_consume())
+		self._now += 0.125
+		self.assertTrue(bucket.try_consume())
+		self.assertFalse(bucket.try_consume())
+
+	def test_refill_is_capped_by_burst(self):
+		bucket = TokenBucket(10.0, 5)
+		self._consume(bucket, 5)
+		self._now += 60.0
+		self.assertEqual(self._consume(bucket, 8), 5)
+
+	def test_sustained_rate(self):
+		bucket = TokenBucket(10.0, 1)
+		num_of_accepted = 0
+		for i in range(100):
+			# 40 requests per second for 2.5 seconds
+			self._now += 0.025
+			num_of_accepted += bucket.try_consume()
+		self.assertIn(num_of_accepted, (25, 26))
+
+	def test_fractional_rate(self):
+		bucket = TokenBucket(0.5, 1)
+		self.assertTrue(bucket.try_consume())
+		self._now += 1.0
+		self.assertFalse(bucket.try_consume())
+		self._now += 1.0
+		self.assertTrue(bucket.try_consume())
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,153 @@
+"""@package docstring
+Test the catch detection of the game "Run and Catch".
+"""
+
+import unittest
+
+from color_position_finder import ColorPosManager
+from game_essential import TeamType
+from game_run_and_catch.game_core import GameCore
+from maze_manager import MazeManager, MazePositionRecord, MazePositionSnapshot
+from point import Point2D
+from tools.synthetic_arena import SyntheticArena, SyntheticArenaSource
+
+class _MessageRecorder:
+	"""Record the messages sent by the game core instead of the server
+	"""
+
+	def __init__(self):
+		self.messages = []
+
+	def send_message(self, client_ip, msg):
+		self.messages.append((client_ip, msg))
+
+	def broadcast_message(self, msg, exclude = ()):
+		self.messages.append((None, msg))
+
+class GameCoreCatchTest(unittest.TestCase):
+
+	CATCHER_COLOR = (0, 0, 255)
+	RUNNER_COLOR = (0, 255, 0)
+	RUNNER2_COLOR = (255, 0, 0)
+
+	@classmethod
+	def setUpClass(cls):
+		# The command handlers are registered to the communication_server
+		# module, so the game core is only created once.
+		source = SyntheticArenaSource(SyntheticArena(frame_size = Point2D(64, 48)), \
+			realtime = False)
+		cls._game_core = GameCore(MazeManager(ColorPosManager(source)))
+		cls._recorder = _MessageRecorder()
+		cls._game_core._comm_server = cls._recorder
+
+		# A 2 x 2 maze. Only the blocks (0, 0) and (1, 0) are connected.
+		cls._game_core._maze_size = Point2D(2, 2)
+		cls._game_core._maze_map = bytearray([GameCore.SIDE_RIGHT, GameCore.SIDE_LEFT, 0, 0])
+		cls._game_core._init_touch_table()
+
+		cls._game_core.team_set_name(TeamType.A, "catcher")
+		cls._game_core.team_set_name(TeamType.B, "runner")
+		cls._join("1.1.1.1", "c1", "catcher", cls.CATCHER_COLOR)
+		cls._join("1.1.1.2", "r1", "runner", cls.RUNNER_COLOR)
+		cls._join("1.1.1.3", "r2", "runner", cls.RUNNER2_COLOR)
+
+	@classmethod
+	def tearDownClass(cls):
+		cls._game_core.release()
+
+	@classmethod
+	def _join(cls, player_ip, player_ID, team_name, color_bgr):
+		cls._game_core.player_join(player_ip, player_ID, team_name)
+		team_type = cls._game_core.team_get_type_by_name(team_name)
+		cls._game_core._teams[team_type].get_player_info_by_IP(player_ip) \
+			.color_bgr = list(color_bgr)
+
+	def setUp(self):
+		if self._game_core.is_game_started:
+			self._game_core.game_stop()
+		self._game_core._handler_init()
+		self._recorder.messages.clear()
+
+	def _update(self, team_type, *cars):
+		finder = self._game_core._teams[team_type].maze_pos_finder
+		self._game_core._check_catch(finder, MazePositionSnapshot(0, cars, {}))
+
+	def _catched_IPs(self):
+		return [client_ip for client_ip, msg in self._recorder.messages \
+			if msg == "game-catched"]
+
+	def _car(self, color_bgr, block, detail):
+		return MazePositionRecord(color_bgr, 3.0, Point2D(*block), Point2D(*detail))
+
+	def test_touch_table(self):
+		game_core = self._game_core
+		self.assertTrue(game_core.is_catch(self._car(self.RUNNER_COLOR, (0, 0), (25, 15)), \
+			self._car(self.CATCHER_COLOR, (0, 0), (20, 10))))
+		# Connected blocks
+		self.assertTrue(game_core.is_catch(self._car(self.RUNNER_COLOR, (0, 0), (28, 10)), \
+			self._car(self.CATCHER_COLOR, (1, 0), (32, 10))))
+		# A wall between the blocks
+		self.assertFalse(game_core.is_catch(self._car(self.RUNNER_COLOR, (0, 0), (10, 28)), \
+			self._car(self.CATCHER_COLOR, (0, 1), (10, 32))))
+		# Too far in the same block
+		self.assertFalse(game_core.is_catch(self._car(self.RUNNER_COLOR, (0, 0), (2, 2)), \
+			self._car(self.CATCHER_COLOR, (0, 0), (20, 20))))
+		# Out of the maze
+		self.assertFalse(game_core.is_catch(self._car(self.RUNNER_COLOR, (-1, -1), (-1, -1)), \
+			self._car(self.CATCHER_COLOR, (0, 0), (0, 0))))
+		self.assertFalse(game_core.is_catch(self._car(self.RUNNER_COLOR, (2, 0), (62, 10)), \
+			self._car(self.CATCHER_COLOR, (1, 0), (58, 10))))
+
+	def test_catch_by_moving_catcher(self):
+		self._game_core.game_start()
+		self._update(TeamType.B, self._car(self.RUNNER_COLOR, (1, 0), (40, 10)), \
+			self._car(self.RUNNER2_COLOR, (1, 1), (40, 40)))
+		self._update(TeamType.A, self._car(self.CATCHER_COLOR, (0, 0), (10, 10)))
+		self.assertEqual(self._catched_IPs(), [])
+
+		self._update(TeamType.A, self._car(self.CATCHER_COLOR, (0, 0), (29, 10)))
+		self.assertEqual(self._catched_IPs(), ["1.1.1.2"])
+		self.assertTrue(self._game_core.is_game_started)
+
+		# The runner is only catched once
+		self._update(TeamType.A, self._car(self.CATCHER_COLOR, (1, 0), (35, 10)))
+		self.assertEqual(self._catched_IPs(), ["1.1.1.2"])
+
+	def test_game_stops_when_all_runners_are_catched(self):
+		self._game_core.game_start()
+		self._update(TeamType.A, self._car(self.CATCHER_COLOR, (1, 1), (45, 45)))
+		self._update(TeamType.B, self._car(self.RUNNER_COLOR, (1, 1), (40, 40)), \
+			self._car(self.RUNNER2_COLOR, (1, 1), (50, 50)))
+		self.assertEqual(sorted(self._catched_IPs()), ["1.1.1.2", "1.1.1.3"])
+		self.assertFalse(self._game_core.is_game_started)
+
+	def test_wall_blocks_the_catch(self):
+		self._game_core.game_start()
+		self._update(TeamType.A, self._car(self.CATCHER_COLOR, (0, 1), (10, 32)))
+		self._update(TeamType.B, self._car(self.RUNNER_COLOR, (0, 0), (10, 28)))
+		self.assertEqual(self._catched_IPs(), [])
+
+	def test_no_catch_before_game_start(self):
+		self._update(TeamType.A, self._car(self.CATCHER_COLOR, (0, 0), (10, 10)))
+		self._update(TeamType.B, self._car(self.RUNNER_COLOR, (0, 0), (10, 10)))
+		self.assertEqual(self._catched_IPs(), [])
+
+	def test_handler_exception_does_not_keep_the_game_running(self):
+		def raise_error(runner_ip):
+			raise RuntimeError("handler error")
+		self._game_core._handlers["game-catched"] += raise_error
+
+		self._game_core.game_start()
+		self._update(TeamType.A, self._car(self.CATCHER_COLOR, (1, 1), (45, 45)))
+		with self.assertLogs("game_run_and_catch.game_core", "ERROR"):
+			self._update(TeamType.B, self._car(self.RUNNER_COLOR, (1, 1), (40, 40)), \
+				self._car(self.RUNNER2_COLOR, (1, 1), (50, 50)))
+		self.assertEqual(self._catched_IPs(), ["1.1.1.2"])
+
+		with self.assertLogs("game_run_and_catch.game_core", "ERROR"):
+			self._update(TeamType.A, self._car(self.CATCHER_COLOR, (1, 1), (46, 46)))
+		self.assertEqual(sorted(self._catched_IPs()), ["1.1.1.2", "1.1.1.3"])
+		self.assertFalse(self._game_core.is_game_started)
+
+if __name__ == "__main__":
+	unittest.main()
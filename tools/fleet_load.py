@@ -0,0 +1,338 @@
+"""@package docstring
+Simulate a fleet of maze cars connecting to the communication server.
+
+Each car connects from its own loopback IP, because the server tells the
+clients apart by their IPs. Linux routes the whole 127.0.0.0/8 to the
+loopback interface, so no extra setting is needed.
+
+Run it in the root directory of the project. Start a local server with
+the game core of "Run and Catch" and load it:
+```
+python -m tools.fleet_load --local --cars 8 32 128
+```
+Or load a running console:
+```
+python -m tools.fleet_load --port 5000 --teams TeamA TeamB --cars 32
+```
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import socket
+import time
+from collections import deque
+
+from tools.stats import percentile
+from util import latency_monitor
+
+# The commands sent by each car and their default rate per second
+COMMAND_RATES = {
+	"position": 10.0,
+	"position-team": 2.0,
+	"position-enemy": 2.0,
+	"send-to": 1.0,
+	"send-team": 1.0
+}
+
+class LoadStats:
+	"""The statistics of the load shared by all the simulated cars
+
+	All the cars are run in the same event loop, so no lock is needed.
+
+	@var num_of_connected The number of the cars joined the game
+	@var num_of_failed The number of the cars failed to connect or join
+	@var num_of_sent A dictionary of command-number of requests sent pair
+	@var num_of_busy A dictionary of command-number of "busy" replies pair
+	@var num_of_fail A dictionary of command-number of "fail" replies pair
+	@var num_of_pushes The number of the messages sent from the other cars
+	@var latencies A dictionary of command-list of reply latency in seconds pair
+	@var max_queue_depth The maximum number of the commands waiting in the
+	     local server. None if the server is not local.
+	"""
+
+	def __init__(self):
+		self.num_of_connected = 0
+		self.num_of_failed = 0
+		self.num_of_sent = {command: 0 for command in COMMAND_RATES}
+		self.num_of_busy = {command: 0 for command in COMMAND_RATES}
+		self.num_of_fail = {command: 0 for command in COMMAND_RATES}
+		self.num_of_pushes = 0
+		self.latencies = {command: [] for command in COMMAND_RATES}
+		self.max_queue_depth = None
+
+class SimulatedCar:
+	"""A maze car which joins a team and keeps sending the requests
+
+	The replies of a client are sent in the order of its requests, and each
+	reply starts with the command, so the reply is matched to the oldest
+	request of the same command.
+
+	@var _car_ID The ID of the car
+	@var _local_ip The loopback IP the car connects from
+	@var _team_name The name of the team to join
+	@var _teammate_IDs The IDs of the other cars in the same team
+	@var _rates A dictionary of command-rate per second pair
+	@var _stats The shared LoadStats
+	@var _pending A dictionary of command-deque of the sending time pair
+	"""
+
+	def __init__(self, car_ID, local_ip, team_name, teammate_IDs, rates, \
+		stats: LoadStats):
+		self._car_ID = car_ID
+		self._local_ip = local_ip
+		self._team_name = team_name
+		self._teammate_IDs = teammate_IDs
+		self._rates = rates
+		self._stats = stats
+		self._pending = {command: deque() for command in rates}
+
+	async def run(self, host, port, start_time, end_time):
+		"""Join the game, and send the requests until end_time
+
+		@param host Specify the IP of the server
+		@param port Specify the port of the server
+		@param start_time Specify the time to start sending the requests
+		       in time.monotonic(), so all the cars start after joining
+		@param end_time Specify the time to stop sending the requests
+		"""
+		try:
+			reader, writer = await asyncio.open_connection(host, port, \
+				local_addr = (self._local_ip, 0))
+			# Send each request at once instead of measuring the Nagle's delay
+			writer.get_extra_info("socket").setsockopt( \
+				socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			writer.write("join {0} {1}\n".format(self._car_ID, self._team_name).encode())
+			line = await asyncio.wait_for(reader.readline(), 5.0)
+			if line.decode().strip() != "join ok":
+				raise ConnectionError(line.decode().strip())
+		except (OSError, asyncio.TimeoutError, ConnectionError) as err:
+			logging.getLogger(__name__).warning("Car {0} from {1} cannot join: {2}" \
+				.format(self._car_ID, self._local_ip, err))
+			self._stats.num_of_failed += 1
+			return
+
+		self._stats.num_of_connected += 1
+		receiver = asyncio.ensure_future(self._receive(reader))
+		senders = [asyncio.ensure_future(self._send(writer, command, rate, \
+			start_time, end_time)) for command, rate in self._rates.items() if rate > 0]
+		await asyncio.gather(*senders)
+
+		# Wait for the replies of the last requests
+		await asyncio.sleep(1.0)
+		receiver.cancel()
+		writer.close()
+
+	async def _send(self, writer, command, rate, start_time, end_time):
+		"""Send the command in the rate until end_time
+
+		The first request is delayed randomly, so the cars don't send
+		the requests at the same time.
+		"""
+		interval = 1.0 / rate
+		next_time = start_time + random.uniform(0.0, interval)
+		while next_time < end_time:
+			await asyncio.sleep(max(next_time - time.monotonic(), 0.0))
+			next_time += interval
+
+			if command == "send-to":
+				if len(self._teammate_IDs) == 0:
+					continue
+				request = "send-to {0} hello".format(random.choice(self._teammate_IDs))
+			elif command == "send-team":
+				request = "send-team hello"
+			else:
+				request = command
+
+			self._pending[command].append(time.monotonic())
+			self._stats.num_of_sent[command] += 1
+			writer.write((request + "\n").encode())
+
+	async def _receive(self, reader):
+		"""Match the replies to the requests and record the latency
+		"""
+		while True:
+			line = await reader.readline()
+			if len(line) == 0:
+				return
+			now = time.monotonic()
+			fields = line.decode().split()
+			if len(fields) == 0:
+				continue
+
+			command = fields[0]
+			pending = self._pending.get(command)
+			if pending is None or len(pending) == 0:
+				self._stats.num_of_pushes += 1
+				continue
+
+			self._stats.latencies[command].append(now - pending.popleft())
+			if fields[-1] == "busy":
+				self._stats.num_of_busy[command] += 1
+			elif fields[-1] == "fail":
+				self._stats.num_of_fail[command] += 1
+
+def _get_local_ip(index) -> str:
+	"""Get the distinct loopback IP of the index-th car
+	"""
+	return "127.0.{0}.{1}".format(index // 250 + 1, index % 250 + 1)
+
+async def _sample_queue_depth(get_queue_depth, stats: LoadStats, interval = 0.05):
+	"""Keep the maximum queue depth of the local server until cancelled
+	"""
+	stats.max_queue_depth = 0
+	while True:
+		stats.max_queue_depth = max(stats.max_queue_depth, get_queue_depth())
+		await asyncio.sleep(interval)
+
+async def run_load(host, port, num_of_cars, team_names, rates, duration, \
+	get_queue_depth = None) -> LoadStats:
+	"""Run the simulated cars against the server
+
+	The cars are spread over the teams in turn.
+
+	@param host Specify the IP of the server
+	@param port Specify the port of the server
+	@param num_of_cars Specify the number of the cars
+	@param team_names Specify the names of the teams
+	@param rates Specify a dictionary of command-rate per second pair
+	@param duration Specify the seconds of sending the requests
+	@param get_queue_depth Specify the function getting the number of the
+	       commands waiting in the local server, which is sampled during the run
+	@return The LoadStats of the run
+	"""
+	stats = LoadStats()
+	car_IDs = ["car{0}".format(i) for i in range(num_of_cars)]
+	teams = [car_IDs[i::len(team_names)] for i in range(len(team_names))]
+
+	# Leave a second for joining
+	start_time = time.monotonic() + 1.0
+	end_time = start_time + duration
+	cars = []
+	for i in range(num_of_cars):
+		team = teams[i % len(team_names)]
+		teammate_IDs = [car_ID for car_ID in team if car_ID != car_IDs[i]]
+		cars.append(SimulatedCar(car_IDs[i], _get_local_ip(i), \
+			team_names[i % len(team_names)], teammate_IDs, rates, stats))
+
+	sampler = None
+	if get_queue_depth is not None:
+		sampler = asyncio.ensure_future(_sample_queue_depth(get_queue_depth, stats))
+	await asyncio.gather(*[car.run(host, port, start_time, end_time) for car in cars])
+	if sampler is not None:
+		sampler.cancel()
+	return stats
+
+def start_local_server(port, backend, rate_limit = True):
+	"""Start the communication server with the game core of "Run and Catch"
+
+	The camera is replaced by an idle synthetic arena, so the positions
+	replied are all "-1 -1", but the requests go through the same path.
+
+	@param port Specify the port of the server
+	@param backend Specify the backend of the TCP server
+	@param rate_limit Specify whether to keep the default rate limits
+	@return The names of the teams
+	"""
+	import communication_server as comm_server
+	from color_position_finder import ColorPosManager
+	from game_essential import TeamType
+	from game_run_and_catch import GameCore
+	from maze_manager import MazeManager
+	from point import Point2D
+	from tools.synthetic_arena import SyntheticArena, SyntheticArenaSource
+
+	source = SyntheticArenaSource(SyntheticArena(frame_size = Point2D(64, 48)), \
+		realtime = False)
+	game_core = GameCore(MazeManager(ColorPosManager(source)))
+	game_core.team_set_name(TeamType.A, "A")
+	game_core.team_set_name(TeamType.B, "B")
+
+	if not rate_limit:
+		for cmd_class in comm_server.CommandClass:
+			comm_server.set_rate_limit(cmd_class, 1e9, 1000000)
+
+	comm_server.set_backend(backend)
+	if not comm_server.start_server("127.0.0.1", port):
+		raise RuntimeError("Cannot start the server at port {0}.".format(port))
+	return ["A", "B"]
+
+def print_stats(num_of_cars, stats: LoadStats, duration):
+	"""Print the throughput and the reply latency of each command
+	"""
+	print("cars: {0}, joined: {1}, failed: {2}, pushes received: {3}" \
+		.format(num_of_cars, stats.num_of_connected, stats.num_of_failed, \
+			stats.num_of_pushes))
+	print("{0:>15} {1:>8} {2:>8} {3:>9} {4:>6} {5:>6} {6:>9} {7:>9} {8:>9} {9:>9}" \
+		.format("command", "sent", "replied", "reply/s", "busy", "fail", \
+			"p50", "p95", "p99", "max"))
+
+	total_replied = 0
+	for command in COMMAND_RATES:
+		latencies = sorted(stats.latencies[command])
+		total_replied += len(latencies)
+		print("{0:>15} {1:>8} {2:>8} {3:>9.1f} {4:>6} {5:>6} {6:>7.2f}ms " \
+			"{7:>7.2f}ms {8:>7.2f}ms {9:>7.2f}ms".format(command, \
+			stats.num_of_sent[command], len(latencies), len(latencies) / duration, \
+			stats.num_of_busy[command], stats.num_of_fail[command], \
+			percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, \
+			percentile(latencies, 99) * 1000, percentile(latencies, 100) * 1000))
+	print("{0:>15} {1:>8} {2:>8} {3:>9.1f}".format("total", \
+		sum(stats.num_of_sent.values()), total_replied, total_replied / duration))
+	if stats.max_queue_depth is not None:
+		print("max queue depth: {0}".format(stats.max_queue_depth))
+
+def main():
+	parser = argparse.ArgumentParser( \
+		description = "Load the communication server with simulated cars.")
+	parser.add_argument("--host", default = "127.0.0.1", \
+		help = "The IP of the server")
+	parser.add_argument("--port", type = int, default = 5000, \
+		help = "The port of the server")
+	parser.add_argument("--cars", type = int, nargs = "+", default = [8, 32, 128], \
+		help = "The numbers of the cars of each run")
+	parser.add_argument("--teams", nargs = "+", default = ["A", "B"], \
+		help = "The names of the teams to join")
+	parser.add_argument("--duration", type = float, default = 10.0, \
+		help = "The seconds of sending the requests of each run")
+	for command, rate in COMMAND_RATES.items():
+		parser.add_argument("--{0}-rate".format(command), type = float, default = rate, \
+			help = "The rate per second of \"{0}\" of each car".format(command))
+	parser.add_argument("--local", action = "store_true", \
+		help = "Start a local server with the game core of \"Run and Catch\"")
+	parser.add_argument("--backend", default = "select", choices = ["select", "asyncio"], \
+		help = "The TCP server backend of the local server")
+	parser.add_argument("--no-rate-limit", action = "store_true", \
+		help = "Disable the rate limits of the local server")
+	args = parser.parse_args()
+
+	logging.basicConfig(level = logging.WARNING)
+
+	rates = {command: getattr(args, "{0}_rate".format(command.replace("-", "_"))) \
+		for command in COMMAND_RATES}
+	team_names = args.teams
+	get_queue_depth = None
+	if args.local:
+		team_names = start_local_server(args.port, args.backend, not args.no_rate_limit)
+		import communication_server as comm_server
+		get_queue_depth = comm_server.get_queue_depth
+
+	try:
+		for num_of_cars in args.cars:
+			latency_monitor.reset()
+			stats = asyncio.run(run_load(args.host, args.port, num_of_cars, \
+				team_names, rates, args.duration, get_queue_depth))
+			print_stats(num_of_cars, stats, args.duration)
+			if args.local:
+				# The latency of the stages in the local server
+				print(latency_monitor.format_summaries())
+			# Wait for the server to remove the players
+			time.sleep(1.0)
+	finally:
+		if args.local:
+			import communication_server as comm_server
+			comm_server.stop_server()
+
+if __name__ == "__main__":
+	main()
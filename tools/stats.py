@@ -0,0 +1,15 @@
+"""@package docstring
+The statistics shared by the tools.
+"""
+
+def percentile(sorted_values, percent):
+	"""Get the percentile of the sorted values by the nearest rank
+
+	@param sorted_values Specify the values sorted in ascending order
+	@param percent Specify the percentile between 0 and 100
+	@return The value at the percentile. 0.0 if there is no value.
+	"""
+	if len(sorted_values) == 0:
+		return 0.0
+	rank = max(int(round(percent / 100.0 * len(sorted_values))) - 1, 0)
+	return sorted_values[min(rank, len(sorted_values) - 1)]
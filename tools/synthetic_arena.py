@@ -0,0 +1,321 @@
+"""@package docstring
+Render a synthetic maze arena with moving LEDs and their ground truth positions.
+"""
+
+import cv2
+import numpy as np
+import math
+import random
+
+from frame_source import FrameSource
+from maze_manager import MazePositionRecord
+from point import Point2D
+
+class CarScript:
+	"""The scripted path of a maze car
+
+	The car moves along the closed path passing through the waypoints
+	in a constant speed, and goes back to the first waypoint at the end.
+
+	@var color_bgr The LED color of the car in BGR domain
+	@var LED_height The height of the LED
+	@var waypoints A list of Point2D in the maze coordinate in blocks
+	@var speed The moving speed in blocks per second
+	@var _segment_lengths The length of each segment of the path
+	@var _path_length The total length of the path
+	"""
+
+	def __init__(self, color_bgr, LED_height, waypoints, speed = 1.0):
+		"""Constructor
+
+		@param color_bgr Specify the LED color of the car in BGR domain
+		@param LED_height Specify the height of the LED
+		@param waypoints Specify the list of Point2D in the maze coordinate
+		@param speed Specify the moving speed in blocks per second
+		"""
+		self.color_bgr = color_bgr
+		self.LED_height = LED_height
+		self.waypoints = list(waypoints)
+		self.speed = speed
+		self._segment_lengths = [Point2D.distance(self.waypoints[i - 1], self.waypoints[i]) \
+			for i in range(1, len(self.waypoints))] + \
+			[Point2D.distance(self.waypoints[-1], self.waypoints[0])]
+		self._path_length = sum(self._segment_lengths)
+
+	def position_at(self, time_sec) -> Point2D:
+		"""Get the position of the car at the specified time
+
+		@param time_sec Specify the time in seconds since the car starts
+		@return The position in the maze coordinate in float
+		"""
+		if self._path_length == 0:
+			return self.waypoints[0]
+
+		distance = (time_sec * self.speed) % self._path_length
+		for i in range(len(self._segment_lengths)):
+			if distance <= self._segment_lengths[i]:
+				break
+			distance -= self._segment_lengths[i]
+
+		start = self.waypoints[i]
+		end = self.waypoints[(i + 1) % len(self.waypoints)]
+		ratio = distance / self._segment_lengths[i] if self._segment_lengths[i] > 0 else 0.0
+		return Point2D(start.x + (end.x - start.x) * ratio, \
+			start.y + (end.y - start.y) * ratio)
+
+class SyntheticArena:
+	"""Render the maze seen by a pinhole camera with the LEDs of the cars
+
+	The maze lies on the ground with its left-bottom corner at the origin.
+	The x axis goes right, the y axis goes away from the camera, and the z axis
+	goes up. The camera is above the maze, behind the bottom edge, and looks at
+	the center of the maze, so the bottom edge of the maze is at the bottom
+	of the frame as MazeManager expects.
+
+	The ground truth is in the same coordinate as MazeManager.recognize_maze
+	generates from the corners returned by SyntheticArena.get_corners.
+	As the LED is on the line between the projection of the lower and the
+	upper plane, the ground truth is exact for a pinhole camera.
+
+	@var DETAIL_SCALE The scale of the detailed position. It is the same as
+	     the one in MazeManager.recognize_maze.
+	@var BACKGROUND_BGR The color of the background
+	@var FLOOR_BGR The color of the floor of the maze
+	@var WALL_BGR The color of the top of the walls
+	@var maze_scale The size of the maze in blocks in Point2D
+	@var block_size The size of a block in the world unit
+	@var wall_height The height of the wall in the world unit
+	@var frame_size The size of the frame in pixel in Point2D
+	@var noise_sigma The standard deviation of the gaussian noise of the camera
+	@var LED_radius The radius of the LED in the world unit
+	@var cars A list of CarScript
+	@var _focal The focal length in pixel
+	@var _eye The position of the camera
+	@var _axes A 3 x 3 array of the right, down, and forward axis of the camera
+	@var _rng The random generator of the noise
+	"""
+
+	DETAIL_SCALE = 128
+	BACKGROUND_BGR = (40, 40, 40)
+	FLOOR_BGR = (90, 90, 90)
+	WALL_BGR = (170, 170, 170)
+
+	def __init__(self, maze_scale = Point2D(8, 8), block_size = 30.0, \
+		wall_height = 10.0, frame_size = Point2D(1080, 720), field_of_view = 60.0, \
+		camera_height = 300.0, camera_distance = 150.0, noise_sigma = 2.0, \
+		LED_radius = 1.5, seed = 0):
+		"""Constructor
+
+		@param maze_scale Specify the size of the maze in blocks
+		@param block_size Specify the size of a block in the world unit
+		@param wall_height Specify the height of the wall in the world unit
+		@param frame_size Specify the size of the frame in pixel
+		@param field_of_view Specify the horizontal field of view in degrees
+		@param camera_height Specify the height of the camera
+		@param camera_distance Specify the distance from the bottom edge of
+		       the maze to the camera on the ground
+		@param noise_sigma Specify the standard deviation of the noise
+		@param LED_radius Specify the radius of the LED in the world unit
+		@param seed Specify the seed of the noise
+		"""
+		self.maze_scale = maze_scale
+		self.block_size = block_size
+		self.wall_height = wall_height
+		self.frame_size = frame_size
+		self.noise_sigma = noise_sigma
+		self.LED_radius = LED_radius
+		self.cars = []
+
+		self._focal = frame_size.x / 2.0 / math.tan(math.radians(field_of_view) / 2.0)
+		center = np.array([maze_scale.x * block_size / 2.0, \
+			maze_scale.y * block_size / 2.0, 0.0])
+		self._eye = np.array([center[0], -camera_distance, camera_height])
+		forward = center - self._eye
+		forward /= np.linalg.norm(forward)
+		right = np.cross(forward, [0.0, 0.0, 1.0])
+		right /= np.linalg.norm(right)
+		down = np.cross(forward, right)
+		self._axes = np.array([right, down, forward])
+		self._rng = np.random.RandomState(seed)
+
+	def add_car(self, car: CarScript):
+		self.cars.append(car)
+
+	def add_random_cars(self, num_of_cars, LED_heights = (3.0, 12.0), seed = 0):
+		"""Add the cars moving along random rectangle loops
+
+		The LED colors are spread over the hue circle, so each car has
+		a distinct color.
+
+		@param num_of_cars Specify the number of the cars
+		@param LED_heights Specify the candidates of the LED height
+		@param seed Specify the seed of the paths
+		"""
+		rng = random.Random(seed)
+		for i in range(num_of_cars):
+			# The hue of OpenCV is in [0, 180)
+			hue = int(i * 175 / num_of_cars)
+			color_bgr = cv2.cvtColor(np.uint8([[[hue, 255, 255]]]), \
+				cv2.COLOR_HSV2BGR)[0][0].tolist()
+
+			left = rng.randrange(self.maze_scale.x - 1)
+			right = rng.randrange(left + 1, self.maze_scale.x)
+			bottom = rng.randrange(self.maze_scale.y - 1)
+			top = rng.randrange(bottom + 1, self.maze_scale.y)
+			waypoints = [Point2D(left + 0.5, bottom + 0.5), Point2D(right + 0.5, bottom + 0.5), \
+				Point2D(right + 0.5, top + 0.5), Point2D(left + 0.5, top + 0.5)]
+			# Start from different points of the path
+			waypoints = waypoints[i % 4:] + waypoints[:i % 4]
+
+			self.add_car(CarScript(color_bgr, rng.choice(LED_heights), waypoints, \
+				rng.uniform(0.5, 2.0)))
+
+	def project(self, points) -> np.ndarray:
+		"""Project the points in the world coordinate to the frame
+
+		@param points Specify a N x 3 array of the points
+		@return A N x 3 array of the pixel positions and the depth
+		"""
+		camera_points = (np.asarray(points, dtype = np.float64) - self._eye) @ self._axes.T
+		depth = camera_points[:, 2:3]
+		pixels = camera_points[:, :2] * self._focal / depth + \
+			np.array([self.frame_size.x / 2.0, self.frame_size.y / 2.0])
+		return np.hstack((pixels, depth))
+
+	def get_corners(self, height = None) -> list:
+		"""Get the corners of the plane of the maze in the frame
+
+		@param height Specify the height of the plane. The wall height if
+		       it is None, which is the upper plane.
+		@return A list of 4 Point2D in pixel for MazeManager.recognize_maze
+		"""
+		if height is None:
+			height = self.wall_height
+		width = self.maze_scale.x * self.block_size
+		length = self.maze_scale.y * self.block_size
+		pixels = self.project([[0, 0, height], [width, 0, height], \
+			[0, length, height], [width, length, height]])
+		return [Point2D(float(pixel[0]), float(pixel[1])) for pixel in pixels]
+
+	def get_ground_truth(self, time_sec) -> list:
+		"""Get the positions of the cars in the maze at the specified time
+
+		@param time_sec Specify the time in seconds
+		@return A list of MazePositionRecord in the order of the cars
+		"""
+		records = []
+		for car in self.cars:
+			pos = car.position_at(time_sec)
+			# The same rounding as MazePositionFinder
+			position = Point2D(int(np.rint(pos.x - 0.5)), int(np.rint(pos.y - 0.5)))
+			position_detail = Point2D( \
+				int(np.rint(pos.x / self.maze_scale.x * SyntheticArena.DETAIL_SCALE - 0.5)), \
+				int(np.rint(pos.y / self.maze_scale.y * SyntheticArena.DETAIL_SCALE - 0.5)))
+			records.append(MazePositionRecord(car.color_bgr, car.LED_height, \
+				position, position_detail))
+		return records
+
+	def render(self, time_sec, frame = None):
+		"""Render the frame at the specified time
+
+		@param time_sec Specify the time in seconds
+		@param frame Specify the frame to be drawn on. A new frame is created
+		       if it is None or in the different size.
+		@return (frame, ground_truth) The frame in BGR domain and the list of
+		        MazePositionRecord of the cars
+		"""
+		if frame is None or frame.shape[:2] != (self.frame_size.y, self.frame_size.x):
+			frame = np.empty((self.frame_size.y, self.frame_size.x, 3), dtype = np.uint8)
+		frame[:] = SyntheticArena.BACKGROUND_BGR
+
+		# The floor, in the order of the outline
+		lower = self.get_corners(0.0)
+		floor = np.array([lower[0], lower[1], lower[3], lower[2]])
+		cv2.fillConvexPoly(frame, np.rint(floor).astype(np.int32), SyntheticArena.FLOOR_BGR)
+
+		# The grid on the top of the walls
+		width = self.maze_scale.x * self.block_size
+		length = self.maze_scale.y * self.block_size
+		lines = []
+		for x in range(self.maze_scale.x + 1):
+			lines += [[x * self.block_size, 0, self.wall_height], \
+				[x * self.block_size, length, self.wall_height]]
+		for y in range(self.maze_scale.y + 1):
+			lines += [[0, y * self.block_size, self.wall_height], \
+				[width, y * self.block_size, self.wall_height]]
+		lines = np.rint(self.project(lines)[:, :2]).astype(np.int32).reshape(-1, 2, 2)
+		cv2.polylines(frame, lines, False, SyntheticArena.WALL_BGR, 2)
+
+		# The LEDs. The farther LED is drawn first.
+		ground_truth = self.get_ground_truth(time_sec)
+		if len(self.cars) > 0:
+			leds = []
+			for car in self.cars:
+				pos = car.position_at(time_sec)
+				leds.append([pos.x * self.block_size, pos.y * self.block_size, car.LED_height])
+			leds = self.project(leds)
+			for i in np.argsort(-leds[:, 2]):
+				radius = max(int(round(self.LED_radius * self._focal / leds[i][2])), 2)
+				cv2.circle(frame, (int(round(leds[i][0])), int(round(leds[i][1]))), \
+					radius, self.cars[i].color_bgr, -1)
+
+		if self.noise_sigma > 0:
+			noise = self._rng.normal(0.0, self.noise_sigma, frame.shape)
+			np.copyto(frame, np.clip(frame + noise, 0, 255).astype(np.uint8))
+
+		return frame, ground_truth
+
+class SyntheticArenaSource(FrameSource):
+	"""Provide the frames rendered by a SyntheticArena
+
+	The i-th frame is rendered at the time i / fps, so the frames are the
+	same whether they are paced in real time or not.
+
+	@var _arena The SyntheticArena to be rendered
+	@var _fps The rate of the frames
+	@var _num_of_frames The number of the frames. 0 if it is endless.
+	@var _next_frame The index of the next frame, which is also its
+	     sequence number
+	@var _ground_truths The dictionary of frame_seq-ground_truth pairs of the
+	     frames in the ring buffer
+	"""
+
+	def __init__(self, arena: SyntheticArena, fps = 30, realtime = True, \
+		num_of_frames = 0, ring_size = 4):
+		"""Constructor
+
+		@param arena Specify the SyntheticArena to be rendered
+		@param fps Specify the rate of the frames
+		@param realtime Specify whether to provide the frames in the fps or
+		       as fast as possible
+		@param num_of_frames Specify the number of the frames. 0 if it is endless.
+		@param ring_size Specify the number of frames in the ring buffer
+		"""
+		super().__init__(ring_size, fps if realtime else 0)
+		self._arena = arena
+		self._fps = fps
+		self._num_of_frames = num_of_frames
+		self._next_frame = 0
+		self._ground_truths = {}
+
+		self._capture_first_frame()
+
+	def get_ground_truth(self, frame_seq) -> list:
+		"""Get the ground truth of the frame
+
+		@param frame_seq Specify the sequence number of the frame
+		@return The list of MazePositionRecord of the cars.
+		        None if the frame is not in the ring buffer.
+		"""
+		return self._ground_truths.get(frame_seq)
+
+	def _read_frame(self, frame_buffer):
+		if self._num_of_frames > 0 and self._next_frame >= self._num_of_frames:
+			self.is_finished = True
+			return False, None
+
+		frame, ground_truth = self._arena.render(self._next_frame / self._fps, frame_buffer)
+		self._ground_truths[self._next_frame] = ground_truth
+		self._ground_truths.pop(self._next_frame - len(self._frame_ring), None)
+		self._next_frame += 1
+		return True, frame
@@ -0,0 +1,178 @@
+"""@package docstring
+Benchmark the recognition of the car positions on the synthetic arena.
+
+Run it in the root directory of the project:
+```
+python -m tools.vision_benchmark --cars 2 8 32 --resolutions 640x480 1080x720
+```
+"""
+
+import argparse
+import logging
+import time
+from threading import Event
+
+from color_position_finder import ColorPosManager
+from color_type import ColorType
+from maze_manager import MazeManager
+from point import Point2D
+from tools.stats import percentile
+from tools.synthetic_arena import SyntheticArena, SyntheticArenaSource
+from util import latency_monitor
+
+def run_benchmark(num_of_cars, frame_size: Point2D, num_of_frames = 300, \
+	noise_sigma = 2.0, use_lookup_table = False, fps = 30, seed = 0) -> dict:
+	"""Recognize the frames of the synthetic arena and compare with the ground truth
+
+	The frames are rendered in advance, and then passed to the ColorPosManager
+	one by one. The next frame is passed after the MazePositionFinders of
+	both teams publish the result of the current frame, so no frame is dropped.
+	The first half of the cars in the hue circle are in team A, and the others
+	are in team B.
+
+	@param num_of_cars Specify the number of the cars
+	@param frame_size Specify the size of the frame in pixel
+	@param num_of_frames Specify the number of the frames
+	@param noise_sigma Specify the standard deviation of the camera noise
+	@param use_lookup_table Specify whether the MazePositionFinder uses
+	       the lookup table
+	@param fps Specify the frame rate of the scripted motion
+	@param seed Specify the seed of the paths and the noise
+	@return A dictionary of the results
+	"""
+	arena = SyntheticArena(frame_size = frame_size, noise_sigma = noise_sigma, seed = seed)
+	arena.add_random_cars(num_of_cars, seed = seed)
+	source = SyntheticArenaSource(arena, fps, realtime = False)
+
+	# Run the recognition as fast as the frames are passed
+	color_pos_manager = ColorPosManager(source, fps = 1000)
+	maze_manager = MazeManager(color_pos_manager, fps = 1000, \
+		use_lookup_table = use_lookup_table)
+	for i, car in enumerate(arena.cars):
+		color_type = ColorType.MAZE_CAR_TEAM_A if i < num_of_cars / 2 \
+			else ColorType.MAZE_CAR_TEAM_B
+		color_pos_manager.set_color(car.color_bgr, ColorType.NOT_DEFINED, color_type)
+		maze_manager.set_color(car.color_bgr, ColorType.NOT_DEFINED, color_type, \
+			car.LED_height)
+	maze_manager.recognize_maze(arena.maze_scale.x, arena.maze_scale.y, \
+		arena.wall_height, arena.get_corners(), arena.get_corners(0.0))
+
+	frames = [arena.render(i / fps) for i in range(num_of_frames)]
+
+	maze_pos_finders = [maze_manager.get_finder_by_name(team) for team in ("A", "B")]
+	published = [Event() for finder in maze_pos_finders]
+	publish_time = [0.0] * len(maze_pos_finders)
+	current_seq = -1
+
+	def on_position_update(maze_pos_finder, snapshot):
+		i = maze_pos_finders.index(maze_pos_finder)
+		if snapshot.frame_seq == current_seq:
+			publish_time[i] = time.perf_counter()
+			published[i].set()
+
+	for finder in maze_pos_finders:
+		finder.on_position_update += on_position_update
+
+	color_pos_manager.start_recognition()
+	maze_manager.start_recognition()
+
+	color_latency = []
+	total_latency = []
+	num_of_found = 0
+	num_of_correct = 0
+	detail_errors = []
+	benchmark_start = time.perf_counter()
+
+	for frame_seq, (frame, ground_truth) in enumerate(frames):
+		for event in published:
+			event.clear()
+		current_seq = frame_seq
+
+		start = time.perf_counter()
+		color_pos_manager.process_frame(frame_seq, frame)
+		color_latency.append(time.perf_counter() - start)
+		for event in published:
+			event.wait()
+		total_latency.append(max(publish_time) - start)
+
+		colors_bgr = [record.color_bgr for record in ground_truth]
+		results = maze_pos_finders[0].get_maze_pos_batch(colors_bgr)
+		results_b = maze_pos_finders[1].get_maze_pos_batch(colors_bgr)
+		for truth, result, result_b in zip(ground_truth, results, results_b):
+			result = result or result_b
+			if result is None or result.position.x < 0:
+				continue
+			num_of_found += 1
+			if result.position == truth.position:
+				num_of_correct += 1
+			detail_errors.append(Point2D.distance(result.position_detail, \
+				truth.position_detail))
+
+	elapsed = time.perf_counter() - benchmark_start
+
+	maze_manager.stop_recognition()
+	color_pos_manager.stop_recognition()
+	for finder in maze_pos_finders:
+		finder.on_position_update -= on_position_update
+
+	color_latency.sort()
+	total_latency.sort()
+	num_of_positions = max(num_of_cars * num_of_frames, 1)
+	return {
+		"cars": num_of_cars,
+		"resolution": "{0}x{1}".format(frame_size.x, frame_size.y),
+		"fps": num_of_frames / elapsed,
+		"color_p50_ms": percentile(color_latency, 50) * 1000,
+		"total_p50_ms": percentile(total_latency, 50) * 1000,
+		"total_p95_ms": percentile(total_latency, 95) * 1000,
+		"total_max_ms": percentile(total_latency, 100) * 1000,
+		"found_rate": num_of_found / num_of_positions,
+		"block_accuracy": num_of_correct / max(num_of_found, 1),
+		"detail_error": sum(detail_errors) / max(len(detail_errors), 1),
+		"detail_error_max": max(detail_errors, default = 0.0)
+	}
+
+def _parse_resolution(text) -> Point2D:
+	width, height = text.lower().split("x")
+	return Point2D(int(width), int(height))
+
+def main():
+	parser = argparse.ArgumentParser( \
+		description = "Benchmark the recognition on the synthetic arena.")
+	parser.add_argument("--cars", type = int, nargs = "+", default = [2, 8, 32], \
+		help = "The numbers of the cars")
+	parser.add_argument("--resolutions", type = _parse_resolution, nargs = "+", \
+		default = [Point2D(640, 480), Point2D(1080, 720)], \
+		help = "The resolutions of the frame, like 1080x720")
+	parser.add_argument("--frames", type = int, default = 300, \
+		help = "The number of the frames of each run")
+	parser.add_argument("--noise", type = float, default = 2.0, \
+		help = "The standard deviation of the camera noise")
+	parser.add_argument("--lookup-table", action = "store_true", \
+		help = "Use the lookup table in the MazePositionFinder")
+	parser.add_argument("--seed", type = int, default = 0, \
+		help = "The seed of the paths and the noise")
+	parser.add_argument("--stages", action = "store_true", \
+		help = "Print the latency of each stage after each run")
+	args = parser.parse_args()
+
+	logging.basicConfig(level = logging.WARNING)
+
+	header = "{0:>5} {1:>10} {2:>8} {3:>9} {4:>9} {5:>9} {6:>9} {7:>7} {8:>7} {9:>8} {10:>8}" \
+		.format("cars", "resolution", "fps", "color p50", "total p50", "total p95", \
+			"total max", "found", "block", "err avg", "err max")
+	print(header)
+	for resolution in args.resolutions:
+		for num_of_cars in args.cars:
+			latency_monitor.reset()
+			result = run_benchmark(num_of_cars, resolution, args.frames, args.noise, \
+				args.lookup_table, seed = args.seed)
+			print("{cars:>5} {resolution:>10} {fps:>8.1f} {color_p50_ms:>7.2f}ms " \
+				"{total_p50_ms:>7.2f}ms {total_p95_ms:>7.2f}ms {total_max_ms:>7.2f}ms " \
+				"{found_rate:>7.1%} {block_accuracy:>7.1%} {detail_error:>8.2f} " \
+				"{detail_error_max:>8.2f}".format(**result))
+			if args.stages:
+				print(latency_monitor.format_summaries())
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,68 @@
+"""@package docstring
+
+The framing of the binary protocol.
+
+Each frame is a 3-byte header followed by the payload. The header is the
+message ID (uint8) and the length of the payload (uint16), in little endian.
+"""
+import struct
+
+# The header of the frame: (message ID, payload length)
+FRAME_HEADER = struct.Struct("<BH")
+# The maximum length in bytes of the payload
+MAX_PAYLOAD_LENGTH = 0xFFFF
+
+def pack_frame(message_id: int, payload: bytes = b"") -> bytes:
+	"""Pack the message into a frame
+
+	@param message_id Specify the message ID
+	@param payload Specify the payload
+	@return The frame in bytes
+	@exception ValueError If the payload is longer than MAX_PAYLOAD_LENGTH
+	"""
+	if len(payload) > MAX_PAYLOAD_LENGTH:
+		raise ValueError("The payload is longer than {0} bytes." \
+			.format(MAX_PAYLOAD_LENGTH))
+	return FRAME_HEADER.pack(message_id, len(payload)) + payload
+
+class BinaryFrameBuffer:
+	"""Buffer the received data of a connection and split it into frames
+
+	It has the same interface as util.line_buffer.LineBuffer, so the
+	connection can switch its framing.
+
+	@var _buffer The received data that hasn't formed a complete frame
+	"""
+
+	def __init__(self, data: bytes = b""):
+		"""Constructor
+
+		@param data Specify the data received before switching to this framing
+		"""
+		self._buffer = bytearray(data)
+
+	def feed(self, data: bytes) -> list:
+		"""Add the received data to the buffer and get the complete frames
+
+		@param data Specify the received data
+		@return A list of the complete frames in tuple (message_id, payload)
+		"""
+		self._buffer += data
+
+		frames = []
+		start = 0
+		while len(self._buffer) - start >= FRAME_HEADER.size:
+			message_id, length = FRAME_HEADER.unpack_from(self._buffer, start)
+			end = start + FRAME_HEADER.size + length
+			if end > len(self._buffer):
+				break
+			frames.append((message_id, bytes(self._buffer[start + FRAME_HEADER.size:end])))
+			start = end
+
+		del self._buffer[:start]
+		return frames
+
+	def get_pending(self) -> bytes:
+		"""Get the received data that hasn't formed a complete frame
+		"""
+		return bytes(self._buffer)
@@ -1,5 +1,5 @@
 from threading import Thread
-from time import sleep
+from time import sleep, monotonic
 import logging
 
 class JobThread():
@@ -13,24 +13,43 @@ class JobThread():
 	the class will create a Thread to run either two methods.
 
 	You can make thread do the job every n seconds by setting a positive
-	value to call_every_sec at the constructor.
+	value to call_every_sec at the constructor. By default, JobThread sleeps
+	call_every_sec after each call, so the real period is the processing time
+	plus call_every_sec. If fixed_rate is True, JobThread sleeps until the
+	next deadline instead, so the processing time is taken into account.
+
+	You can also make thread do the job only when something happens by
+	passing a trigger function, which blocks until the job is ready and
+	returns True, or returns False if it is timed out. The trigger function
+	should be timed out periodically so that the thread can be stopped.
+	See SequenceSignal.create_trigger(). If both call_every_sec and trigger
+	are specified, the target method is called once per trigger and at most
+	once every call_every_sec seconds.
 
 	@var _fn_target The target method to be run in JobThread. Note that
 	     it don't need to add an additional while loop in the target method.
+	@var _fn_trigger The trigger function. None if the thread runs without
+	     waiting for the trigger.
 	@var _thread The Thread object that runs the target method
 	@var _is_thread_started A flag controling the thread execution
 	@var _name The identification name of the thread
 	@var _call_every_sec The calling period of the target method. JobThread
 	     invokes sleep(_call_every_sec) in the loop.
+	@var _is_fixed_rate Is the calling period scheduled by the deadline?
 	"""
 
-	def __init__(self, target, name = "", call_every_sec = 0.0):
+	def __init__(self, target, name = "", call_every_sec = 0.0, \
+		fixed_rate = False, trigger = None):
 		"""Constructor
 
 		@param target Specify the target method to be run
 		@param name Specify the thread name for recognition
 		@param call_every_sec Specify the time interval in seconds
 		       for running the target method
+		@param fixed_rate Specify whether to schedule the target method by
+		       the deadline which takes the processing time into account
+		@param trigger Specify the function that blocks until the target
+		       method should be run. It returns False if it is timed out.
 		"""
 		self._logger = logging.getLogger(self.__class__.__name__)
 
@@ -43,6 +62,8 @@ class JobThread():
 		else:
 			self._name = name
 		self._call_every_sec = call_every_sec
+		self._is_fixed_rate = fixed_rate
+		self._fn_trigger = trigger
 
 	@property
 	def is_running(self):
@@ -104,6 +125,8 @@ class JobThread():
 		self._logger.debug("{0} thread is started.".format(self._name))
 
 		while self._is_thread_started:
+			if self._fn_trigger is not None and not self._fn_trigger():
+				continue
 			self._fn_target()
 
 		self._logger.debug("{0} thread is stopped.".format(self._name))
@@ -111,14 +134,30 @@ class JobThread():
 	def _thread_loop_every_sec(self, time_interval):
 		"""A while loop for Thread to execute the target method every n sec
 
+		If the thread is fixed rate, the next calling time is the previous
+		calling time plus time_interval. If the target method is overrun,
+		the missed calls are skipped instead of being run in a burst.
+
 		@param time_interval Specify the time interval
 		"""
 		self._logger.debug("{0} thread is started. " \
 			"Will be executed every {1:6f} seconds." \
 			.format(self._name, time_interval))
 
+		next_call_time = monotonic()
 		while self._is_thread_started:
+			if self._fn_trigger is not None and not self._fn_trigger():
+				continue
 			self._fn_target()
-			sleep(time_interval)
+
+			if self._is_fixed_rate:
+				next_call_time += time_interval
+				delay = next_call_time - monotonic()
+				if delay > 0:
+					sleep(delay)
+				else:
+					next_call_time = monotonic()
+			else:
+				sleep(time_interval)
 
 		self._logger.debug("{0} thread is stopped.".format(self._name))
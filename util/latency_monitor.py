@@ -0,0 +1,219 @@
+"""@package docstring
+
+Aggregate the latency of each processing stage into rolling histograms.
+The stages record their elapsed time by record(), and the histograms can
+be queried at runtime by get_summaries() or get_histogram().
+
+Usage:
+```
+start_time = time.perf_counter()
+do_something()
+latency_monitor.record(latency_monitor.STAGE_CAPTURE, \
+	time.perf_counter() - start_time)
+
+print(latency_monitor.format_summaries())
+```
+"""
+from bisect import bisect_left
+from collections import namedtuple
+from threading import Lock
+import time
+
+### Stages ###
+# Reading a frame from the frame source
+STAGE_CAPTURE = "capture"
+# Cropping and converting a frame into HSV domain
+STAGE_HSV = "hsv"
+# Segmenting the target colors and finding their blobs in a frame
+STAGE_SEGMENTATION = "segmentation"
+# Transforming the pixel positions to the maze positions
+STAGE_MAZE_TRANSFORM = "maze_transform"
+# Waiting in the queue from receiving a command to handling it
+STAGE_COMMAND_QUEUE = "command_queue"
+# From sending a message to passing it to the socket
+STAGE_SOCKET_SEND = "socket_send"
+# Running the handler of a command. It is formatted with the command,
+# so each command has its own stage, such as "handler:position".
+STAGE_COMMAND_HANDLER = "handler:{0}"
+
+# The summary of a histogram. The latencies are in seconds.
+# The percentiles are the upper bounds of the buckets, which are at most
+# 26% larger than the real values.
+LatencySummary = namedtuple("LatencySummary", \
+	["count", "mean", "p50", "p95", "p99", "max"])
+
+class RollingHistogram:
+	"""The histogram of the latencies recorded in the recent time window
+
+	The latencies are counted in the buckets whose bounds grow
+	logarithmically, 10 buckets per decade from 10 us to 10 s. The time
+	window is split into slices, and the oldest slice is dropped when
+	a new slice begins, so recording is O(1) in memory and time.
+
+	@var BUCKET_BOUNDS The upper bounds in seconds of the buckets. The last
+	     bucket counts the latencies larger than the last bound.
+	@var _slice_sec The length of a slice in seconds
+	@var _slices A list of slices, each is [slice_id, counts, total_sec, max_sec],
+	     where slice_id is the index of the slice since the epoch
+	@var _lock The lock for accessing _slices
+	"""
+
+	BUCKET_BOUNDS = tuple(1e-5 * 10 ** (i / 10.0) for i in range(61))
+
+	def __init__(self, window_sec = 60.0, num_of_slices = 6):
+		"""Constructor
+
+		@param window_sec Specify the length of the time window in seconds
+		@param num_of_slices Specify the number of the slices of the window
+		"""
+		self._slice_sec = window_sec / num_of_slices
+		self._slices = [self._new_slice(-1) for i in range(num_of_slices)]
+		self._lock = Lock()
+
+	def _new_slice(self, slice_id):
+		return [slice_id, [0] * (len(RollingHistogram.BUCKET_BOUNDS) + 1), 0.0, 0.0]
+
+	def record(self, elapsed_sec):
+		"""Count a latency in the current slice
+
+		@param elapsed_sec Specify the latency in seconds
+		"""
+		bucket = bisect_left(RollingHistogram.BUCKET_BOUNDS, elapsed_sec)
+		slice_id = int(time.monotonic() / self._slice_sec)
+
+		with self._lock:
+			current_slice = self._slices[slice_id % len(self._slices)]
+			if current_slice[0] != slice_id:
+				current_slice = self._new_slice(slice_id)
+				self._slices[slice_id % len(self._slices)] = current_slice
+
+			current_slice[1][bucket] += 1
+			current_slice[2] += elapsed_sec
+			current_slice[3] = max(current_slice[3], elapsed_sec)
+
+	def get_buckets(self) -> list:
+		"""Get the counts of the buckets in the time window
+
+		@return A list of (upper_bound, count). The upper bound of the last
+		        bucket is float("inf").
+		"""
+		counts, _, _ = self._merge_slices()
+		return list(zip(RollingHistogram.BUCKET_BOUNDS + (float("inf"),), counts))
+
+	def get_summary(self) -> LatencySummary:
+		"""Get the summary of the latencies in the time window
+
+		@return The LatencySummary. All the values are 0 if there is no latency.
+		"""
+		counts, total_sec, max_sec = self._merge_slices()
+		count = sum(counts)
+		if count == 0:
+			return LatencySummary(0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+		percentiles = []
+		for percent in (50, 95, 99):
+			rank = max(int(round(percent / 100.0 * count)), 1)
+			accumulated = 0
+			for bucket in range(len(counts)):
+				accumulated += counts[bucket]
+				if accumulated >= rank:
+					break
+			if bucket < len(RollingHistogram.BUCKET_BOUNDS):
+				percentiles.append(min(RollingHistogram.BUCKET_BOUNDS[bucket], max_sec))
+			else:
+				percentiles.append(max_sec)
+
+		return LatencySummary(count, total_sec / count, *percentiles, max_sec)
+
+	def reset(self):
+		"""Drop all the latencies recorded
+		"""
+		with self._lock:
+			self._slices = [self._new_slice(-1) for i in range(len(self._slices))]
+
+	def _merge_slices(self):
+		"""Merge the slices in the time window
+
+		@return (counts, total_sec, max_sec)
+		"""
+		oldest_slice_id = int(time.monotonic() / self._slice_sec) - len(self._slices) + 1
+		counts = [0] * (len(RollingHistogram.BUCKET_BOUNDS) + 1)
+		total_sec = 0.0
+		max_sec = 0.0
+
+		with self._lock:
+			for slice_id, slice_counts, slice_total_sec, slice_max_sec in self._slices:
+				if slice_id < oldest_slice_id:
+					continue
+				for bucket in range(len(counts)):
+					counts[bucket] += slice_counts[bucket]
+				total_sec += slice_total_sec
+				max_sec = max(max_sec, slice_max_sec)
+
+		return counts, total_sec, max_sec
+
+### Module variables ###
+# The histogram of each stage
+_histograms = {}	# (stage, RollingHistogram)
+# The lock for adding the histograms
+_histograms_lock = Lock()
+# Are the latencies recorded?
+_is_enabled = True
+
+def set_enabled(enabled: bool):
+	"""Enable or disable recording the latencies
+	"""
+	global _is_enabled
+	_is_enabled = enabled
+
+def is_enabled() -> bool:
+	return _is_enabled
+
+def record(stage: str, elapsed_sec: float):
+	"""Record the latency of the stage
+
+	The histogram of the stage is created at the first record.
+
+	@param stage Specify the name of the stage, such as STAGE_CAPTURE
+	@param elapsed_sec Specify the latency in seconds
+	"""
+	if not _is_enabled:
+		return
+
+	histogram = _histograms.get(stage)
+	if histogram is None:
+		with _histograms_lock:
+			histogram = _histograms.setdefault(stage, RollingHistogram())
+	histogram.record(elapsed_sec)
+
+def get_histogram(stage: str) -> RollingHistogram:
+	"""Get the histogram of the stage
+
+	@return The RollingHistogram. None if the stage has not been recorded.
+	"""
+	return _histograms.get(stage)
+
+def get_summaries() -> dict:
+	"""Get the summaries of all the stages
+
+	@return A dictionary of stage-LatencySummary pair
+	"""
+	return {stage: histogram.get_summary() \
+		for stage, histogram in list(_histograms.items())}
+
+def format_summaries() -> str:
+	"""Format the summaries of all the stages into a table in milliseconds
+	"""
+	lines = ["{0:<22} {1:>8} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}" \
+		.format("stage", "count", "mean", "p50", "p95", "p99", "max")]
+	for stage, summary in get_summaries().items():
+		lines.append("{0:<22} {1:>8} {2:>7.3f}ms {3:>7.3f}ms {4:>7.3f}ms " \
+			"{5:>7.3f}ms {6:>7.3f}ms".format(stage, summary.count, \
+			*[value * 1000 for value in summary[1:]]))
+	return "\n".join(lines)
+
+def reset():
+	"""Drop the latencies recorded of all the stages
+	"""
+	for histogram in list(_histograms.values()):
+		histogram.reset()
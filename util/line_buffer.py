@@ -0,0 +1,94 @@
+"""@package docstring
+
+Reassemble the newline-terminated messages from a byte stream.
+
+The clients that don't end their messages with a newline are served in the
+legacy mode, which only works if each message arrives in a single read:
+a message split across reads becomes two messages, and the messages merged
+into a read become one message. Send a newline after each message to avoid it.
+"""
+import logging
+
+_logger = logging.getLogger(__name__)
+
+class LineBuffer:
+	"""Buffer the received data of a connection and split it into lines
+
+	TCP may merge several messages into a read or split a message across
+	reads, so the data is buffered until a newline is received.
+
+	For the clients that don't end their messages with a newline, the buffer
+	starts in the legacy mode, which treats each read as a whole message.
+	It switches to the line mode once a newline is received. The messages
+	read before that are not reassembled.
+
+	Usage:
+	```
+	recv_buffer = LineBuffer()
+	for message in recv_buffer.feed(sock.recv(512)):
+		handle(message)
+	```
+
+	@var MAX_LINE_LENGTH The default maximum length in bytes of a line
+	@var _buffer The received data that hasn't been terminated by a newline
+	@var _max_length The maximum length in bytes of a line. The data longer
+	     than it without a newline is discarded.
+	@var _is_line_mode Has a newline been received?
+	@var _is_discarding Is the rest of a too long line being discarded?
+	"""
+
+	MAX_LINE_LENGTH = 4096
+
+	def __init__(self, max_length = MAX_LINE_LENGTH):
+		"""Constructor
+
+		@param max_length Specify the maximum length in bytes of a line
+		"""
+		self._buffer = bytearray()
+		self._max_length = max_length
+		self._is_line_mode = False
+		self._is_discarding = False
+
+	def feed(self, data: bytes) -> list:
+		"""Add the received data to the buffer and get the complete messages
+
+		The trailing "\\r" of each message is removed, and the empty messages
+		are skipped.
+
+		@param data Specify the received data
+		@return A list of the complete messages in str
+		@exception UnicodeDecodeError If a message is not encoded in UTF-8
+		"""
+		if not self._is_line_mode:
+			if b"\n" not in data:
+				message = data.decode("utf-8").rstrip("\r")
+				return [message] if len(message) > 0 else []
+			self._is_line_mode = True
+
+		self._buffer += data
+		lines = self._buffer.split(b"\n")
+		# The last one is not terminated yet
+		self._buffer = lines.pop()
+
+		if self._is_discarding and len(lines) > 0:
+			# The rest of the too long line is received
+			lines.pop(0)
+			self._is_discarding = False
+
+		if len(self._buffer) > self._max_length:
+			_logger.error("The line is longer than {0} bytes. Discard it." \
+				.format(self._max_length))
+			self._buffer.clear()
+			self._is_discarding = True
+
+		messages = []
+		for line in lines:
+			message = line.decode("utf-8").rstrip("\r")
+			if len(message) > 0:
+				messages.append(message)
+		return messages
+
+	def get_pending(self) -> bytes:
+		"""Get the received data that hasn't been terminated by a newline
+		"""
+		return bytes(self._buffer)
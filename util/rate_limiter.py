@@ -0,0 +1,46 @@
+"""@package docstring
+
+The token bucket for limiting the rate of the requests.
+"""
+import time
+
+class TokenBucket:
+	"""Limit the rate of the requests while allowing a short burst
+
+	The bucket is refilled at `rate` tokens per second, and holds at most
+	`burst` tokens. Each request takes a token. If there is no token left,
+	the request exceeds the rate limit.
+
+	@var _rate The number of tokens refilled per second
+	@var _burst The maximum number of tokens in the bucket
+	@var _tokens The number of tokens in the bucket at _timestamp
+	@var _timestamp The time of the last refilling
+	"""
+
+	def __init__(self, rate: float, burst: int):
+		"""Constructor
+
+		The bucket is full when it is created.
+
+		@param rate Specify the number of requests allowed per second
+		@param burst Specify the maximum number of requests allowed at once
+		"""
+		self._rate = rate
+		self._burst = burst
+		self._tokens = float(burst)
+		self._timestamp = time.monotonic()
+
+	def try_consume(self) -> bool:
+		"""Take a token from the bucket
+
+		@return True if the token is taken. False if the rate limit is exceeded.
+		"""
+		now = time.monotonic()
+		self._tokens = min(self._burst, \
+			self._tokens + (now - self._timestamp) * self._rate)
+		self._timestamp = now
+
+		if self._tokens < 1.0:
+			return False
+		self._tokens -= 1.0
+		return True
@@ -0,0 +1,76 @@
+from threading import Condition
+
+class SequenceSignal:
+	"""A signal that notifies the waiting threads of the new published items
+
+	Each time a new item is published, the sequence number of the signal is
+	increased by one. A thread waits for the sequence number to be different
+	from the one it has seen, so it never misses or handles an item twice.
+
+	Usage:
+	```
+	new_frame_signal = SequenceSignal()
+	new_frame_signal.publish() # In the producer thread
+
+	seen_seq = new_frame_signal.seq
+	seen_seq = new_frame_signal.wait_for_newer(seen_seq) # In the consumer thread
+	```
+
+	@var _condition The condition for waiting the new item
+	@var _seq The sequence number of the latest published item
+	"""
+
+	def __init__(self):
+		"""Constructor
+		"""
+		self._condition = Condition()
+		self._seq = 0
+
+	@property
+	def seq(self):
+		"""The sequence number of the latest published item
+		"""
+		return self._seq
+
+	def publish(self) -> int:
+		"""Publish a new item and wake up all the waiting threads
+
+		@return The sequence number of the new item
+		"""
+		with self._condition:
+			self._seq += 1
+			self._condition.notify_all()
+			return self._seq
+
+	def wait_for_newer(self, seen_seq, timeout = None) -> int:
+		"""Wait until the sequence number is different from seen_seq
+
+		@param seen_seq Specify the sequence number that has been seen
+		@param timeout Specify the maximum waiting time in seconds
+		@return The latest sequence number. It is seen_seq if it is timed out.
+		"""
+		with self._condition:
+			self._condition.wait_for(lambda: self._seq != seen_seq, timeout)
+			return self._seq
+
+	def create_trigger(self, timeout = 0.1):
+		"""Create a trigger function for the JobThread
+
+		The trigger function waits for a new item published after the last
+		call of it. It returns True if there is a new item, or False if it is
+		timed out, so the JobThread can check its running flag.
+
+		@param timeout Specify the maximum waiting time in seconds of each call
+		@return The trigger function
+		"""
+		seen_seq = self._seq
+
+		def trigger() -> bool:
+			nonlocal seen_seq
+			latest_seq = self.wait_for_newer(seen_seq, timeout)
+			if latest_seq == seen_seq:
+				return False
+			seen_seq = latest_seq
+			return True
+
+		return trigger
@@ -5,10 +5,13 @@ IP and port by a new thread. It provides callback functions
 for new connection, disconnection, or receving message from
 the client.
 """
-import socket, select, time, logging
+import socket, select, logging, time
 from threading import Thread
 from queue import Queue
 from util.function_delegate import FunctionDelegate
+from util import latency_monitor
+from util.line_buffer import LineBuffer
+from util.binary_frame import BinaryFrameBuffer
 
 ### Callback functions ###
 # Add callbacks by '+=' operator, such as `on_new_connect += foo`.
@@ -16,7 +19,9 @@ from util.function_delegate import FunctionDelegate
 on_new_connect = FunctionDelegate()
 # For disconnection. It should be foo(client_ip: str).
 on_disconnect = FunctionDelegate()
-# For receving message from client. It should be foo(client_ip: str, message: str)
+# For receving message from client. It should be foo(client_ip: str, message),
+# where the message is a str, or a tuple (message_id: int, payload: bytes)
+# if the client uses the binary framing.
 on_recv_msg = FunctionDelegate()
 
 ### Module variables ###
@@ -30,23 +35,42 @@ _server_running = False
 MAX_CONNECTION = 8
 # The buffer size for receving message at a time.
 RECV_BUFF_SIZE = 512
+# The max size of the unsent data of a client. The client is disconnected
+# if it doesn't receive the data fast enough.
+MAX_SEND_BUFF_SIZE = 64 * 1024
 # A list for storing sockets, including server and clients.
 _sockets = []
 # A dictionary(IP, socket) which mapping IP to the socket.
 _clients = {}
-# The time interval of the request from the client.
-request_interval = 0.1 # seconds
-# The queue for the sending message
+# A dictionary(socket, ClientSock) which mapping the socket to its client.
+# The IP of a reset socket cannot be got from the socket itself.
+_socket_clients = {}
+# The queue for the sending message in (to_ip, msg, queued_time, switch_framing),
+# where switch_framing tells whether to switch to the binary framing after msg
 _sending_queue = Queue()
+# A socket pair (recv, send) for waking up the server thread from select.
+# The recv socket is in the _sockets.
+_wakeup_socks = None
 # Logger
 _logger = logging.getLogger(__name__)
 
 ### Data structure ###
 class ClientSock:
-	def __init__(self, sock):
+	"""The client socket and its state
+
+	@var sock The nonblocking socket of the client
+	@var ip The IP of the client
+	@var to_be_closed Is the socket going to be closed by the server thread?
+	@var send_buffer The data that hasn't been sent to the client
+	@var recv_buffer The LineBuffer splitting the received data into messages,
+	     or the BinaryFrameBuffer if the client uses the binary framing
+	"""
+	def __init__(self, sock, ip):
 		self.sock = sock
+		self.ip = ip
 		self.to_be_closed = False
-		self.timestamp = time.time()
+		self.send_buffer = bytearray()
+		self.recv_buffer = LineBuffer()
 
 def start_server(server_ip: str, server_port: int) -> bool:
 	"""Start the TCP server on server_ip: server_port.
@@ -58,20 +82,25 @@ def start_server(server_ip: str, server_port: int) -> bool:
 	@param server_port Specify the port of the TCP server
 	@return True if the server successfully started
 	"""
-	global _server_thread, _server_running
+	global _server_thread, _server_running, _wakeup_socks
 
 	if _server_running:
-		return
+		return False
 
 	_logger.debug("TCP server thread is starting.")
 
 	_sockets.clear()
 	_clients.clear()
+	_socket_clients.clear()
 	
 	_server_socket = _create_server_socket(server_ip, server_port)
 	if _server_socket is None:
 		return False
 
+	_wakeup_socks = socket.socketpair()
+	for sock in _wakeup_socks:
+		sock.setblocking(False)
+
 	_server_thread = Thread( \
 		target = lambda: _listen_to_client(_server_socket), \
 		name = "tcp_server")
@@ -96,6 +125,7 @@ def stop_server():
 	_logger.debug("TCP server thread is stopping.")
 
 	_server_running = False
+	_wakeup_server_thread()
 	_server_thread.join()
 
 	# Close all the client sockets
@@ -103,6 +133,9 @@ def stop_server():
 		target_client.to_be_closed = True
 	_check_disconnection()
 
+	for sock in _wakeup_socks:
+		sock.close()
+
 	_logger.info("Server is stopped.")
 
 def is_running() -> bool:
@@ -142,23 +175,38 @@ def _listen_to_client(server_socket):
 
 	The mainloop of the TCP server. If there has new pending,
 	it will accept new connection, receive message, or close connection.
+	The server thread is woken up by the wake-up socket when there is a new
+	message to be sent, and the clients that have unsent data are checked
+	for writing, so the messages are sent as soon as possible.
 	"""
-	# Add server socket to the checking list
+	# Add server socket and wake-up socket to the checking list
 	_sockets.append(server_socket)
+	_sockets.append(_wakeup_socks[0])
 
 	_logger.debug("TCP server thread is started.")
 
 	while _server_running:
 		# Checking sockets if there are incoming message for reading
 		checking_sockets = _sockets.copy()
-		read_sockets, _, _ = select.select(checking_sockets, [], [], 0.1)
+		# Checking clients that have unsent data for writing
+		writing_clients = {client.sock: client \
+			for client in _clients.values() if len(client.send_buffer) > 0}
+		read_sockets, write_sockets, _ = \
+			select.select(checking_sockets, list(writing_clients.keys()), [], 0.1)
 
 		for sock in read_sockets:
 			if sock == server_socket:
 				_new_connection(*(server_socket.accept()))	
+			elif sock == _wakeup_socks[0]:
+				_drain_wakeup_socket()
 			else:
 				_recv_msg(sock)
 
+		for sock in write_sockets:
+			client = writing_clients[sock]
+			if not client.to_be_closed:
+				_flush_send_buffer(client)
+
 		_consume_sending_queue()
 		# Check if the socket needs to be closed
 		_check_disconnection()
@@ -177,12 +225,15 @@ def _new_connection(new_sock, addr_info):
 	The socket and the IP of the new connection is added to _socket
 	and _clients. And then invoke on_new_connect.
 
+	The Nagle's algorithm is disabled on the new socket, so the short replies
+	are sent at once instead of waiting for the ACK of the previous one.
+
 	@param new_sock The socket of the new client
 	@param addr_info The information of the new_sock
 	"""
 	global _sockets, _clients
 
-	sock_ip = new_sock.getpeername()[0]
+	sock_ip = addr_info[0]
 
 	try:
 		# Check if the incoming connection is already in the list
@@ -191,29 +242,34 @@ def _new_connection(new_sock, addr_info):
 		pass
 	else:
 		# If it's in the list, disconnection the old connection
-		_disconnection(client_sock.sock)
+		_disconnection(client_sock)
 	finally:
 		# Accept new connection
+		new_sock.setblocking(False)
+		new_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 		_sockets.append(new_sock)
-		_clients[sock_ip] = ClientSock(new_sock)
+		_clients[sock_ip] = ClientSock(new_sock, sock_ip)
+		_socket_clients[new_sock] = _clients[sock_ip]
 
 		_logger.info("New connection from {0}. Current clients: {1}" \
 			.format(sock_ip, len(_clients)))
 
 	on_new_connect.invoke(sock_ip)
 
-def _disconnection(sock):
+def _disconnection(client: ClientSock):
 	"""Close the connection from client
 
 	Remove the socket from _socket and _clients, and close that socket.
 	Then, invoke on_disconnection.
 
-	@param sock The socket to be closed
+	@param client The ClientSock to be closed
 	"""
-	sock_ip = sock.getpeername()[0]
+	sock = client.sock
+	sock_ip = client.ip
 
 	_sockets.remove(sock)
 	_clients.pop(sock_ip)
+	_socket_clients.pop(sock)
 
 	_logger.info("Disconnection from {0}. Current clients: {1}" \
 		.format(sock_ip, len(_clients)))
@@ -246,7 +302,7 @@ def _check_disconnection():
 			sock_to_be_closed.append(client_sock)
 
 	for client_sock in sock_to_be_closed:
-		_disconnection(client_sock.sock)
+		_disconnection(client_sock)
 
 def _recv_msg(sock):
 	"""Receving message from the client
@@ -254,70 +310,154 @@ def _recv_msg(sock):
 	If the exception occured when receving message, the client socket
 	will be closed forcedly. The exception will be printed to the console.
 
-	The received message is passed by invoking on_recv_msg.
+	The received data is split into messages by the LineBuffer of the client,
+	and each complete message is passed by invoking on_recv_msg.
 
 	@param sock The socket that sending the message
 	"""
-	sock_ip = sock.getpeername()[0]
+	target_client = _socket_clients[sock]
+	sock_ip = target_client.ip
 
 	try:
-		recv_data = sock.recv(RECV_BUFF_SIZE).decode('utf-8')
+		recv_data = sock.recv(RECV_BUFF_SIZE)
+		messages = target_client.recv_buffer.feed(recv_data)
 	except Exception as e:
 		_logger.error("Exception occured while receving data from {0}: {1}" \
 			.format(sock_ip, e))
-		_disconnection(sock)
+		_disconnection(target_client)
 	else:
 		if len(recv_data) > 0:
-			# Check timestamp to see whether handle the message or not.
-			target_client = _clients[sock_ip]
-
-			if time.time() - target_client.timestamp > request_interval:
+			for message in messages:
 				_logger.debug("Receive data from {0}: {1}" \
-					.format(sock_ip, recv_data))
-				target_client.timestamp = time.time()
-				on_recv_msg.invoke(sock_ip, recv_data)
+					.format(sock_ip, message))
+				on_recv_msg.invoke(sock_ip, message)
 		else:
-			_disconnection(sock)
+			_disconnection(target_client)
+
+def _wakeup_server_thread():
+	"""Wake up the server thread waiting in select
+	"""
+	try:
+		_wakeup_socks[1].send(b"\0")
+	except (BlockingIOError, OSError):
+		# The wake-up socket is full, so the server thread will be woken up
+		# anyway, or the server is stopped.
+		pass
+
+def _drain_wakeup_socket():
+	"""Read out all the wake-up data
+	"""
+	try:
+		while _wakeup_socks[0].recv(RECV_BUFF_SIZE):
+			pass
+	except BlockingIOError:
+		pass
+
+def _flush_send_buffer(client: ClientSock):
+	"""Send the unsent data of the client without blocking
+
+	The data that cannot be sent now remains in the buffer, and will be sent
+	when the socket is writable.
+
+	@param client The ClientSock to be flushed
+	"""
+	try:
+		msg_sent = client.sock.send(client.send_buffer)
+		if msg_sent == 0:
+			raise RuntimeError("Socket connetion broken")
+		del client.send_buffer[:msg_sent]
+	except BlockingIOError:
+		pass
+	except Exception as e:
+		_logger.error("Exception occured while sending data to {0}: {1}"\
+			.format(client.ip, e))
+		client.to_be_closed = True
 
 def _consume_sending_queue():
 	while not _sending_queue.empty():
 		message_item = _sending_queue.get()
 
 		try:
-			to_ip = message_item[0]
-			message = message_item[1] + "\n"
+			to_ip, message, queued_time, switch_framing = message_item
 			client = _clients[to_ip]
-
-			total_msg_sent = 0
-			while total_msg_sent < len(message):
-				msg_sent = client.sock.send(message[total_msg_sent:].encode())
-				if msg_sent == 0:
-					raise RuntimeError("Socket connetion broken")
-				total_msg_sent = total_msg_sent + msg_sent
-			_logger.debug("Send data to {0}: {1}".format(to_ip, message.rstrip("\n")))
 		except KeyError:
 			_logger.error("Exception occured while sending data to {0}: "\
 				"Client not found".format(to_ip))
-		except Exception as e:
-			_logger.error("Exception occured while sending data to {0}: {1}"\
-				.format(to_ip, e))
+			continue
+
+		if client.to_be_closed:
+			continue
+
+		client.send_buffer += message if isinstance(message, bytes) \
+			else (message + "\n").encode()
+		if len(client.send_buffer) > MAX_SEND_BUFF_SIZE:
+			_logger.error("Exception occured while sending data to {0}: "\
+				"Too much unsent data. Disconnect it.".format(to_ip))
 			client.to_be_closed = True
+			continue
+
+		_flush_send_buffer(client)
+		latency_monitor.record(latency_monitor.STAGE_SOCKET_SEND, \
+			time.perf_counter() - queued_time)
+		_logger.debug("Send data to {0}: {1}".format(to_ip, message))
+
+		if switch_framing:
+			_switch_to_binary_framing(client)
+
+def _switch_to_binary_framing(client: ClientSock):
+	"""Split the data received from the client by the binary framing
 
-def send_message(to_ip: str, msg: str):
+	It is called right after the reply of the negotiation is passed to the
+	socket, so the client cannot have received the reply yet. If there is
+	data received but not split, the client doesn't wait for the reply,
+	and it is disconnected.
+	"""
+	if len(client.recv_buffer.get_pending()) > 0:
+		_logger.error("{0} sends data before the binary framing is " \
+			"negotiated. Disconnect it.".format(client.ip))
+		client.to_be_closed = True
+		return
+
+	client.recv_buffer = BinaryFrameBuffer()
+	_logger.debug("{0} uses the binary framing.".format(client.ip))
+
+def send_message(to_ip: str, msg):
 	"""Send message to a cllient.
 
 	The message item (to_ip, msg) will be pushed to the queue, and
-	then consumed in _consume_sending_queue().
+	then consumed in _consume_sending_queue(). The server thread is woken up
+	immediately to send it. The str message is ended with a newline and
+	encoded in UTF-8, and the bytes message is sent as it is.
 
 	@param to_ip Specify the IP of the client
-	@param msg Specify the message
+	@param msg Specify the message in str, or the binary frame in bytes
 	"""
-	_sending_queue.put((to_ip, msg))
+	_sending_queue.put((to_ip, msg, time.perf_counter(), False))
+	if _server_running:
+		_wakeup_server_thread()
 
-def broadcast_message(msg: str):
+def broadcast_message(msg, exclude = ()):
 	"""Boardcast message to all the clients
 
-	@param msg Specify the message
+	@param msg Specify the message in str, or the binary frame in bytes
+	@param exclude Specify the IPs of the clients not to send
 	"""
-	for ip in _clients.keys():
-		send_message(ip, msg)
+	for ip in list(_clients.keys()):
+		if ip not in exclude:
+			send_message(ip, msg)
+
+def set_binary_framing(client_ip: str, reply: str):
+	"""Send the reply of the negotiation, and then split the data received
+	from the client by the binary framing
+
+	The framing is switched by the server thread right after the reply is
+	passed to the socket, so the client can send the binary frames once it
+	receives the reply. The client must not send anything between its request
+	and the reply. Otherwise, it is disconnected.
+
+	@param client_ip Specify the IP of the client
+	@param reply Specify the reply in str
+	"""
+	_sending_queue.put((client_ip, reply, time.perf_counter(), True))
+	if _server_running:
+		_wakeup_server_thread()
@@ -0,0 +1,340 @@
+"""@package docstring
+
+The asyncio backend of the TCP server. It has the same interface as
+util.tcp_server, and shares the callback functions with it, so the callbacks
+added to either module are invoked by both backends.
+
+The event loop is run by a new thread. The messages to be sent are
+written as soon as the event loop is woken up, and the number of
+clients is not limited by the select loop.
+"""
+import asyncio, logging, time
+from threading import Thread
+from util.tcp_server import on_new_connect, on_disconnect, on_recv_msg, \
+	MAX_SEND_BUFF_SIZE
+from util.line_buffer import LineBuffer
+from util.binary_frame import BinaryFrameBuffer
+from util import latency_monitor
+
+### Module variables ###
+# The event loop of the server
+_loop = None
+# The asyncio server object
+_server = None
+# The thread for running the event loop
+_server_thread = None
+# Is server running?
+_server_running = False
+# The max number of the connections. It is also the max pending connections
+# of the server socket.
+MAX_CONNECTION = 256
+# A dictionary(IP, _ClientProtocol) which mapping IP to the client.
+_clients = {}
+# Logger
+_logger = logging.getLogger(__name__)
+
+### Data structure ###
+class _ClientProtocol(asyncio.Protocol):
+	"""The protocol of a client connection
+
+	All the methods are invoked in the event loop thread.
+
+	@var transport The transport of the connection
+	@var ip The IP of the client
+	@var is_replaced Is the connection replaced by a new one from the same IP?
+	@var recv_buffer The LineBuffer splitting the received data into messages,
+	     or the BinaryFrameBuffer if the client uses the binary framing
+	"""
+
+	def __init__(self):
+		self.transport = None
+		self.ip = None
+		self.is_replaced = False
+		self.recv_buffer = LineBuffer()
+
+	def connection_made(self, transport):
+		"""Accept new connection
+
+		If the IP of the new connection is already in the _clients,
+		it will close the old connection first. If there are MAX_CONNECTION
+		clients, the connection from a new IP is rejected.
+		"""
+		self.transport = transport
+		self.ip = transport.get_extra_info("peername")[0]
+
+		if len(_clients) >= MAX_CONNECTION and self.ip not in _clients:
+			_logger.error("Reject the connection from {0}: " \
+				"Too many clients.".format(self.ip))
+			transport.close()
+			return
+
+		old_client = _clients.pop(self.ip, None)
+		if old_client is not None:
+			old_client.is_replaced = True
+			old_client.transport.close()
+			_logger.info("Disconnection from {0}. Current clients: {1}" \
+				.format(self.ip, len(_clients)))
+			on_disconnect.invoke(self.ip)
+
+		_clients[self.ip] = self
+		_logger.info("New connection from {0}. Current clients: {1}" \
+			.format(self.ip, len(_clients)))
+		on_new_connect.invoke(self.ip)
+
+	def data_received(self, data):
+		"""Receving message from the client
+
+		The received data is split into messages by the recv_buffer, and
+		each complete message is passed by invoking on_recv_msg.
+		"""
+		try:
+			messages = self.recv_buffer.feed(data)
+		except Exception as e:
+			_logger.error("Exception occured while receving data from {0}: {1}" \
+				.format(self.ip, e))
+			self.transport.close()
+			return
+
+		for message in messages:
+			_logger.debug("Receive data from {0}: {1}".format(self.ip, message))
+			on_recv_msg.invoke(self.ip, message)
+
+	def connection_lost(self, exc):
+		"""Remove the client from _clients and invoke on_disconnect
+		"""
+		if self.is_replaced or _clients.get(self.ip) is not self:
+			return
+
+		_clients.pop(self.ip)
+		_logger.info("Disconnection from {0}. Current clients: {1}" \
+			.format(self.ip, len(_clients)))
+		on_disconnect.invoke(self.ip)
+
+def start_server(server_ip: str, server_port: int) -> bool:
+	"""Start the TCP server on server_ip: server_port.
+
+	If the server is running, it will do nothing. Otherwise, create the
+	server in a new event loop and start the server thread to run it.
+
+	@param server_ip Specify the IPv4 of the TCP server
+	@param server_port Specify the port of the TCP server
+	@return True if the server successfully started
+	"""
+	global _loop, _server, _server_thread, _server_running
+
+	if _server_running:
+		return False
+
+	_logger.debug("TCP server thread is starting.")
+
+	_clients.clear()
+
+	_loop = asyncio.new_event_loop()
+	try:
+		_server = _loop.run_until_complete(_loop.create_server( \
+			_ClientProtocol, server_ip, server_port, \
+			backlog = MAX_CONNECTION, reuse_address = True))
+	except Exception as e:
+		_logger.error("Exception occured while creating server socket: " \
+			+ str(e))
+		_loop.close()
+		_loop = None
+		return False
+
+	_server_thread = Thread(target = _run_loop, name = "tcp_server")
+	_server_running = True
+	_server_thread.start()
+
+	_logger.info("Server is started on {0}:{1}" \
+		.format(server_ip, server_port))
+
+	return True
+
+def stop_server():
+	"""Stop the TCP server
+
+	If the server is not running, it will do nothing.
+	"""
+	global _loop, _server, _server_running
+
+	if not _server_running:
+		return
+
+	_logger.debug("TCP server thread is stopping.")
+
+	_server_running = False
+	asyncio.run_coroutine_threadsafe(_close_server(), _loop).result()
+	_loop.call_soon_threadsafe(_loop.stop)
+	_server_thread.join()
+	_loop.close()
+	_loop = None
+	_server = None
+
+	_logger.info("Server is stopped.")
+
+def is_running() -> bool:
+	"""Is server running?
+	"""
+	return _server_running
+
+def get_current_connection_num():
+	"""Get the number of connections in the TCP server
+
+	@return A tuple of (num of connections, max connection)
+	"""
+	return (len(_clients), MAX_CONNECTION)
+
+def _run_loop():
+	"""The target method of the server thread
+	"""
+	_logger.debug("TCP server thread is started.")
+	asyncio.set_event_loop(_loop)
+	_loop.run_forever()
+	_logger.debug("TCP server thread is stopped.")
+
+async def _close_server():
+	"""Stop accepting new connections and close all the client connections
+	"""
+	_server.close()
+	for client in list(_clients.values()):
+		client.transport.close()
+	await _server.wait_closed()
+	# Let the connection_lost() of the closed clients run
+	await asyncio.sleep(0)
+
+	# Clean up the clients whose connection_lost() is not invoked yet
+	for client_ip in list(_clients.keys()):
+		_clients.pop(client_ip)
+		on_disconnect.invoke(client_ip)
+
+def force_disconnection(sock_ip):
+	"""Forcely close the connection from the client asychronizedly
+
+	The connection is closed by the server thread.
+	"""
+	if sock_ip not in _clients:
+		_logger.error("{0} is not connecting to server. " \
+			"Cannot forcely disconnect it.".format(sock_ip))
+		return
+
+	_logger.info("Forcely disconnect {0}".format(sock_ip))
+	_call_in_loop(_close_client, sock_ip)
+
+def _close_client(sock_ip):
+	client = _clients.get(sock_ip)
+	if client is not None:
+		client.transport.close()
+
+def _call_in_loop(callback, *args):
+	"""Call the callback in the event loop thread
+
+	@return False if the server is not running
+	"""
+	loop = _loop
+	if loop is None:
+		return False
+	try:
+		loop.call_soon_threadsafe(callback, *args)
+	except RuntimeError:
+		# The event loop is closed
+		return False
+	return True
+
+def _write_message(to_ip: str, msg, queued_time):
+	"""Write the message to the client in the event loop thread
+
+	The message is buffered by the transport, so it never blocks. If the
+	client doesn't receive the data fast enough and the unsent data is more
+	than MAX_SEND_BUFF_SIZE, the client is disconnected, which is the same as
+	util.tcp_server.
+	The str message is ended with a newline and encoded in UTF-8, and
+	the bytes message is written as it is.
+
+	@param queued_time The time.perf_counter() when the message is sent
+	"""
+	try:
+		client = _clients[to_ip]
+	except KeyError:
+		_logger.error("Exception occured while sending data to {0}: "\
+			"Client not found".format(to_ip))
+		return
+
+	try:
+		client.transport.write(msg if isinstance(msg, bytes) else (msg + "\n").encode())
+		if client.transport.get_write_buffer_size() > MAX_SEND_BUFF_SIZE:
+			_logger.error("Exception occured while sending data to {0}: "\
+				"Too much unsent data. Disconnect it.".format(to_ip))
+			# Drop the unsent data instead of waiting for it to be flushed
+			client.transport.abort()
+			return
+		latency_monitor.record(latency_monitor.STAGE_SOCKET_SEND, \
+			time.perf_counter() - queued_time)
+		_logger.debug("Send data to {0}: {1}".format(to_ip, msg))
+	except Exception as e:
+		_logger.error("Exception occured while sending data to {0}: {1}"\
+			.format(to_ip, e))
+		client.transport.close()
+
+def _write_broadcast_message(msg, exclude, queued_time):
+	for ip in list(_clients.keys()):
+		if ip not in exclude:
+			_write_message(ip, msg, queued_time)
+
+def _switch_to_binary_framing(client_ip: str, reply: str, queued_time):
+	"""Write the reply of the negotiation and switch to the binary framing
+
+	Both are done in the same callback, so no data is received in between.
+	If there is data received but not split, the client doesn't wait for
+	the reply, and it is disconnected.
+	"""
+	_write_message(client_ip, reply, queued_time)
+
+	client = _clients.get(client_ip)
+	if client is None or client.transport.is_closing():
+		return
+	if len(client.recv_buffer.get_pending()) > 0:
+		_logger.error("{0} sends data before the binary framing is " \
+			"negotiated. Disconnect it.".format(client_ip))
+		client.transport.close()
+		return
+
+	client.recv_buffer = BinaryFrameBuffer()
+	_logger.debug("{0} uses the binary framing.".format(client_ip))
+
+def send_message(to_ip: str, msg):
+	"""Send message to a cllient.
+
+	The message will be written by the server thread as soon as possible.
+
+	@param to_ip Specify the IP of the client
+	@param msg Specify the message in str, or the binary frame in bytes
+	"""
+	if not _call_in_loop(_write_message, to_ip, msg, time.perf_counter()):
+		_logger.error("Exception occured while sending data to {0}: "\
+			"Server is not running".format(to_ip))
+
+def broadcast_message(msg, exclude = ()):
+	"""Boardcast message to all the clients
+
+	@param msg Specify the message in str, or the binary frame in bytes
+	@param exclude Specify the IPs of the clients not to send
+	"""
+	_call_in_loop(_write_broadcast_message, msg, frozenset(exclude), \
+		time.perf_counter())
+
+def set_binary_framing(client_ip: str, reply: str):
+	"""Send the reply of the negotiation, and then split the data received
+	from the client by the binary framing
+
+	The framing is switched by the server thread right after the reply is
+	written, so the client can send the binary frames once it receives the
+	reply. The client must not send anything between its request and the
+	reply. Otherwise, it is disconnected.
+
+	@param client_ip Specify the IP of the client
+	@param reply Specify the reply in str
+	"""
+	if not _call_in_loop(_switch_to_binary_framing, client_ip, reply, \
+		time.perf_counter()):
+		_logger.error("Exception occured while sending data to {0}: "\
+			"Server is not running".format(client_ip))
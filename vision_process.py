@@ -0,0 +1,507 @@
+"""@package docstring
+Run the frame capturing and the color recognition in a worker process.
+
+The worker process owns the real frame source and ColorPosManager. The frames
+are copied to a ring buffer in the shared memory, and the results of the color
+recognition are sent back by a queue, so the recognition doesn't hold the GIL
+of the main process.
+
+Usage:
+```
+camera = VisionProcess(functools.partial(WebCamera, src = 0, width = 1080, \
+	height = 720), fps = 30)
+color_pos_manager = ProcessColorPosManager(camera, fps = 30)
+camera.start_camera_thread()
+```
+The main module has to be importable without side effects, because the
+worker process is spawned.
+"""
+
+import logging
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+from queue import Empty
+from threading import Lock, Thread
+
+from color_position_finder import ColorPositionFinder, ColorPosManager
+from color_type import *
+from frame_pipeline import FramePipeline
+from frame_source import FrameSource
+from point import Point2D
+from util.function_delegate import FunctionDelegate
+from util.job_thread import JobThread
+
+# The size of the header of the shared memory. It stores the sequence number
+# of the latest frame in int64.
+_HEADER_SIZE = 8
+# The commands of ColorPosManager that can be run in the worker process
+_WORKER_COMMANDS = ("set_color", "set_roi", "clear_roi", \
+	"start_recognition", "stop_recognition")
+# The frames fed from the main process are recognized with the sequence
+# number _FED_FRAME_SEQ_BASE - (the sequence number in the shared memory),
+# so they never collide with the frames of the camera
+_FED_FRAME_SEQ_BASE = -2
+
+class _VisionWorker:
+	"""The job of the worker process
+
+	The frames are numbered by the worker camera in the ColorPosManager, but
+	by _frame_seq in the shared memory. The results are sent with the sequence
+	number in the shared memory, so the main process sees only one sequence.
+
+	@var _camera The frame source created in the worker process
+	@var _color_pos_manager The ColorPosManager recognizing the frames
+	@var _command_queue The queue of (command, args) from the main process
+	@var _result_queue The queue of the messages to the main process
+	@var _shared_memory The SharedMemory of the header and the frame ring
+	@var _latest_seq The int64 array of the header
+	@var _frame_ring The array of the frames in the shared memory
+	@var _frame_seq The sequence number of the latest frame in the shared memory
+	@var _frame_lock The lock for writing a frame to the shared memory
+	@var _seq_map A dictionary of the sequence number of the camera-the
+	     sequence number in the shared memory pairs of the recent frames
+	@var _seq_map_lock The lock of _seq_map
+	@var _threads The JobThreads publishing the frames and the results
+	"""
+
+	def __init__(self, source_factory, fps, ring_size, command_queue, result_queue):
+		self._logger = logging.getLogger(self.__class__.__name__)
+		self._camera = source_factory()
+		self._command_queue = command_queue
+		self._result_queue = result_queue
+		self._shared_memory = None
+		self._latest_seq = None
+		self._frame_ring = None
+		self._frame_seq = -1
+		self._frame_lock = Lock()
+		self._seq_map = {}
+		self._seq_map_lock = Lock()
+		self._threads = []
+
+		frame = self._camera.frame
+		if frame is None:
+			self._logger.error("The frame source provides no frame.")
+			return
+
+		self._shared_memory = shared_memory.SharedMemory(create = True, \
+			size = _HEADER_SIZE + ring_size * frame.nbytes)
+		self._latest_seq = np.ndarray((1,), dtype = np.int64, \
+			buffer = self._shared_memory.buf)
+		self._latest_seq[0] = -1
+		self._frame_ring = np.ndarray((ring_size,) + frame.shape, dtype = np.uint8, \
+			buffer = self._shared_memory.buf, offset = _HEADER_SIZE)
+
+		self._color_pos_manager = ColorPosManager(self._camera, fps)
+		self._threads.append(JobThread(self._publish_frame, "PublishFrame", \
+			1.0 / fps, fixed_rate = True, trigger = self._camera.create_frame_trigger()))
+		for finder_type in (PosFinderType.CAR_TEAM_A, PosFinderType.CAR_TEAM_B):
+			finder = self._color_pos_manager.get_finder(finder_type)
+			self._threads.append(JobThread( \
+				lambda finder_type = finder_type: self._publish_result(finder_type), \
+				"PublishResult_{0}".format(finder_type.name), \
+				trigger = finder.create_result_trigger()))
+
+	def run(self):
+		"""Run the commands from the main process until "stop" is received
+		"""
+		if self._shared_memory is None:
+			self._result_queue.put(("stopped",))
+			return
+
+		self._result_queue.put(("shared_memory", self._shared_memory.name, \
+			self._frame_ring.shape[1:], self._frame_ring.shape[0]))
+		self._camera.start_camera_thread()
+		for thread in self._threads:
+			thread.start()
+
+		while True:
+			command, args = self._command_queue.get()
+			if command == "stop":
+				break
+			if command == "process_frame":
+				self._process_frame(*args)
+				continue
+			if command not in _WORKER_COMMANDS:
+				self._logger.error("Unknown command {0}. Discard.".format(command))
+				continue
+			getattr(self._color_pos_manager, command)(*args)
+
+		self._color_pos_manager.stop_recognition()
+		for thread in self._threads:
+			thread.stop()
+		self._camera.stop_camera_thread()
+		self._camera.release_camera()
+
+		# The views of the shared memory have to be released before closing it
+		self._latest_seq = None
+		self._frame_ring = None
+		self._shared_memory.close()
+		self._shared_memory.unlink()
+		self._result_queue.put(("stopped",))
+
+	def _publish_frame(self):
+		"""Copy the latest frame to the next slot of the frame ring
+
+		The slot of the frame next to the latest one may be being overwritten,
+		which is the same as FrameSource.
+		"""
+		frame_seq, frame = self._camera.borrow_frame()
+		if frame is None:
+			return
+
+		with self._frame_lock:
+			slot = (self._frame_seq + 1) % len(self._frame_ring)
+			np.copyto(self._frame_ring[slot], frame)
+			if not self._camera.is_frame_valid(frame_seq):
+				return
+			shared_seq = self._commit_frame()
+
+		with self._seq_map_lock:
+			self._seq_map[frame_seq] = shared_seq
+			# Only the results of the recent frames are waited for
+			while len(self._seq_map) > 2 * len(self._frame_ring):
+				del self._seq_map[next(iter(self._seq_map))]
+
+	def _process_frame(self, frame_seq, frame):
+		"""Copy the frame from the main process to the frame ring and recognize it
+
+		@param frame_seq The sequence number given by the main process, which
+		       is replaced by the sequence number in the shared memory
+		@param frame The frame in BGR domain
+		"""
+		if frame.shape != self._frame_ring.shape[1:]:
+			self._logger.error("The size of the frame {0} is different from " \
+				"the camera {1}. Discard.".format(frame.shape, self._frame_ring.shape[1:]))
+			return
+
+		with self._frame_lock:
+			slot = (self._frame_seq + 1) % len(self._frame_ring)
+			np.copyto(self._frame_ring[slot], frame)
+			shared_seq = self._commit_frame()
+
+		self._color_pos_manager.process_frame(_FED_FRAME_SEQ_BASE - shared_seq, frame)
+
+	def _commit_frame(self) -> int:
+		"""Publish the frame written to the next slot of the frame ring
+
+		It is invoked with _frame_lock held.
+
+		@return The sequence number of the frame in the shared memory
+		"""
+		self._frame_seq += 1
+		self._latest_seq[0] = self._frame_seq
+		self._result_queue.put(("frame", self._frame_seq))
+		return self._frame_seq
+
+	def _to_shared_seq(self, frame_seq) -> int:
+		"""Convert the sequence number of the result into the one in the shared memory
+
+		@param frame_seq The sequence number of the frame recognized
+		@return The sequence number in the shared memory. None if the frame
+		        is not in the shared memory.
+		"""
+		if frame_seq <= _FED_FRAME_SEQ_BASE:
+			return _FED_FRAME_SEQ_BASE - frame_seq
+		with self._seq_map_lock:
+			return self._seq_map.get(frame_seq)
+
+	def _publish_result(self, finder_type: PosFinderType):
+		"""Send the latest result of the ColorPositionFinder to the main process
+
+		The result of the frame not copied to the shared memory is discarded,
+		because the main process cannot match it to a frame.
+		"""
+		finder = self._color_pos_manager.get_finder(finder_type)
+		frame_seq = self._to_shared_seq(finder.get_result_frame_seq())
+		if frame_seq is None:
+			self._logger.debug("The result of finder {0} is not of a frame in " \
+				"the shared memory. Discard.".format(finder_type.name))
+			return
+		colors = finder.get_all_target_colors()
+		self._result_queue.put(("result", finder_type, frame_seq, \
+			[color.color_bgr for color in colors], \
+			[color.pixel_position for color in colors]))
+
+def _run_vision_worker(source_factory, fps, ring_size, command_queue, result_queue):
+	"""The target function of the worker process
+	"""
+	_VisionWorker(source_factory, fps, ring_size, command_queue, result_queue).run()
+
+class VisionProcess(FrameSource):
+	"""The frame source whose frames are captured in the worker process
+
+	The worker process is started by VisionProcess.start_camera_thread and
+	stopped by VisionProcess.stop_camera_thread. The frames are borrowed from
+	the ring buffer in the shared memory, and the sequence number of the
+	frames is counted by the worker process.
+
+	@var on_result The FunctionDelegate invoked with (finder_type, frame_seq,
+	     colors_bgr, pixel_positions) in the receiver thread when the result
+	     of a ColorPositionFinder in the worker process arrives
+	@var _source_factory The picklable callable creating the frame source in
+	     the worker process, such as functools.partial(WebCamera, src = 0)
+	@var _fps The processing rate of the frames
+	@var _worker_ring_size The number of the frames in the shared memory
+	@var _command_queue The queue of (command, args) to the worker process
+	@var _result_queue The queue of the messages from the worker process
+	@var _process The worker process
+	@var _receiver_thread The thread handling the messages from the worker process
+	@var _shared_memory The SharedMemory attached
+	@var _latest_seq The int64 array of the header of the shared memory
+	"""
+
+	def __init__(self, source_factory, fps = 30, ring_size = 4):
+		"""Constructor
+
+		@param source_factory Specify the picklable callable creating the
+		       frame source in the worker process
+		@param fps Specify the processing rate of the frames
+		@param ring_size Specify the number of frames in the shared memory.
+		       It should be at least 3.
+		"""
+		super().__init__(ring_size)
+		self.on_result = FunctionDelegate()
+		self._source_factory = source_factory
+		self._fps = fps
+		self._worker_ring_size = max(ring_size, 3)
+
+		context = multiprocessing.get_context("spawn")
+		self._context = context
+		self._command_queue = context.Queue()
+		self._result_queue = context.Queue()
+		self._process = None
+		self._receiver_thread = None
+		self._shared_memory = None
+		self._latest_seq = None
+
+	def send_command(self, command, *args):
+		"""Run the method of the ColorPosManager in the worker process
+
+		The commands sent before the worker process starts are run after
+		it starts.
+
+		@param command Specify the name of the method
+		@param args Specify the arguments of the method
+		"""
+		self._command_queue.put((command, args))
+
+	def start_camera_thread(self):
+		"""Start the worker process and the receiver thread
+		"""
+		if self.is_thread_started:
+			self._logger.info("The worker process has been started.")
+			return
+
+		self._logger.debug("The worker process is starting.")
+
+		self._process = self._context.Process(target = _run_vision_worker, \
+			args = (self._source_factory, self._fps, self._worker_ring_size, \
+				self._command_queue, self._result_queue), \
+			name = "VisionWorker", daemon = True)
+		self._receiver_thread = Thread(target = self._receive_messages, \
+			name = "VisionReceiver")
+		self.is_thread_started = True
+		self._process.start()
+		self._receiver_thread.start()
+
+	def stop_camera_thread(self):
+		"""Stop the worker process and the receiver thread
+		"""
+		if self._process is None or not self._process.is_alive():
+			self.is_thread_started = False
+			return
+
+		self._logger.debug("The worker process is stopping.")
+
+		self.send_command("stop")
+		self._receiver_thread.join()
+		self._process.join()
+		self.is_thread_started = False
+
+	def release_camera(self):
+		"""Detach the shared memory
+
+		The shared memory is removed by the worker process, or by the receiver
+		thread if the worker process exits unexpectedly.
+		"""
+		self.read_lock.acquire()
+		self.frame = None
+		self._frame_ring = [None] * self._worker_ring_size
+		self._latest_seq = None
+		self.read_lock.release()
+
+		if self._shared_memory is not None:
+			self._shared_memory.close()
+			self._shared_memory = None
+		self._logger.debug("Shared memory released.")
+
+	def is_frame_valid(self, frame_seq) -> bool:
+		"""Is the frame borrowed still intact in the shared memory?
+
+		The sequence number of the latest frame is read from the shared memory,
+		because the worker process may be ahead of the receiver thread.
+		"""
+		latest_seq = self._latest_seq
+		if latest_seq is None:
+			return False
+		return 0 <= int(latest_seq[0]) - frame_seq <= len(self._frame_ring) - 2
+
+	def _receive_messages(self):
+		"""Handle the messages from the worker process until it is stopped
+
+		The target method of the receiver thread. It also stops if the worker
+		process exits unexpectedly.
+		"""
+		self._logger.debug("The receiver thread is started.")
+
+		while True:
+			try:
+				message = self._result_queue.get(timeout = 0.5)
+			except Empty:
+				if not self._process.is_alive():
+					self._logger.error("The worker process exits unexpectedly.")
+					self._unlink_shared_memory()
+					break
+				continue
+
+			if message[0] == "frame":
+				self._update_frame(message[1])
+			elif message[0] == "result":
+				self.on_result.invoke(*message[1:])
+			elif message[0] == "shared_memory":
+				self._attach_shared_memory(*message[1:])
+			elif message[0] == "stopped":
+				break
+
+		self._logger.debug("The receiver thread is stopped.")
+
+	def _unlink_shared_memory(self):
+		"""Remove the shared memory left by the worker process exited unexpectedly
+
+		The shared memory is still attached until VisionProcess.release_camera.
+		"""
+		if self._shared_memory is None:
+			return
+		try:
+			self._shared_memory.unlink()
+			self._logger.debug("Shared memory removed.")
+		except FileNotFoundError:
+			# The worker process has removed it
+			pass
+
+	def _attach_shared_memory(self, name, frame_shape, ring_size):
+		self._shared_memory = shared_memory.SharedMemory(name = name)
+		frame_ring = np.ndarray((ring_size,) + tuple(frame_shape), dtype = np.uint8, \
+			buffer = self._shared_memory.buf, offset = _HEADER_SIZE)
+
+		self.read_lock.acquire()
+		self._latest_seq = np.ndarray((1,), dtype = np.int64, \
+			buffer = self._shared_memory.buf)
+		self._frame_ring = [frame_ring[i] for i in range(ring_size)]
+		self.read_lock.release()
+
+		self._logger.debug("Shared memory attached. Frame: {0}.".format(frame_shape))
+
+	def _update_frame(self, frame_seq):
+		self.read_lock.acquire()
+		self.isCaptured = True
+		self.frame = self._frame_ring[frame_seq % len(self._frame_ring)]
+		self._frame_seq = frame_seq
+		self.read_lock.release()
+
+		self._new_frame_signal.publish()
+
+class ProcessColorPositionFinder(ColorPositionFinder):
+	"""The ColorPositionFinder whose colors are found in the worker process
+
+	It keeps the target colors and publishes the results from the worker
+	process, so the MazePositionFinder uses it as the ColorPositionFinder.
+	"""
+
+	def __init__(self, finder_name, frame_pipeline: FramePipeline):
+		"""Constructor
+
+		@param finder_name The name of the finder
+		@param frame_pipeline Specify the FramePipeline of the ColorPosManager,
+		       which is never consumed by this finder
+		"""
+		super().__init__(finder_name, None, frame_pipeline = frame_pipeline, \
+			tracking = False)
+
+	def start_recognition(self):
+		self._is_recognition_started = True
+
+	def stop_recognition(self):
+		self._is_recognition_started = False
+
+	def apply_result(self, frame_seq, colors_bgr, pixel_positions):
+		"""Publish the result from the worker process
+
+		The result is discarded if the recognition is stopped or the target
+		colors are changed after the result is made.
+
+		@param frame_seq The sequence number of the frame in the worker process
+		@param colors_bgr The target colors of the result
+		@param pixel_positions A list whose i-th element is a list of
+		       positions in pixel of the i-th color in colors_bgr
+		"""
+		if not self._is_recognition_started or \
+			colors_bgr != [color.color_bgr for color in self._colors_to_find]:
+			return
+		self._publish_result(frame_seq, pixel_positions)
+
+class ProcessColorPosManager(ColorPosManager):
+	"""The ColorPosManager whose recognition is run in the worker process
+
+	The methods are forwarded to the ColorPosManager in the worker process
+	of the VisionProcess, and the results are published by the
+	ProcessColorPositionFinders. The frame pipeline of the VisionProcess
+	stays idle, because no finder consumes it.
+
+	@var _vision_process The VisionProcess
+	"""
+
+	def __init__(self, vision_process: VisionProcess, fps = 30):
+		"""Constructor
+
+		@param vision_process Specify the VisionProcess
+		@param fps Specify the updating rate of the car position
+		"""
+		self._vision_process = vision_process
+		super().__init__(vision_process, fps)
+		vision_process.on_result += self._apply_result
+
+	def _create_finder(self, finder_name, fps) -> ColorPositionFinder:
+		return ProcessColorPositionFinder(finder_name, self._frame_pipeline)
+
+	def process_frame(self, frame_seq, frame):
+		"""Send the frame to the worker process to find the colors in it
+
+		The frame is also copied to the shared memory, and the result is
+		published with its sequence number there instead of frame_seq.
+		"""
+		self._vision_process.send_command("process_frame", frame_seq, frame)
+
+	def set_roi(self, top_left: Point2D, bottom_right: Point2D):
+		self._vision_process.send_command("set_roi", top_left, bottom_right)
+
+	def clear_roi(self):
+		self._vision_process.send_command("clear_roi")
+
+	def set_color(self, color_bgr, old_type: ColorType, new_type: ColorType):
+		super().set_color(color_bgr, old_type, new_type)
+		self._vision_process.send_command("set_color", list(color_bgr), \
+			old_type, new_type)
+
+	def start_recognition(self):
+		super().start_recognition()
+		self._vision_process.send_command("start_recognition")
+
+	def stop_recognition(self):
+		super().stop_recognition()
+		self._vision_process.send_command("stop_recognition")
+
+	def _apply_result(self, finder_type, frame_seq, colors_bgr, pixel_positions):
+		self._color_pos_finders[finder_type].apply_result( \
+			frame_seq, colors_bgr, pixel_positions)
@@ -8,7 +8,7 @@ from color_position_finder import *
 from util.number_entry import *
 from maze_manager import MazeManager
 from config_manager import ConfigManager
-from webcam import WebCamera
+from frame_source import FrameSource
 
 from threading import Thread
 from tkinter import *
@@ -233,14 +233,14 @@ class ColorManagerWidget(LabelFrame):
 	     gathering the information of the maze
 	"""
 
-	def __init__(self, master, camera: WebCamera, \
+	def __init__(self, master, camera: FrameSource, \
 		config_manager: ConfigManager, \
 		color_pos_manager: ColorPosManager, \
 		maze_manager: MazeManager, **options):
 		"""Constructor
 
 		@param master The parent widget of the ColorManagerWidget
-		@param camera The WebCamera object
+		@param camera The FrameSource object, such as WebCamera
 		@param config_manager The instance of class ConfigManager
 		@param color_pos_manager The instance of class ColorPosManager
 		@param maze_manager The instance of class MazeManager